@@ -0,0 +1,227 @@
+"""
+Description: migrate many dumps on one host at the same time
+- every dump is migrated by its own "invoke migrate" process in its own directory, so with its own compose project
+  and volumes, and with free host ports for mysql, postgres and dotcms
+- a job's memory and cpus are sized from its dump (job_resources()); the job's servers, batches and container limits
+  are sized to that share (migrate --memory-mb/--cpus, tuning.budget) instead of the whole host
+- jobs start largest first while the running jobs fit under the memory, cpu and job caps, smaller jobs fill the gaps;
+  a job larger than the caps runs alone
+- each job writes its own migration-report.json, the jobs' status and phase times are combined in batch-report.json
+"""
+
+import glob
+import json
+import re
+import shlex
+import socket
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from tempfile import mkdtemp
+from time import perf_counter, sleep
+
+import rich
+from rich.table import Table
+
+import migrate_db, readiness, report, tuning
+
+batch_report_file_name = "batch-report.json"
+log_file_name = "migrate.log"
+poll_every = 5 # seconds between checks of the running jobs
+# mysql, postgres, pgloader, opensearch and dotcms of the smallest dump
+job_base_memory = 6 * tuning.gigabyte
+# dump bytes per extra cpu, up to job_max_cpus
+job_bytes_per_cpu = 4 * tuning.gigabyte
+job_min_cpus = 2
+job_max_cpus = 8
+
+
+def expand_dumps(dumps):
+    """ comma separated paths and glob patterns -> absolute paths, in order, each once """
+    paths = []
+    for pattern in dumps.split(","):
+        pattern = pattern.strip()
+        if pattern:
+            paths += sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+    return list(dict.fromkeys(str(Path(path).resolve()) for path in paths))
+
+
+def job_resources(dump_bytes, max_memory, max_cpus):
+    """
+    (memory bytes, cpus) for a dump of dump_bytes (uncompressed): the bulk profile gives mysql a quarter and postgres
+    an eighth of the memory, so half the dump size on top of the base keeps a good part of the data in their buffers
+    """
+    memory = job_base_memory + dump_bytes // 2
+    cpus = job_min_cpus + dump_bytes // job_bytes_per_cpu
+    return min(memory, max_memory), max(1, min(cpus, job_max_cpus, max_cpus))
+
+
+def free_port(taken):
+    """ a host port nothing listens on and no other job of the batch got """
+    while True:
+        with socket.socket() as s:
+            s.bind(("", 0))
+            port = s.getsockname()[1]
+        if port not in taken:
+            taken.add(port)
+            return port
+
+
+def plan_jobs(dumps, batch_dir, max_memory, max_cpus):
+    """ one job per dump: its directory, ports and resources, largest dump first """
+    taken = set()
+    jobs = []
+    for number, dump in enumerate(dumps, 1):
+        dump_bytes = readiness.dump_size(dump)
+        memory, cpus = job_resources(dump_bytes, max_memory, max_cpus)
+        # compose names the project after the directory, the volume names start with it too
+        stem = re.sub(r"(\.sql)?(\.gz)?$", "", Path(dump).name.lower())
+        stem = re.sub(r"[^a-z0-9]+", "_", stem).strip("_") or "dump"
+        jobs.append({
+            "name": f"{number}-{stem}",
+            "dump": dump,
+            "dump_bytes": dump_bytes,
+            "memory": memory,
+            "cpus": cpus,
+            "directory": mkdtemp(prefix=f"dotcms_migrate_{stem}_", dir=batch_dir),
+            "ports": {service: free_port(taken) for service in ("mysql", "postgres", "dotcms")},
+            "status": "queued",
+            "seconds": None,
+            "exit_code": None,
+        })
+    return sorted(jobs, key=lambda job: job["dump_bytes"], reverse=True)
+
+
+def job_command(job, options=""):
+    """ the invoke migrate command line of a job, options are passed on to every job """
+    return [
+        sys.executable, "-m", "invoke", "migrate", job["dump"],
+        f"--directory={job['directory']}",
+        f"--mysql-port={job['ports']['mysql']}",
+        f"--postgres-port={job['ports']['postgres']}",
+        f"--dotcms-port={job['ports']['dotcms']}",
+        f"--memory-mb={job['memory'] // tuning.megabyte}",
+        f"--cpus={job['cpus']}",
+        *shlex.split(options),
+    ]
+
+
+def run_batch(jobs, batch_dir, max_memory, max_cpus, max_jobs=0, options=""):
+    """ run the jobs under the caps, returns them with their status, seconds and phase times """
+    started = perf_counter()
+    batch = {
+        "started": datetime.now(timezone.utc).isoformat(),
+        "max_memory": max_memory,
+        "max_cpus": max_cpus,
+        "max_jobs": max_jobs,
+        "options": options,
+    }
+    running = {} # Popen: (job, started)
+    print_status(jobs)
+    while any(job["status"] in ("queued", "running") for job in jobs):
+        for job in jobs:
+            if job["status"] != "queued":
+                continue
+            if max_jobs and len(running) >= max_jobs:
+                break
+            used_memory = sum(running_job["memory"] for running_job, _ in running.values())
+            used_cpus = sum(running_job["cpus"] for running_job, _ in running.values())
+            if running and (used_memory + job["memory"] > max_memory or used_cpus + job["cpus"] > max_cpus):
+                continue
+            with open(Path(job["directory"]) / log_file_name, "w") as log:
+                process = subprocess.Popen(
+                    job_command(job, options),
+                    cwd=Path(__file__).resolve().parent,
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                )
+            running[process] = (job, perf_counter())
+            job["status"] = "running"
+            rich.print(f":arrow_forward:  {job['name']}: started, {job['memory'] // tuning.megabyte:,} MB, {job['cpus']} cpus, "
+                       f"log {Path(job['directory']) / log_file_name}")
+        sleep(poll_every)
+        for process, (job, job_started) in list(running.items()):
+            if process.poll() is None:
+                continue
+            del running[process]
+            job["seconds"] = perf_counter() - job_started
+            job["exit_code"] = process.returncode
+            run_report = read_report(job)
+            job["phases"] = [
+                {"name": phase["name"], "status": phase["status"], "seconds": phase["seconds"]}
+                for phase in run_report.get("phases", [])
+            ]
+            # a failed migrate exits 1 with its run report saying so, a job killed before writing the report fails too
+            job["status"] = "ok" if process.returncode == 0 and run_report.get("run", {}).get("status") == "ok" else "failed"
+            if job["status"] == "ok":
+                migrate_db.success_msg(f"{job['name']}: done in {job['seconds'] / 60:.1f} minutes")
+            else:
+                migrate_db.fail_msg(f"{job['name']}: failed after {job['seconds'] / 60:.1f} minutes, "
+                                    f"continue it with: invoke migrate {job['dump']} --resume={job['directory']}")
+            print_status(jobs)
+    batch["seconds"] = perf_counter() - started
+    write_report(batch, jobs, batch_dir)
+    print_report(batch, jobs)
+    return jobs
+
+
+def read_report(job):
+    try:
+        with open(Path(job["directory"]) / report.report_file_name) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_report(batch, jobs, batch_dir):
+    path = Path(batch_dir) / batch_report_file_name
+    with open(path, "w") as f:
+        json.dump({"batch": batch, "jobs": jobs}, f, indent=2, default=str)
+    rich.print(f":page_facing_up: batch report: {path}")
+
+
+def print_status(jobs):
+    table = Table(title="migration jobs")
+    table.add_column("job")
+    table.add_column("dump MB", justify="right")
+    table.add_column("memory MB", justify="right")
+    table.add_column("cpus", justify="right")
+    table.add_column("ports mysql/postgres/dotcms")
+    table.add_column("status")
+    colors = {"queued": "dim", "running": "yellow", "ok": "green", "failed": "red"}
+    for job in jobs:
+        table.add_row(
+            job["name"],
+            f"{job['dump_bytes'] / tuning.megabyte:,.0f}",
+            f"{job['memory'] / tuning.megabyte:,.0f}",
+            str(job["cpus"]),
+            "/".join(str(job["ports"][service]) for service in ("mysql", "postgres", "dotcms")),
+            f"[{colors[job['status']]}]{job['status']}",
+        )
+    rich.print(table)
+
+
+def print_report(batch, jobs):
+    """ minutes per job and its three slowest phases, and the time the jobs would have taken one after the other """
+    table = Table(title=f"migration batch, {batch['seconds'] / 60:.1f} minutes")
+    table.add_column("job")
+    table.add_column("status")
+    table.add_column("minutes", justify="right")
+    table.add_column("slowest phases")
+    for job in jobs:
+        phases = sorted(job.get("phases", []), key=lambda phase: phase["seconds"], reverse=True)[:3]
+        table.add_row(
+            job["name"],
+            job["status"] if job["status"] == "ok" else f"[red]{job['status']}",
+            f"{job['seconds'] / 60:.1f}" if job["seconds"] is not None else "-",
+            ", ".join(f"{phase['name']} {phase['seconds'] / 60:.1f}m" for phase in phases),
+        )
+    rich.print(table)
+    serial = sum(job["seconds"] or 0 for job in jobs)
+    failed = [job["name"] for job in jobs if job["status"] != "ok"]
+    if failed:
+        migrate_db.fail_msg(f"{len(failed)} of {len(jobs)} jobs failed: {', '.join(failed)}")
+    else:
+        migrate_db.success_msg(f"{len(jobs)} dumps migrated in {batch['seconds'] / 60:.1f} minutes, "
+                               f"{serial / 60:.1f} minutes one after the other")
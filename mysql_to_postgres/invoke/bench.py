@@ -0,0 +1,132 @@
+"""
+Description: scaling benchmark for the python side of the migration
+- generates dotcms shaped dumps at several sizes (synthesize.py)
+- times preprocessing, indexing, the parallel mysql import (given a mysql client command)
+  and the native converter plus postgres_post_import (given a postgres session) at each size
+- the converter stages rename and drop schemas, so they only run in a database bench created itself
+  or one named a scratch database; either carries scratch_comment afterwards
+- writes bench-results.json and prints rows/s per stage and size, to compare releases and hosts
+"""
+
+import json
+import os
+from pathlib import Path
+from time import perf_counter
+
+import rich
+from rich.table import Table
+
+import convert, migrate_db, mysqldump, synthesize
+from session import MigrationSession
+
+results_file_name = "bench-results.json"
+scratch_db = "dotcms_bench"
+# COMMENT ON DATABASE of the databases bench may empty
+scratch_comment = "scratch database of invoke benchmark"
+
+
+def prepare_scratch_db(session, scratch=False):
+    """
+    create the session's postgres database when it doesn't exist, True when bench may rename and drop its schemas:
+    it carries scratch_comment, or scratch says it is a scratch database and it gets the comment now
+    """
+    admin = MigrationSession(
+        username=session.username,
+        password=session.password,
+        db="postgres",
+        postgres_host=session.postgres_host,
+        postgres_port=session.postgres_port,
+    )
+    try:
+        rows = admin.execute(
+            "postgres", "SELECT shobj_description(oid, 'pg_database') FROM pg_database WHERE datname = %s", (session.db,), fetch=True,
+        )
+        if not rows:
+            # CREATE DATABASE can't run inside a transaction
+            admin.execute_all("postgres", [f'CREATE DATABASE "{session.db}";'], autocommit=True)
+            rich.print(f":new: created the scratch database {session.db}")
+        elif rows[0][0] != scratch_comment and not scratch:
+            return False
+        admin.execute_all("postgres", [f"COMMENT ON DATABASE \"{session.db}\" IS '{scratch_comment}';"], autocommit=True)
+    finally:
+        admin.close()
+    return True
+
+
+def _stage(results, size, stage, run, rows, nbytes):
+    started = perf_counter()
+    value = run()
+    seconds = perf_counter() - started
+    results.append(_rates({"contentlets": size, "stage": stage, "seconds": seconds, "rows": rows, "bytes": nbytes}))
+    rich.print(f"   {stage}: {seconds:.1f}s")
+    return value
+
+
+def _rates(result):
+    seconds = result["seconds"]
+    result["rows_per_second"] = result["rows"] / seconds if seconds else None
+    result["mb_per_second"] = result["bytes"] / 1024 / 1024 / seconds if seconds else None
+    return result
+
+
+def run_benchmark(sizes, workdir, session=None, mysql_command=None, workers=None, versions=1, history=2, keep_dumps=False):
+    """
+    sizes: contentlet counts, e.g. [10000, 100000, 1000000]
+    session: MigrationSession of a scratch postgres to run the native converter against, or None to skip it
+    mysql_command: mysql client reading SQL from stdin for a scratch db, or None to skip the mysql import
+    """
+    workdir = Path(workdir)
+    synthesizer = synthesize.Synthesizer()
+    results = []
+    for size in sizes:
+        print("---------------------------------------------------")
+        rich.print(f":stopwatch:  benchmark with {size:,} contentlets")
+        dump_file = workdir / f"bench-{size}.sql"
+        preprocessed_file = workdir / f"bench-{size}-preprocessed.sql"
+        _stage(results, size, "generate", lambda: synthesizer.write(dump_file, size, versions, history), 0, 0)
+        nbytes = dump_file.stat().st_size
+        rows = sum(mysqldump.row_targets(dump_file).values())
+        results[-1].update(rows=rows, bytes=nbytes)
+        _rates(results[-1])
+        _stage(results, size, "preprocess", lambda: mysqldump.preprocess_dump(dump_file, preprocessed_file), rows, nbytes)
+        nbytes = preprocessed_file.stat().st_size
+        _stage(results, size, "index", lambda: mysqldump.index_dump(preprocessed_file), rows, nbytes)
+        if mysql_command:
+            _stage(
+                results, size, "mysql_import",
+                lambda: mysqldump.import_parallel(str(preprocessed_file), mysql_command, workers=workers or 4),
+                rows, nbytes,
+            )
+        if session:
+            _stage(
+                results, size, "native_convert",
+                lambda: convert.load_dump(str(preprocessed_file), session.postgres_dsn, schema=session.db, workers=workers),
+                rows, nbytes,
+            )
+            # postgres_post_import renames public to public_old, drop the previous size's copy
+            session.execute("postgres", "DROP SCHEMA IF EXISTS public_old CASCADE;")
+            _stage(results, size, "postgres_post_import", lambda: migrate_db.postgres_post_import(session), rows, 0)
+        if not keep_dumps:
+            os.remove(dump_file)
+            os.remove(preprocessed_file)
+    path = workdir / results_file_name
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print_results(results, sizes)
+    rich.print(f":page_facing_up: benchmark results: {path}")
+    return results
+
+
+def print_results(results, sizes):
+    table = Table(title="rows/s by stage and contentlet count")
+    table.add_column("stage")
+    for size in sizes:
+        table.add_column(f"{size:,}", justify="right")
+    stages = list(dict.fromkeys(result["stage"] for result in results))
+    for stage in stages:
+        by_size = {result["contentlets"]: result for result in results if result["stage"] == stage}
+        table.add_row(stage, *(
+            f"{by_size[size]['rows_per_second']:,.0f}" if by_size.get(size, {}).get("rows_per_second") else "-"
+            for size in sizes
+        ))
+    rich.print(table)
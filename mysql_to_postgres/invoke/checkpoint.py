@@ -0,0 +1,166 @@
+"""
+Description: checkpoints of a migrate run, so a failed run can continue where it stopped
+- tasks.migrate is a list of named stages (the run report phases); each completed stage is saved to
+  migration-state.json in the workdir with an output marker, e.g. the contentlet rows in mysql after the import
+- migrate --resume=<workdir> runs in the same workdir, so the same compose project and docker volumes, which stop_docker keeps;
+  a completed stage is skipped while its marker reads the same as when it completed, the first stage that runs again
+  drops itself and the stages after it from the state
+- the options that decide what the stages produce must match the first run, the others (timeouts, workers) may change
+"""
+
+import json
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import rich
+
+import migrate_db
+
+state_file_name = "migration-state.json"
+# a resumed run must use the same values for these
+data_options = ("mysqldump_file", "converter", "preprocess", "target_dsn", "defer_indexes")
+
+
+def mysql_contentlets(session):
+    return int(session.execute("mysql", "SELECT COUNT(*) FROM contentlet", fetch=True)[0][0])
+
+
+def mysql_pending_alters(session):
+    """ ALTER TABLE statements mysql_post_import would still run, 0 after it ran """
+    plan = migrate_db.mysql_post_import_plan(session)
+    return sum(query.startswith("ALTER TABLE") for queries in plan.values() for query in queries)
+
+
+def mysql_db_version(session):
+    """ the last dotcms upgrade task, dotcms on mysql runs them """
+    return int(session.execute("mysql", "SELECT MAX(db_version) FROM db_version", fetch=True)[0][0])
+
+
+def postgres_contentlets(session):
+    # the converters load into the db schema, postgres_post_import renames it to public; the count reads the same in both
+    schema = session.execute(
+        "postgres", "SELECT CASE WHEN to_regnamespace(%s) IS NULL THEN 'public' ELSE %s END", (session.db, session.db), fetch=True,
+    )[0][0]
+    return int(session.execute("postgres", f'SELECT COUNT(*) FROM "{schema}".contentlet', fetch=True)[0][0])
+
+
+def postgres_indexes(session):
+    return int(session.execute(
+        "postgres", "SELECT COUNT(*) FROM pg_indexes WHERE schemaname IN (%s, 'public')", (session.db,), fetch=True,
+    )[0][0])
+
+
+def postgres_renamed(session):
+    return bool(session.execute(
+        "postgres",
+        "SELECT to_regclass('public.contentlet') IS NOT NULL AND to_regnamespace(%s) IS NULL",
+        (session.db,),
+        fetch=True,
+    )[0][0])
+
+
+def file_marker(path):
+    """ marker of a stage writing a file or directory: its size in bytes """
+    path = Path(path)
+    def marker(session):
+        if path.is_dir():
+            return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+        return path.stat().st_size if path.exists() else None
+    return marker
+
+
+class Checkpoint:
+    def __init__(self, workdir, session, run_report, markers=None):
+        self.path = Path(workdir) / state_file_name
+        self.session = session
+        self.run_report = run_report
+        # {stage: marker(session)}, stages without a marker are trusted once completed
+        self.markers = markers or {}
+        self.state = {"options": {}, "stages": []}
+        # True until the first stage that runs again
+        self.resuming = False
+        self.skipped = []
+
+    def start(self, options):
+        """ a new run with these options """
+        self.state = {"options": options, "stages": []}
+        self.save()
+
+    def resume(self, options):
+        """ continue the run saved in the workdir, returns the data options that differ from it """
+        with open(self.path) as f:
+            self.state = json.load(f)
+        self.resuming = True
+        differ = [
+            option for option in data_options
+            if option in self.state["options"] and self.state["options"][option] != options.get(option)
+        ]
+        if not differ:
+            self.state["options"].update(options)
+            rich.print(f":recycle:  resuming {self.path.parent}, completed: {', '.join(self.completed()) or 'nothing'}")
+        return differ
+
+    def completed(self):
+        return [stage["name"] for stage in self.state["stages"]]
+
+    def saved_stage(self, name):
+        """ {"name", "completed", "seconds", "marker"} of a stage the saved run completed, or None """
+        return next((stage for stage in self.state["stages"] if stage["name"] == name), None)
+
+    def skip(self, name):
+        """
+        True while resuming, when the stage completed in the saved run and its output marker reads the same;
+        otherwise the stage and everything after it runs again
+        """
+        if not self.resuming:
+            return False
+        saved = self.saved_stage(name)
+        if saved is not None and name in self.markers:
+            marker = self.marker(name)
+            # no marker saved: it could not be read when the stage completed
+            if saved["marker"] is None or marker != saved["marker"]:
+                migrate_db.fail_msg(f"{name}: output changed since it completed ({saved['marker']} -> {marker}), running it again")
+                saved = None
+        if saved is None:
+            self.state["stages"] = [stage for stage in self.state["stages"] if stage["name"] in self.skipped]
+            self.resuming = False
+            self.save()
+            return False
+        self.skipped.append(name)
+        self.run_report.skip_phase(name, saved)
+        rich.print(f":fast_forward: {name}: completed {saved['completed']}, skipped")
+        return True
+
+    @contextmanager
+    def stage(self, name):
+        """ a run report phase, saved as completed with its marker when it returns """
+        with self.run_report.phase(name) as details:
+            yield details
+        self.complete(name, self.run_report.phases[-1]["seconds"])
+
+    def marker(self, name):
+        """ the output marker of a stage now, None without one or when it can't be read """
+        if name not in self.markers:
+            return None
+        try:
+            return self.markers[name](self.session)
+        except Exception as e:
+            rich.print(f"   {name} marker: {e}")
+            return None
+
+    def complete(self, name, seconds):
+        marker = self.marker(name)
+        self.state["stages"] = [stage for stage in self.state["stages"] if stage["name"] != name]
+        self.state["stages"].append({
+            "name": name,
+            "completed": datetime.now(timezone.utc).isoformat(),
+            "seconds": seconds,
+            "marker": marker,
+        })
+        self.save()
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.state, f, indent=2, default=str)
+
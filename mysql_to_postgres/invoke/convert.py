@@ -0,0 +1,421 @@
+"""
+Description: native mysqldump -> postgres conversion, an alternative to mysql + pgloader
+- translate mysqldump CREATE TABLE statements to postgres DDL using pgloader's default casting rules
+- parse INSERT ... VALUES tuples as a stream and feed them to postgres with COPY FROM STDIN
+- one worker process per table, each with its own postgres connection
+Tables are created in a schema named like the mysql db ("dotcms"), the way pgloader does it,
+so migrate_db.postgres_post_import() works the same on either path.
+"""
+
+import binascii
+import io
+import multiprocessing
+import os
+import re
+from time import perf_counter
+
+import psycopg2
+import rich
+from rich.table import Table
+
+import migrate_db, mysqldump
+
+batch_bytes = 64 * 1024 * 1024 # flush a COPY every 64MB of converted rows
+
+column_re = re.compile(r"^\s*`([^`]+)`\s+(\w+)(?:\(([^)]*)\))?(.*?),?\s*$")
+default_re = re.compile(r"\bDEFAULT\s+('(?:[^'\\]|\\.|'')*'|b'[01]*'|\S+)", re.IGNORECASE)
+key_columns_re = re.compile(r"`([^`]+)`(?:\(\d+\))?")
+primary_key_re = re.compile(r"^\s*PRIMARY KEY \((.*)\)")
+index_re = re.compile(r"^\s*(UNIQUE )?KEY `([^`]+)` \((.*)\)")
+foreign_key_re = re.compile(
+    r"^\s*CONSTRAINT `([^`]+)` FOREIGN KEY \((.*?)\) REFERENCES `([^`]+)` \((.*?)\)(.*?),?\s*$"
+)
+insert_columns_re = re.compile(rb"^INSERT INTO `[^`]+` \(([^)]*)\) VALUES ")
+value_re = re.compile(
+    rb"""'((?:[^'\\]+|\\.|'')*)'       # 1: quoted string
+    |(NULL)                            # 2: null
+    |_binary\s*'((?:[^'\\]+|\\.|'')*)' # 3: binary string (mysqldump >= 8.0)
+    |0x([0-9A-Fa-f]*)                  # 4: hex literal (--hex-blob)
+    |b'([01]*)'                        # 5: bit literal
+    |([-+0-9.eE]+)                     # 6: number
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+unescape_re = re.compile(rb"\\(.)|''", re.DOTALL)
+mysql_escapes = {
+    b"0": b"\x00",
+    b"b": b"\x08",
+    b"n": b"\n",
+    b"r": b"\r",
+    b"t": b"\t",
+    b"Z": b"\x1a",
+}
+
+blob_types = ("binary", "varbinary", "tinyblob", "blob", "mediumblob", "longblob")
+# mysqldump leaves generated columns out of the INSERTs, pgloader copies their computed values
+generated_columns = {
+    ("identifier", "full_path_lc"):
+        "CASE WHEN parent_path = 'system folder' THEN '/' ELSE lower(parent_path || asset_name) END",
+}
+
+
+def postgres_type(mysql_type, args, extra):
+    """
+    pgloader's default mysql casting rules, returns (postgres type, value kind)
+    https://pgloader.readthedocs.io/en/latest/ref/mysql.html#default-mysql-casting-rules
+    """
+    extra = extra.lower()
+    unsigned = "unsigned" in extra
+    auto_increment = "auto_increment" in extra
+    precision = int(args.split(",")[0]) if args and args.split(",")[0].strip().isdigit() else None
+    if mysql_type == "tinyint" and precision == 1:
+        return "boolean", "bool"
+    if mysql_type == "bit" and precision in (None, 1):
+        return "boolean", "bool"
+    if mysql_type == "bit":
+        return f"bit varying({precision})", "bit"
+    if mysql_type in ("tinyint", "smallint"):
+        return ("integer" if unsigned else "smallint"), "number"
+    if mysql_type in ("mediumint", "int", "integer"):
+        if auto_increment:
+            return ("serial" if precision is not None and precision < 10 else "bigserial"), "number"
+        if precision is not None and precision < 10 and not unsigned:
+            return "integer", "number"
+        return "bigint", "number"
+    if mysql_type == "bigint":
+        if auto_increment:
+            return "bigserial", "number"
+        return ("numeric" if unsigned else "bigint"), "number"
+    if mysql_type in ("float", "double", "real"):
+        return "double precision", "number"
+    if mysql_type in ("decimal", "numeric"):
+        return (f"numeric({args})" if args else "numeric"), "number"
+    if mysql_type == "year":
+        return "integer", "number"
+    if mysql_type in ("datetime", "timestamp"):
+        return "timestamp with time zone", "date"
+    if mysql_type == "date":
+        return "date", "date"
+    if mysql_type == "time":
+        return "time without time zone", "text"
+    if mysql_type == "char":
+        return (f"character({args})" if args else "character"), "text"
+    if mysql_type == "varchar":
+        return (f"character varying({args})" if args else "text"), "text"
+    if mysql_type in blob_types:
+        return "bytea", "bytea"
+    # text types, enum, set, json and anything unexpected
+    return "text", "text"
+
+
+def postgres_default(default, pg_type, kind):
+    """ translate a mysql column DEFAULT to postgres, None means no default """
+    if default is None or default.upper() == "NULL" or pg_type.endswith("serial"):
+        return None
+    if default.upper().startswith("CURRENT_TIMESTAMP"):
+        return "CURRENT_TIMESTAMP"
+    if default.startswith("b'"):
+        default = default[2:-1]
+    elif default.startswith("'"):
+        default = default[1:-1]
+    if kind == "bool":
+        return "true" if default not in ("0", "") else "false"
+    if kind == "date" and default.startswith("0000-00-00"):
+        return None
+    return "'" + default.replace("'", "''") + "'"
+
+
+def parse_create_table(create):
+    """ parse a mysqldump CREATE TABLE statement into columns, primary key, indexes and foreign keys """
+    table = {"columns": [], "primary_key": None, "indexes": [], "foreign_keys": []}
+    for line in create.decode(errors="replace").splitlines()[1:]:
+        if line.startswith(")"):
+            break
+        if match := primary_key_re.match(line):
+            table["primary_key"] = key_columns_re.findall(match.group(1))
+        elif match := index_re.match(line):
+            table["indexes"].append({
+                "name": match.group(2),
+                "unique": bool(match.group(1)),
+                "columns": key_columns_re.findall(match.group(3)),
+            })
+        elif match := foreign_key_re.match(line):
+            table["foreign_keys"].append({
+                "name": match.group(1),
+                "columns": key_columns_re.findall(match.group(2)),
+                "references": match.group(3),
+                "reference_columns": key_columns_re.findall(match.group(4)),
+                "actions": match.group(5).strip(),
+            })
+        elif match := column_re.match(line):
+            name, mysql_type, args, extra = match.groups()
+            pg_type, kind = postgres_type(mysql_type.lower(), args, extra or "")
+            default = default_re.search(extra or "")
+            default = default.group(1) if default else None
+            # pgloader: datetime NOT NULL DEFAULT '0000-00-00 00:00:00' -> drop not null, zero dates become NULL
+            zero_date = kind == "date" and default is not None and default.startswith("'0000-00-00")
+            table["columns"].append({
+                "name": name.lower(),
+                "type": pg_type,
+                "kind": kind,
+                "not_null": "NOT NULL" in (extra or "").upper() and not zero_date,
+                "default": postgres_default(default, pg_type, kind),
+                "generated": "GENERATED ALWAYS" in (extra or "").upper(),
+            })
+    return table
+
+
+def create_table_sql(schema, name, table):
+    columns = []
+    for column in table["columns"]:
+        sql = f'"{column["name"]}" {column["type"]}'
+        if column["not_null"]:
+            sql += " NOT NULL"
+        if column["default"] is not None:
+            sql += f" DEFAULT {column['default']}"
+        columns.append(sql)
+    return f'CREATE TABLE "{schema}"."{name}" (\n    ' + ",\n    ".join(columns) + "\n);"
+
+
+def generated_columns_sql(schema, tables):
+    """ fill in generated columns after the copy """
+    statements = []
+    for name, table in tables.items():
+        for column in table["columns"]:
+            if not column["generated"]:
+                continue
+            expression = generated_columns.get((name, column["name"]))
+            if expression is None:
+                migrate_db.fail_msg(f"no postgres expression for generated column {name}.{column['name']}, leaving it NULL")
+                continue
+            statements.append(f'UPDATE "{schema}"."{name}" SET "{column["name"]}" = {expression};')
+    return statements
+
+
+def constraints_sql(schema, tables):
+    """
+    primary keys, indexes and foreign keys, created after the data is loaded
+    mysql index names are unique per table, postgres index names are unique per schema
+    """
+    statements = []
+    index_names = set()
+    for name, table in tables.items():
+        if table["primary_key"]:
+            statements.append(
+                f'ALTER TABLE "{schema}"."{name}" ADD CONSTRAINT "{name}_pkey" PRIMARY KEY ({_columns(table["primary_key"])});'
+            )
+            index_names.add(f"{name}_pkey")
+        for index in table["indexes"]:
+            index_name = index["name"].lower()
+            if index_name in index_names:
+                index_name = f"{name}_{index_name}"
+            index_names.add(index_name)
+            unique = "UNIQUE " if index["unique"] else ""
+            statements.append(
+                f'CREATE {unique}INDEX "{index_name}" ON "{schema}"."{name}" ({_columns(index["columns"])});'
+            )
+    for name, table in tables.items():
+        for fk in table["foreign_keys"]:
+            if fk["references"].lower() not in tables:
+                continue
+            actions = f" {fk['actions']}" if fk["actions"] else ""
+            statements.append(
+                f'ALTER TABLE "{schema}"."{name}" ADD CONSTRAINT "{fk["name"].lower()}" '
+                f'FOREIGN KEY ({_columns(fk["columns"])}) '
+                f'REFERENCES "{schema}"."{fk["references"].lower()}" ({_columns(fk["reference_columns"])}){actions};'
+            )
+    return statements
+
+
+def sequences_sql(schema, tables):
+    """ set serial sequences past the loaded ids, like pgloader's "reset sequences" """
+    statements = []
+    for name, table in tables.items():
+        for column in table["columns"]:
+            if column["type"].endswith("serial"):
+                statements.append(
+                    f"SELECT setval(pg_get_serial_sequence('\"{schema}\".\"{name}\"', '{column['name']}'), "
+                    f'COALESCE(MAX("{column["name"]}"), 0) + 1, false) FROM "{schema}"."{name}";'
+                )
+    return statements
+
+
+def _columns(columns):
+    return ", ".join(f'"{column.lower()}"' for column in columns)
+
+
+def _unescape(value):
+    if b"\\" not in value and b"''" not in value:
+        return value
+    return unescape_re.sub(
+        lambda m: b"'" if m.group(1) is None else mysql_escapes.get(m.group(1), m.group(1)),
+        value,
+    )
+
+
+def _copy_text(value):
+    """ escape a value for postgres COPY text format """
+    return value.replace(b"\\", b"\\\\").replace(b"\t", b"\\t").replace(b"\n", b"\\n").replace(b"\r", b"\\r")
+
+
+def copy_value(match, kind):
+    """ convert one parsed mysql value to its postgres COPY text representation """
+    string, null, binary, hex_literal, bits, number = match.groups()
+    if null is not None:
+        return b"\\N"
+    if hex_literal is not None:
+        raw = binascii.unhexlify(hex_literal)
+    elif bits is not None:
+        raw = bits
+    elif number is not None:
+        raw = number
+    else:
+        raw = _unescape(string if string is not None else binary)
+    if kind == "bool":
+        return b"f" if raw.strip(b"0\x00") == b"" else b"t"
+    if kind == "bytea":
+        return b"\\\\x" + binascii.hexlify(raw)
+    if kind == "date" and raw.startswith(b"0000-00-00"):
+        return b"\\N"
+    # postgres text cannot hold NUL characters, pgloader removes them too
+    return _copy_text(raw.replace(b"\x00", b""))
+
+
+def parse_insert(line, kinds=None):
+    """
+    yield one COPY text row per VALUES tuple of a mysqldump INSERT statement,
+    without kinds each tuple as a list of its raw SQL literals
+    """
+    pos = line.index(b" VALUES ") + 8
+    end = len(line)
+    row = []
+    while pos < end:
+        char = line[pos:pos + 1]
+        if char in (b"(", b","):
+            pos += 1
+            match = value_re.match(line, pos)
+            if match is None:
+                # "," between tuples, or "()" for a table without columns
+                continue
+            row.append(match.group(0) if kinds is None else copy_value(match, kinds[len(row)]))
+            pos = match.end()
+        elif char == b")":
+            yield row if kinds is None else b"\t".join(row) + b"\n"
+            row = []
+            pos += 1
+        else:
+            # whitespace, the statement terminating ";" and line ending
+            pos += 1
+
+
+def _copy_table(job):
+    """ worker process: COPY one table's INSERT statements from the dump to postgres """
+    mysqldump_file, dsn, schema, name, columns, data_start, data_end = job
+    started = perf_counter()
+    rows = 0
+    kinds_by_name = {column["name"]: column["kind"] for column in columns}
+    copy_columns = [column["name"] for column in columns]
+    buffer = io.BytesIO()
+    cnx = psycopg2.connect(dsn)
+    with cnx, cnx.cursor() as cursor:
+        cursor.execute("SET timezone = 'UTC';")
+        with open(mysqldump_file, "rb") as f:
+            f.seek(data_start)
+            offset = data_start
+            for line in f:
+                offset += len(line)
+                if line.startswith(b"INSERT INTO "):
+                    # mysqldump --complete-insert names the columns in every INSERT
+                    match = insert_columns_re.match(line)
+                    names = [n.strip().strip("`").lower() for n in match.group(1).decode().split(",")] if match else copy_columns
+                    if names != copy_columns:
+                        _copy_buffer(cursor, schema, name, copy_columns, buffer)
+                        copy_columns = names
+                    kinds = [kinds_by_name[column] for column in copy_columns]
+                    for row in parse_insert(line, kinds):
+                        buffer.write(row)
+                        rows += 1
+                    if buffer.tell() >= batch_bytes:
+                        _copy_buffer(cursor, schema, name, copy_columns, buffer)
+                if offset >= data_end:
+                    break
+        _copy_buffer(cursor, schema, name, copy_columns, buffer)
+    cnx.close()
+    return name, rows, data_end - data_start, perf_counter() - started
+
+
+def _copy_buffer(cursor, schema, name, columns, buffer):
+    if not buffer.tell():
+        return
+    buffer.seek(0)
+    cursor.copy_expert(f'COPY "{schema}"."{name}" ({_columns(columns)}) FROM STDIN', buffer)
+    buffer.seek(0)
+    buffer.truncate()
+
+
+def load_dump(mysqldump_file, dsn, schema="dotcms", workers=None):
+    """
+    convert an uncompressed mysqldump file and load it into postgres
+    the schema is dropped and recreated; data is loaded before keys and indexes are built
+    returns {table: {"rows": n, "bytes": n, "seconds": n}}
+    """
+    workers = workers or os.cpu_count()
+    sections = mysqldump.index_dump(mysqldump_file)
+    tables = {}
+    for name, section in sections.items():
+        if section["create"]:
+            tables[name.lower()] = dict(parse_create_table(section["create"]), **section)
+    rich.print(f"creating {len(tables)} tables in postgres schema '{schema}'")
+    cnx = psycopg2.connect(dsn)
+    with cnx, cnx.cursor() as cursor:
+        cursor.execute(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE;')
+        cursor.execute(f'CREATE SCHEMA "{schema}";')
+        for name, table in tables.items():
+            cursor.execute(create_table_sql(schema, name, table))
+    cnx.close()
+    # largest tables first so the biggest one isn't started last
+    jobs = [
+        (mysqldump_file, dsn, schema, name, table["columns"], table["data_start"], table["data_end"])
+        for name, table in sorted(tables.items(), key=lambda item: item[1]["data_bytes"], reverse=True)
+        if table["data_start"] is not None
+    ]
+    rich.print(f"copying {len(jobs)} tables with {workers} worker processes")
+    stats = {}
+    started = perf_counter()
+    with multiprocessing.Pool(processes=workers) as pool:
+        for name, rows, size, seconds in pool.imap_unordered(_copy_table, jobs):
+            stats[name] = {"rows": rows, "bytes": size, "seconds": seconds}
+            migrate_db.success_msg(f"copied {name}: {rows} rows in {seconds:.1f}s")
+    copy_seconds = perf_counter() - started
+    rich.print("building generated columns, primary keys, indexes and foreign keys")
+    cnx = psycopg2.connect(dsn)
+    with cnx, cnx.cursor() as cursor:
+        for query in generated_columns_sql(schema, tables) + constraints_sql(schema, tables) + sequences_sql(schema, tables):
+            cursor.execute(query)
+        # same as the missing_migrations index in migrate_db.mysql_post_import
+        if "workflow_action" in tables:
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS workflow_idx_action_step ON "{schema}".workflow_action (step_id);')
+    cnx.close()
+    print_load_report(stats, copy_seconds)
+    return stats
+
+
+def print_load_report(stats, copy_seconds):
+    table = Table(title="native mysqldump -> postgres COPY")
+    table.add_column("table")
+    table.add_column("rows", justify="right")
+    table.add_column("MB", justify="right")
+    table.add_column("seconds", justify="right")
+    table.add_column("rows/s", justify="right")
+    for name, stat in sorted(stats.items(), key=lambda item: item[1]["seconds"], reverse=True):
+        table.add_row(
+            name,
+            str(stat["rows"]),
+            f"{stat['bytes'] / 1024 / 1024:.1f}",
+            f"{stat['seconds']:.1f}",
+            f"{stat['rows'] / stat['seconds']:.0f}" if stat["seconds"] else "-",
+        )
+    rich.print(table)
+    migrate_db.success_msg(
+        f"copied {sum(stat['rows'] for stat in stats.values())} rows in {copy_seconds:.1f}s"
+    )
@@ -0,0 +1,174 @@
+"""
+Description: export the converted postgres db without temp copies
+- plain: pg_dump's stdout (run by the runner, e.g. "docker exec") is piped into a compressor on the host (gzip, pigz or zstd)
+- custom: pg_dump -Fc streamed the same way, pg_dump compresses; restore it with pg_restore -j N
+- directory: pg_dump -Fd -j N writes into the workdir, bind mounted into the postgres container by the docker runner
+The peak disk use of the export (lowest free space on the output filesystem) and the wall time are reported
+"""
+
+import gzip
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+from time import perf_counter
+
+import rich
+
+import migrate_db
+
+# compressor: (host command, file suffix), gzip falls back to python's gzip module when the binary is missing
+compressors = {
+    "gzip": (["gzip", "-c"], ".gz"),
+    "pigz": (["pigz", "-c"], ".gz"),
+    "zstd": (["zstd", "-c", "-T0", "-q"], ".zst"),
+}
+formats = ("plain", "custom", "directory")
+# suffixes of the dumps export() writes, see output_suffix()
+dump_suffixes = (".sql", ".gz", ".zst", ".dump", ".dir")
+block_size = 1024 * 1024
+
+
+class DiskHighWater:
+    """ sample the free space of a filesystem in a background thread, used = baseline free - lowest free """
+    def __init__(self, path, interval=1):
+        self.path = path
+        self.interval = interval
+        self.baseline = shutil.disk_usage(path).free
+        self.lowest = self.baseline
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+        return False
+
+    def sample(self):
+        self.lowest = min(self.lowest, shutil.disk_usage(self.path).free)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    @property
+    def used(self):
+        return max(0, self.baseline - self.lowest)
+
+
+def pg_dump_command(command, username, dbname, *options, host_user=False):
+    """
+    pg_dump next to the postgres server, command(*args, host_user) is the runner's argv for it (runners.*Runner.command);
+    host_user runs it as the calling user so files in bind mounts stay ours
+    """
+    return command(
+        "pg_dump", "--no-owner", "--clean", "--no-password", "-h", "localhost", "-U", username, *options, dbname,
+        host_user=host_user,
+    )
+
+
+def output_suffix(dump_format="plain", compressor="gzip"):
+    """ the file suffix of a dump in this format and compression """
+    if dump_format == "custom":
+        return ".dump"
+    if dump_format == "directory":
+        return ".dir"
+    return ".sql" + compressors[compressor][1]
+
+
+def default_path(directory, dump_format="plain", compressor="gzip"):
+    """ the output when none is given, named with the suffix of the format and compressor """
+    return Path(directory) / f"dotcms-21.06-postgres{output_suffix(dump_format, compressor)}"
+
+
+def suffix_matches(pg_dump_file, dump_format="plain", compressor="gzip"):
+    """
+    False when a given output ends in the suffix of another format or compressor, e.g. dump.sql.gz with zstd;
+    other suffixes are used as given, except for the directory format: export() replaces the directory, it must end in .dir
+    """
+    suffix = Path(pg_dump_file).suffix
+    if dump_format == "directory" or suffix in dump_suffixes:
+        return suffix == "." + output_suffix(dump_format, compressor).rsplit(".", 1)[1]
+    return True
+
+
+def _stream(command, out, compressor_command=None):
+    """ pipe command's stdout into out, through compressor_command if given """
+    dump = subprocess.Popen(command, stdout=subprocess.PIPE)
+    if compressor_command:
+        compress = subprocess.Popen(compressor_command, stdin=dump.stdout, stdout=out)
+        # let the compressor own the pipe so pg_dump gets SIGPIPE if the compressor dies
+        dump.stdout.close()
+        if compress.wait():
+            raise subprocess.CalledProcessError(compress.returncode, compressor_command)
+    else:
+        shutil.copyfileobj(dump.stdout, out, block_size)
+        dump.stdout.close()
+    if dump.wait():
+        raise subprocess.CalledProcessError(dump.returncode, command)
+
+
+def export(command, username, dbname, pg_dump_file, dump_format="plain", compressor="gzip", jobs=4,
+           export_mount=None):
+    """
+    dump the db to pg_dump_file as given (see suffix_matches()), returns a stats dict
+    command(*args, host_user) runs a postgres client program, see pg_dump_command()
+    the directory format needs export_mount: (host directory, its path for the postgres server);
+    pg_dump writes there and the result is moved to pg_dump_file's directory
+    """
+    assert dump_format in formats, f"format must be one of {', '.join(formats)}"
+    assert compressor in compressors, f"compressor must be one of {', '.join(compressors)}"
+    path = Path(pg_dump_file)
+    if path.is_dir() and dump_format == "directory":
+        shutil.rmtree(path)
+    elif path.is_file():
+        path.unlink()
+    rich.print(f":outbox_tray: pg_dump, {dump_format} format, to {path}")
+    started = perf_counter()
+    with DiskHighWater(path.parent) as disk:
+        if dump_format == "directory":
+            assert export_mount, "directory format needs a directory the postgres server can write to"
+            host_path, container_path = export_mount
+            subprocess.run(
+                pg_dump_command(
+                    command, username, dbname, "-Fd", "-j", str(jobs), "-f", f"{container_path}/{path.name}", host_user=True,
+                ),
+                check=True,
+            )
+            if Path(host_path) / path.name != path:
+                shutil.move(Path(host_path) / path.name, path)
+        elif dump_format == "custom":
+            with open(path, "wb") as out:
+                _stream(pg_dump_command(command, username, dbname, "-Fc"), out)
+        else:
+            compressor_command, _ = compressors[compressor]
+            with open(path, "wb") as out:
+                if shutil.which(compressor_command[0]):
+                    _stream(pg_dump_command(command, username, dbname), out, compressor_command)
+                elif compressor == "gzip":
+                    with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6) as compressed:
+                        _stream(pg_dump_command(command, username, dbname), compressed)
+                else:
+                    raise FileNotFoundError(f"{compressor_command[0]} is not installed, use --compressor=gzip")
+    seconds = perf_counter() - started
+    nbytes = sum(f.stat().st_size for f in path.iterdir()) if path.is_dir() else path.stat().st_size
+    stats = {
+        "path": str(path),
+        "format": dump_format,
+        "compressor": compressor if dump_format == "plain" else None,
+        "jobs": jobs if dump_format == "directory" else 1,
+        "seconds": seconds,
+        "bytes": nbytes,
+        "disk_high_water_bytes": disk.used,
+    }
+    migrate_db.success_msg(
+        f"pg_dump: {nbytes / 1024 / 1024:.1f} MB in {seconds:.1f}s, "
+        f"disk high-water mark {disk.used / 1024 / 1024:.1f} MB"
+    )
+    return stats
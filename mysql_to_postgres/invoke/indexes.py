@@ -0,0 +1,196 @@
+"""
+Description: deferred index and constraint build for the postgres copy
+- capture(): with migrate --defer-indexes, after pgloader created the schema, the definitions of the secondary indexes,
+  unique constraints and foreign keys are read from the catalog and saved, then they are dropped so the copy only
+  maintains primary keys
+- build(): after the copy they are recreated by a pool of connections, biggest tables first, each statement
+  with a raised maintenance_work_mem; foreign keys are added NOT VALID one by one in short transactions and then validated
+  in parallel, validation does not lock the referenced tables against each other
+Run build() before postgres_post_import, which renames the primary keys and moves the schema to public
+"""
+
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import perf_counter
+
+import rich
+from rich.table import Table
+
+import migrate_db, tuning
+
+definitions_file_name = "deferred-indexes.json"
+
+definitions_query = """
+    SELECT 'index', t.relname, i.relname, pg_get_indexdef(x.indexrelid), NULL
+    FROM pg_index x
+    JOIN pg_class i ON i.oid = x.indexrelid
+    JOIN pg_class t ON t.oid = x.indrelid
+    JOIN pg_namespace n ON n.oid = t.relnamespace
+    LEFT JOIN pg_constraint con ON con.conindid = x.indexrelid AND con.contype IN ('p', 'u', 'x')
+    WHERE n.nspname = %(schema)s AND con.oid IS NULL
+    UNION ALL
+    SELECT CASE con.contype WHEN 'f' THEN 'foreign_key' ELSE 'unique' END, t.relname, con.conname,
+        pg_get_constraintdef(con.oid), r.relname
+    FROM pg_constraint con
+    JOIN pg_class t ON t.oid = con.conrelid
+    JOIN pg_namespace n ON n.oid = t.relnamespace
+    LEFT JOIN pg_class r ON r.oid = con.confrelid
+    WHERE n.nspname = %(schema)s AND con.contype IN ('f', 'u')
+"""
+
+# (table, name) of the indexes and constraints schema has, a build that runs again skips the ones built before
+existing_query = """
+    SELECT t.relname, i.relname
+    FROM pg_index x
+    JOIN pg_class i ON i.oid = x.indexrelid
+    JOIN pg_class t ON t.oid = x.indrelid
+    JOIN pg_namespace n ON n.oid = t.relnamespace
+    WHERE n.nspname = %(schema)s
+    UNION
+    SELECT t.relname, con.conname
+    FROM pg_constraint con
+    JOIN pg_class t ON t.oid = con.conrelid
+    JOIN pg_namespace n ON n.oid = t.relnamespace
+    WHERE n.nspname = %(schema)s
+"""
+
+
+def capture(session, schema, workdir=None):
+    """
+    drop the secondary indexes, unique constraints and foreign keys of schema, returns their definitions
+    [{"kind", "table", "name", "definition", "references"}], also saved to workdir for a later build
+    """
+    definitions = [
+        {"kind": kind, "table": table, "name": name, "definition": definition, "references": references}
+        for kind, table, name, definition, references in session.execute(
+            "postgres", definitions_query, {"schema": schema}, fetch=True,
+        )
+    ]
+    # foreign keys first, they may depend on the unique constraints they reference
+    drops = [
+        f'ALTER TABLE "{schema}"."{d["table"]}" DROP CONSTRAINT "{d["name"]}";'
+        for kind in ("foreign_key", "unique") for d in definitions if d["kind"] == kind
+    ] + [
+        f'DROP INDEX "{schema}"."{d["name"]}";'
+        for d in definitions if d["kind"] == "index"
+    ]
+    session.execute_batch("postgres", drops)
+    if workdir:
+        with open(f"{workdir}/{definitions_file_name}", "w") as f:
+            json.dump({"schema": schema, "definitions": definitions}, f, indent=2)
+    migrate_db.success_msg(
+        f"deferred {sum(d['kind'] != 'foreign_key' for d in definitions)} indexes "
+        f"and {sum(d['kind'] == 'foreign_key' for d in definitions)} foreign keys until after the copy"
+    )
+    return definitions
+
+
+def load(workdir):
+    """ (schema, definitions) saved by capture() """
+    with open(f"{workdir}/{definitions_file_name}") as f:
+        saved = json.load(f)
+    return saved["schema"], saved["definitions"]
+
+
+def create_sql(schema, definition):
+    if definition["kind"] == "index":
+        # pg_get_indexdef() has the schema qualified table name
+        return definition["definition"] + ";"
+    not_valid = " NOT VALID" if definition["kind"] == "foreign_key" else ""
+    return f'ALTER TABLE "{schema}"."{definition["table"]}" ADD CONSTRAINT "{definition["name"]}" {definition["definition"]}{not_valid};'
+
+
+def session_memory(workers):
+    """ maintenance_work_mem for each of `workers` concurrent builds, a quarter of the host RAM between them """
+    memory, _ = tuning.host_resources()
+    return tuning.size(min(max(memory // 4 // max(workers, 1), 64 * tuning.megabyte), 4 * tuning.gigabyte))
+
+
+def _run(session, key, queries):
+    started = perf_counter()
+    try:
+        session.execute_all("postgres", queries)
+    except Exception as e:
+        return key, perf_counter() - started, e
+    return key, perf_counter() - started, None
+
+
+def build(session, schema, definitions, workers=4):
+    """
+    recreate the definitions from capture(), returns {"table.name": {"table", "kind", "seconds", "error"}};
+    a failed build is reported and the others go on, see failed(). Run again after a failure, it skips what was built,
+    foreign keys added before are only validated
+    """
+    started = perf_counter()
+    existing = {tuple(row) for row in session.execute("postgres", existing_query, {"schema": schema}, fetch=True)}
+    built = lambda d: (d["table"], d["name"]) in existing
+    if any(built(d) for d in definitions):
+        rich.print(f"   {sum(built(d) for d in definitions)} indexes and constraints were built by an earlier run")
+    sizes = dict(session.execute(
+        "postgres",
+        "SELECT c.relname, pg_relation_size(c.oid) FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = %s AND c.relkind = 'r'",
+        (schema,),
+        fetch=True,
+    ))
+    by_size = lambda d: sizes.get(d["table"], 0)
+    memory = session_memory(workers)
+    rich.print(f":building_construction:  building {len(definitions)} indexes and constraints with {workers} workers, "
+               f"maintenance_work_mem={memory}")
+    results = {}
+    kinds = {f"{d['table']}.{d['name']}": d["kind"] for d in definitions}
+
+    def record(key, seconds, error):
+        table, _ = key.split(".", 1)
+        results[key] = {"table": table, "kind": kinds[key], "seconds": seconds, "error": str(error) if error else None}
+        if error:
+            migrate_db.fail_msg(f"building {key} failed")
+            print(f"   {error}")
+
+    def run_all(jobs):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_run, session, f"{d['table']}.{d['name']}", [f"SET LOCAL maintenance_work_mem = '{memory}';", *queries])
+                for d, queries in jobs
+            ]
+            for future in as_completed(futures):
+                record(*future.result())
+
+    # indexes and unique constraints first, foreign keys may reference a unique constraint
+    run_all([
+        (d, [create_sql(schema, d)])
+        for d in sorted(definitions, key=by_size, reverse=True) if d["kind"] != "foreign_key" and not built(d)
+    ])
+    foreign_keys = sorted((d for d in definitions if d["kind"] == "foreign_key"), key=by_size, reverse=True)
+    # one at a time, adding a foreign key locks both tables; one that can't be added is reported and not validated
+    for d in foreign_keys:
+        if not built(d):
+            key, seconds, error = _run(session, f"{d['table']}.{d['name']}", [create_sql(schema, d)])
+            if error:
+                record(key, seconds, error)
+    run_all([
+        (d, [f'ALTER TABLE "{schema}"."{d["table"]}" VALIDATE CONSTRAINT "{d["name"]}";'])
+        for d in foreign_keys if f"{d['table']}.{d['name']}" not in results
+    ])
+    print_results(results, perf_counter() - started)
+    return results
+
+
+def failed(results):
+    """ the builds of build() that failed, a missing unique constraint or foreign key must stop the run """
+    return [key for key, result in results.items() if result["error"]]
+
+
+def print_results(results, seconds):
+    table = Table(title="slowest index and constraint builds")
+    table.add_column("table.name")
+    table.add_column("kind")
+    table.add_column("seconds", justify="right")
+    for key, result in sorted(results.items(), key=lambda item: item[1]["seconds"], reverse=True)[:15]:
+        table.add_row(key, result["kind"], f"{result['seconds']:.1f}")
+    rich.print(table)
+    failed_builds = failed(results)
+    if failed_builds:
+        migrate_db.fail_msg(f"{len(failed_builds)} of {len(results)} index and constraint builds failed: {', '.join(failed_builds)}")
+    else:
+        migrate_db.success_msg(f"built {len(results)} indexes and constraints in {seconds:.1f}s")
@@ -4,14 +4,129 @@ Description: All the heavy lifting for Invoke tasks
 - server health and status checks - so Invoke knows when when it can proceed
 """
 
-from time import sleep
-from urllib.request import Request, urlopen
-from urllib.error import URLError, HTTPError
-from http.client import RemoteDisconnected
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import perf_counter
 
-import mysql.connector
-import psycopg2
 import rich
+from rich.table import Table
+
+import readiness
+
+# pglaoder casts mysql tinyint(1) -> postgres boolean
+# these columns in dotcms mysql are tinyint(4) but used as boolean
+alter_tables = {
+    "company": (
+        "`autologin` tinyint(1)", 
+        "`strangers` tinyint(1)",
+    ),
+    "portlet": (
+        "`narrow` tinyint(1)", 
+        "`active_` tinyint(1)",
+    ),
+    "publishing_end_point": (
+        "`enabled` tinyint(1)", 
+        "`sending` tinyint(1)",
+    ),
+    "sitesearch_audit": (
+        "`incremental` tinyint(1) NOT NULL", 
+        "`all_hosts` tinyint(1) NOT NULL", 
+        "`path_include` tinyint(1) NOT NULL",
+    ),
+    "user_": (
+        "`passwordencrypted` tinyint(1)", 
+        "`passwordreset` tinyint(1)", 
+        "`male` tinyint(1)", 
+        "`dottedskins` tinyint(1)", 
+        "`roundedskins` tinyint(1)", 
+        "`agreedtotermsofuse` tinyint(1)", 
+        "`active_` tinyint(1) ",
+    ),
+}
+# dotcms rebuilds the data in these tables, so they are emptied before pgloader runs
+delete_from = (
+    "analytic_summary",
+    "analytic_summary_404",
+    "analytic_summary_content",
+    "analytic_summary_pages",
+    "analytic_summary_period",
+    "analytic_summary_referer",
+    "analytic_summary_visits",
+    "analytic_summary_workstream",
+    "clickstream",
+    "clickstream_404",
+    "clickstream_request",
+    "cluster_server",
+    "cluster_server_action",
+    "cluster_server_uptime",
+    "cms_roles_ir",
+    "dist_reindex_journal",
+    "dot_cluster",
+    "fileassets_ir",
+    "folders_ir",
+    "htmlpages_ir",
+    "indicies",
+    "notification",
+    "publishing_bundle_environment",
+    "publishing_bundle",
+    "publishing_pushed_assets",
+    "publishing_queue",
+    "publishing_queue_audit",
+    "schemes_ir",
+    "sitelic",
+    "structures_ir",
+    "system_event",
+)
+
+# postgres primary key names that don't use the "{table_name}_pkey" form
+primary_key_names = {
+    "notification": "pk_notification",
+    "system_event": "pk_system_event",
+    "workflow_action_step": "pk_workflow_action_step",
+}
+# sequences pgloader names "{table}_{column}_seq" that dotcms on postgres names differently
+sequence_renames = {
+    "clickstream_clickstream_id_seq": "clickstream_seq",
+    "clickstream_request_clickstream_request_id_seq": "clickstream_request_seq",
+    "clickstream_404_clickstream_404_id_seq": "clickstream_404_seq",
+    "content_rating_id_seq": "content_rating_sequence",
+    "dashboard_user_preferences_id_seq": "dashboard_usrpref_seq",
+    "trackback_id_seq": "trackback_sequence",
+    "users_to_delete_id_seq": "user_to_delete_seq",
+    # these just need "_id" removed
+    "chain_link_code_id_seq": "chain_link_code_seq",
+    "chain_id_seq": "chain_seq",
+    "chain_state_parameter_id_seq": "chain_state_parameter_seq",
+    "chain_state_id_seq": "chain_state_seq",
+    "permission_reference_id_seq": "permission_reference_seq",
+    "permission_id_seq": "permission_seq",
+    "user_preferences_id_seq": "user_preferences_seq",
+}
+quartz_locks = (
+    "TRIGGER_ACCESS", 
+    "JOB_ACCESS", 
+    "CALENDAR_ACCESS", 
+    "STATE_ACCESS", 
+    "MISFIRE_ACCESS"
+)
+# lean layout: the reindex queue drops what dotcms queues while it starts (a full reindex into a throwaway index),
+# a mysql BLACKHOLE table stores nothing, postgres skips the rows a BEFORE INSERT trigger returns NULL for
+skip_reindex = {
+    "mysql": ("ALTER TABLE dist_reindex_journal ENGINE=BLACKHOLE;",),
+    "postgres": (
+        "CREATE OR REPLACE FUNCTION migration_skip_reindex() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN RETURN NULL; END $$;",
+        "DROP TRIGGER IF EXISTS migration_skip_reindex ON dist_reindex_journal;",
+        "CREATE TRIGGER migration_skip_reindex BEFORE INSERT ON dist_reindex_journal "
+        "FOR EACH ROW EXECUTE PROCEDURE migration_skip_reindex();",
+    ),
+}
+restore_reindex = {
+    "mysql": ("ALTER TABLE dist_reindex_journal ENGINE=InnoDB;",),
+    "postgres": (
+        "DROP TRIGGER IF EXISTS migration_skip_reindex ON dist_reindex_journal;",
+        "DROP FUNCTION IF EXISTS migration_skip_reindex();",
+    ),
+}
 
 def success_msg(msg):
     rich.print(f":white_check_mark: {msg}")
@@ -19,96 +134,57 @@ def success_msg(msg):
 def fail_msg(msg):
     rich.print(f":x: {msg}")
 
-def check_dotcms_appconfiguration(port=8082, interval=15, attempts=60) -> bool:
+def check_dotcms_appconfiguration(port=8082, timeout=900, log_command=None) -> bool:
     """
     checks for healthy server response from dotCMS
+    log_command follows the dotcms logs, the startup line triggers an immediate check
     """
     url = f"http://127.0.0.1:{port}/api/v1/appconfiguration"
-    print(f"checking for a success response from {url}, will try for {int((interval * attempts)/60)} minutes")
-    count = 0
-    while count <= attempts:
-        sleep(interval)
-        try:
-            response = urlopen(Request(url))
-        except HTTPError as e:
-            msg = f"HTTP error code: {e.code}"
-        except URLError as e:
-            msg = f"Unable to reach server: {e.reason}"
-        except RemoteDisconnected:
-            msg = "Remote end closed connection without response"
-        except Exception as e:
-            print(" Unexpected exception in check_dotcms_appconfiguration():")
-            print(e)
-            print(" Optimistically proceeding")
-        else:
-            success_msg("dotcms is healty")
-            return True
-        count += 1
-        print(f"  failed, attempt {count} of {attempts}")
-    fail_msg("cannot reach dotcms")
-    return False
-
-def mysql_query_content(
-    username, 
-    password,
-    host="127.0.0.1",
-    db="dotcms"
-    ):
+    try:
+        readiness.wait_for(
+            f"a success response from {url}",
+            readiness.http_probe(url),
+            timeout,
+            log_command=log_command,
+            log_pattern=readiness.dotcms_ready_log,
+        )
+    except TimeoutError as e:
+        fail_msg("cannot reach dotcms")
+        print(f"   {e}")
+        return False
+    success_msg("dotcms is healty")
+    return True
+
+def mysql_query_content(session):
     """ mysql client """
     count = None
-    config = {
-        'user': username,
-        'password': password,
-        'host': host,
-        'database': db,
-        'raise_on_warnings': True,
-    }
     query = ("SELECT COUNT(*) FROM contentlet")
     try:
-        cnx = mysql.connector.connect(**config)
-        cursor = cnx.cursor()
-        cursor.execute(query)
-
-        for result in cursor:
+        for result in session.execute("mysql", query, fetch=True):
             count = int(result[0])
             if count:
                 success_msg(f"mysql query: '{query}' == [green]{count}")
-        cursor.close()
-        cnx.close()
     except Exception as e:
         fail_msg(f"Error querying mysql server: '{query}'")
         print(f"   {e}")
     return count
 
 
-def postgres_query_content(
-        username, 
-        password,
-        host="127.0.0.1",
-        db="dotcms"
-    ):
+def postgres_query_content(session):
     """ postgres client """
     count = None
     query = ("SELECT COUNT(*) FROM contentlet;")
     try:
-        with psycopg2.connect(f"dbname={db} user={username} password={password} host={host}") as cnx:
-            with cnx.cursor() as cursor:
-                cursor.execute(query)
-                for result in cursor.fetchall():
-                    count = int(result[0])
-                    if count:
-                        success_msg(f"postgres query: '{query}' == [green]{count}")
+        for result in session.execute("postgres", query, fetch=True):
+            count = int(result[0])
+            if count:
+                success_msg(f"postgres query: '{query}' == [green]{count}")
     except Exception as e:
         fail_msg(f"Error querying postgres server: '{query}'")
         print(f"   {e}")
     return count
 
-def postgres_post_import(
-        username, 
-        password,
-        host="127.0.0.1",
-        db="dotcms"
-    ):
+def postgres_post_import(session, dry_run=False):
     """
     rename schema from "dotcms" to "public"
 
@@ -118,79 +194,68 @@ def postgres_post_import(
     these need to be renamed to:
         "{table_name}_pkey"
     rename db tables as needed
+
+    the whole plan comes from one catalog query and runs in one transaction, a page of statements per round trip,
+    dry_run prints the plan without running it
     """
-    for query in (
-        "ALTER SCHEMA public RENAME TO public_old;",
-        "ALTER SCHEMA dotcms RENAME TO public;"
-    ):
-        postgres_query(username, password, query, host=host, db=db)
+    plan = postgres_post_import_plan(session, source_schema=session.db)
+    print("postgres post import plan:")
+    for query in plan:
+        print(f"    {query}")
+    if dry_run:
+        return plan
+    session.execute_batch("postgres", plan)
+    success_msg(f"postgres post import: {len(plan)} statements in one transaction")
+    return plan
+
+
+def postgres_post_import_plan(session, source_schema="dotcms"):
+    """ build the post import script from the pg_constraint/pg_class catalog """
+    catalog = session.execute(
+        "postgres",
+        """
+        SELECT n.nspname, c.relname, c.relkind, con.conname
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_constraint con ON con.conrelid = c.oid AND con.contype = 'p'
+        WHERE n.nspname IN (%s, 'public') AND c.relkind IN ('r', 'S');
+        """,
+        (source_schema,),
+        fetch=True,
+    )
+    plan = []
+    # pgloader loads into a schema named after the mysql db, a re-run finds it already renamed
+    schema = "public"
+    if any(nspname == source_schema for nspname, _, _, _ in catalog) and source_schema != "public":
+        schema = source_schema
+        plan += [
+            "ALTER SCHEMA public RENAME TO public_old;",
+            f"ALTER SCHEMA {source_schema} RENAME TO public;",
+        ]
+    primary_keys = {relname: conname for nspname, relname, relkind, conname in catalog if nspname == schema and conname}
+    sequences = {relname for nspname, relname, relkind, _ in catalog if nspname == schema and relkind == "S"}
 
     ## special cases: these tables don't use "_pkey" suffix for 'PRIMARY KEY CONSTRAINT' names
-    for table, postgres_key in (
-        ("notification", "pk_notification"),
-        ("system_event", "pk_system_event"),
-        ("workflow_action_step", "pk_workflow_action_step"),
-    ):
-        query = "SELECT constraint_name FROM information_schema.table_constraints WHERE table_schema = 'public' "
-        query += f" AND constraint_type = 'PRIMARY KEY'  AND table_name = '{table}';"
-        primary_key = postgres_query(username, password, query, host=host, db=db, print_success=False)[0][0]
-        query = f"ALTER TABLE {table} RENAME CONSTRAINT {primary_key} TO {postgres_key};"
-        postgres_query(username, password, query, host=host, db=db)
-
-    ## special cases: rename mysql tables to match postgres
-    for mysql_table, postgres_table in (
-        ("clickstream_clickstream_id_seq", "clickstream_seq"),
-        ("clickstream_request_clickstream_request_id_seq", "clickstream_request_seq"),
-        ("clickstream_404_clickstream_404_id_seq", "clickstream_404_seq"),
-        ("content_rating_id_seq", "content_rating_sequence"),
-        ("dashboard_user_preferences_id_seq", "dashboard_usrpref_seq"),
-        ("trackback_id_seq", "trackback_sequence"),
-        ("users_to_delete_id_seq", "user_to_delete_seq"),
-    ):
-        query = f"ALTER TABLE {mysql_table} RENAME TO {postgres_table};"
-        postgres_query(username, password, query, host=host, db=db)
-
-    ## special cases: these table names need "_id" removed
-    for mysql_table in (
-        "chain_link_code_id_seq",
-        "chain_id_seq",
-        "chain_state_parameter_id_seq",
-        "chain_state_id_seq",
-        "permission_reference_id_seq",
-        "permission_id_seq",
-        "user_preferences_id_seq",
-    ):
-        query = f"ALTER TABLE {mysql_table} RENAME TO {mysql_table.replace('_id_', '_')};"
-        postgres_query(username, password, query, host=host, db=db)
-
-    ## end special cases, rename the remaining pkeys to "{table_name}_pkey"
-    query = "SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'  AND table_catalog = 'dotcms';"
-    tables = [table[0] for table in postgres_query(username, password, query, host=host, db=db, print_success=False)]
-    for table in tables:
-        query = "SELECT constraint_name FROM information_schema.table_constraints WHERE table_schema = 'public' "
-        query += f" AND constraint_type = 'PRIMARY KEY'  AND table_name = '{table}';"
-        primary_keys = [pk[0] for pk in postgres_query(username, password, query, host=host, db=db, print_success=False)]
-        for primary_key in primary_keys:
-            if primary_key.startswith("idx_") and primary_key.endswith("_primary"):
-                query = f"ALTER TABLE {table} RENAME CONSTRAINT {primary_key} TO {table}_pkey;"
-                postgres_query(username, password, query, host=host, db=db)
+    ## the remaining pkeys named like "idx_16386_primary" are renamed to "{table_name}_pkey"
+    for table, primary_key in sorted(primary_keys.items()):
+        postgres_key = primary_key_names.get(table)
+        if postgres_key is None and primary_key.startswith("idx_") and primary_key.endswith("_primary"):
+            postgres_key = f"{table}_pkey"
+        if postgres_key and postgres_key != primary_key:
+            plan.append(f'ALTER TABLE "{table}" RENAME CONSTRAINT "{primary_key}" TO "{postgres_key}";')
+
+    ## special cases: rename mysql sequences to match postgres
+    for mysql_sequence, postgres_sequence in sequence_renames.items():
+        if mysql_sequence in sequences:
+            plan.append(f'ALTER SEQUENCE "{mysql_sequence}" RENAME TO "{postgres_sequence}";')
 
     ## remove quartz locks
     for table in (
         "qrtz_locks", 
         "qrtz_excl_locks"
     ):
-        query = f"DELETE FROM {table};"
-        postgres_query(username, password, query, host=host, db=db)
-        for lock in (
-            "TRIGGER_ACCESS", 
-            "JOB_ACCESS", 
-            "CALENDAR_ACCESS", 
-            "STATE_ACCESS", 
-            "MISFIRE_ACCESS"
-        ):
-            query = f"INSERT INTO {table} values('{lock}');"
-            postgres_query(username, password, query, host=host, db=db)
+        plan.append(f"DELETE FROM {table};")
+        plan.append(f"INSERT INTO {table} VALUES " + ", ".join(f"('{lock}')" for lock in quartz_locks) + ";")
     # order matters due to foreign key constraints
     for more_qrtz in [
         "qrtz_excl_fired_triggers",
@@ -205,145 +270,179 @@ def postgres_post_import(
         "qrtz_scheduler_state",
         "qrtz_job_details",
     ]:
-        query = f"DELETE FROM {more_qrtz};"
-        postgres_query(username, password, query, host=host, db=db)
-
-def postgres_query(
-        username, 
-        password,
-        query,
-        host="127.0.0.1",
-        db="dotcms",
-        print_success=True,
+        plan.append(f"DELETE FROM {more_qrtz};")
+    return plan
+
+def postgres_maintenance(session, workers=4, schema="public", dry_run=False):
+    """
+    VACUUM (ANALYZE) every table of the converted db, largest first, on `workers` connections,
+    so dotcms starts on planner statistics and a set visibility map, and pg_dump reads a warm heap.
+    in the same pass each sequence owned by a column is moved up to the column's max where it is behind
+    returns the plan and {table: seconds}
+    """
+    plan = postgres_maintenance_plan(session, schema)
+    print("postgres maintenance plan:")
+    for table, queries in plan.items():
+        for query in queries:
+            print(f"    {query}")
+    timings = {}
+    if dry_run:
+        return plan, timings
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_postgres_maintenance_table, session, queries): table for table, queries in plan.items()}
+        for future in as_completed(futures):
+            table = futures[future]
+            seconds, error = future.result()
+            timings[table] = seconds
+            if error:
+                fail_msg(f"Error querying postgres server: {' '.join(plan[table])}")
+                print(f"   {error}")
+    print_table_timings("postgres maintenance", plan, timings)
+    return plan, timings
+
+
+def postgres_maintenance_plan(session, schema="public"):
+    """ {table: [statements]}, largest tables first """
+    tables = session.execute(
+        "postgres",
+        """
+        SELECT c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relkind = 'r'
+        ORDER BY pg_total_relation_size(c.oid) DESC, c.relname
+        """,
+        (schema,),
+        fetch=True,
+    )
+    plan = {table: [f'VACUUM (ANALYZE) "{schema}"."{table}";'] for table, in tables}
+    for sequence, table, column in session.execute(
+        "postgres",
+        """
+        SELECT s.relname, t.relname, a.attname
+        FROM pg_class s
+        JOIN pg_namespace n ON n.oid = s.relnamespace
+        JOIN pg_depend d ON d.objid = s.oid AND d.classid = 'pg_class'::regclass AND d.deptype IN ('a', 'i')
+        JOIN pg_class t ON t.oid = d.refobjid
+        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = d.refobjsubid
+        WHERE n.nspname = %s AND s.relkind = 'S'
+        """,
+        (schema,),
+        fetch=True,
     ):
-    results = None
-    query = query.strip()
+        if table in plan:
+            # only when the column is ahead, a sequence that was never called hands out last_value next
+            plan[table].append(
+                f"""SELECT setval('"{schema}"."{sequence}"', m) FROM (SELECT max("{column}") AS m FROM "{schema}"."{table}") x """
+                f"""WHERE m >= (SELECT last_value FROM "{schema}"."{sequence}");"""
+            )
+    return plan
+
+
+def _postgres_maintenance_table(session, queries):
+    started = perf_counter()
     try:
-        with psycopg2.connect(f"dbname={db} user={username} password={password} host={host}") as cnx:
-            with cnx.cursor() as cursor:
-                cursor.execute(query)
-                # fetch results only for SELECT
-                if query.upper().startswith("SELECT"):
-                    results = [result for result in cursor.fetchall()]
-                if print_success:
-                    success_msg(f"postgres query: '{query}'")
-    except (psycopg2.errors.DuplicateTable,) as e:
-        print(f"Ignoring pg error:  {e}")
-    return results
-
-def mysql_post_import(
-        username, 
-        password,
-        host="127.0.0.1",
-        db="dotcms"
-    ):
+        # VACUUM can't run inside a transaction
+        session.execute_all("postgres", queries, autocommit=True)
+    except Exception as e:
+        return perf_counter() - started, e
+    return perf_counter() - started, None
+
+
+def mysql_post_import(session, workers=4, dry_run=False):
     """
     pglaoder casts mysql tinyint(1) -> postgres boolean
     these columns in dotcms mysql are tinyint(4) but used as boolean, 
     so we modify them before running pgloader
+
+    all changes to a table go in one ALTER TABLE (one table rebuild), emptied tables are truncated,
+    tables run concurrently on separate connections, dry_run prints the plan without running it
+    returns the plan and {table: seconds}
     """
-    count = None
-    config = {
-        'user': username,
-        'password': password,
-        'host': host,
-        'database': db,
-        'raise_on_warnings': True,
-    }
-    alter_tables = {
-        "company": (
-            "`autologin` tinyint(1)", 
-            "`strangers` tinyint(1)",
-        ),
-        "portlet": (
-            "`narrow` tinyint(1)", 
-            "`active_` tinyint(1)",
-        ),
-        "publishing_end_point": (
-            "`enabled` tinyint(1)", 
-            "`sending` tinyint(1)",
-        ),
-        "sitesearch_audit": (
-            "`incremental` tinyint(1) NOT NULL", 
-            "`all_hosts` tinyint(1) NOT NULL", 
-            "`path_include` tinyint(1) NOT NULL",
-        ),
-        "user_": (
-            "`passwordencrypted` tinyint(1)", 
-            "`passwordreset` tinyint(1)", 
-            "`male` tinyint(1)", 
-            "`dottedskins` tinyint(1)", 
-            "`roundedskins` tinyint(1)", 
-            "`agreedtotermsofuse` tinyint(1)", 
-            "`active_` tinyint(1) ",
-        ),
-    }
-    delete_from = (
-        "analytic_summary",
-        "analytic_summary_404",
-        "analytic_summary_content",
-        "analytic_summary_pages",
-        "analytic_summary_period",
-        "analytic_summary_referer",
-        "analytic_summary_visits",
-        "analytic_summary_workstream",
-        "analytic_summary",
-        "clickstream",
-        "clickstream_404",
-        "clickstream_request",
-        "cluster_server",
-        "cluster_server_action",
-        "cluster_server_uptime",
-        "cms_roles_ir",
-        "dist_reindex_journal",
-        "dot_cluster",
-        "fileassets_ir",
-        "folders_ir",
-        "htmlpages_ir",
-        "indicies",
-        "notification",
-        "publishing_bundle_environment",
-        "publishing_bundle",
-        "publishing_pushed_assets",
-        "publishing_queue",
-        "publishing_queue_audit",
-        "schemes_ir",
-        "sitelic",
-        "structures_ir",
-        "system_event",
-    )
-    # tuple of tuples: ( (query, comment), ...)
+    plan = mysql_post_import_plan(session)
+    print("mysql post import plan:")
+    for table, queries in plan.items():
+        for query in queries:
+            print(f"    {query}")
+    timings = {}
+    if dry_run:
+        return plan, timings
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_mysql_post_import_table, session, queries): table for table, queries in plan.items()}
+        for future in as_completed(futures):
+            table = futures[future]
+            seconds, error = future.result()
+            timings[table] = seconds
+            if error:
+                fail_msg(f"Error querying mysql server: {' '.join(plan[table])}")
+                print(f"   {error}")
+    print_table_timings("mysql post import", plan, timings)
+    return plan, timings
+
+
+def _mysql_post_import_table(session, queries):
+    started = perf_counter()
+    try:
+        session.execute_batch("mysql", queries)
+    except Exception as e:
+        return perf_counter() - started, e
+    return perf_counter() - started, None
+
+
+def mysql_post_import_plan(session):
+    """
+    {table: [statements]} for the tables that exist
+    - TRUNCATE instead of DELETE for tables emptied completely, with key checks off since other emptied tables reference them
+    - one ALTER TABLE per table for the boolean columns, leaving out columns that already have the right type
+      (the mysqldump preprocessing rewrites them) and the missing index when it exists
+    """
+    # tuple of tuples: ( (table, alter clause, index name, comment), ...)
     missing_migrations = (
-        ("CREATE INDEX workflow_idx_action_step ON workflow_action(step_id);", "dotCMS < 5.x may be missing this index"),
+        ("workflow_action", "ADD INDEX workflow_idx_action_step (step_id)", "workflow_idx_action_step", "dotCMS < 5.x may be missing this index"),
     )
+    columns = {}
+    for table, column, column_type, nullable in session.execute(
+        "mysql",
+        "SELECT table_name, column_name, column_type, is_nullable FROM information_schema.columns WHERE table_schema = %s",
+        (session.db,),
+        fetch=True,
+    ):
+        columns[(table.lower(), column.lower())] = (column_type.lower(), nullable == "YES")
+    tables = {table for table, _ in columns}
+    indexes = {
+        (table.lower(), index.lower())
+        for table, index in session.execute(
+            "mysql",
+            "SELECT DISTINCT table_name, index_name FROM information_schema.statistics WHERE table_schema = %s",
+            (session.db,),
+            fetch=True,
+        )
+    }
+    plan = {}
+    for table in dict.fromkeys(delete_from):
+        if table in tables:
+            plan[table] = ["SET FOREIGN_KEY_CHECKS=0;", f"TRUNCATE TABLE `{table}`;", "SET FOREIGN_KEY_CHECKS=1;"]
+    alters = {}
+    for table, modifies in alter_tables.items():
+        for modify in modifies:
+            column = re.match(r"`([^`]+)`", modify).group(1).lower()
+            wanted = (modify.split("`")[2].split()[0].lower(), "NOT NULL" not in modify.upper())
+            if (table, column) in columns and columns[(table, column)] != wanted:
+                alters.setdefault(table, []).append(f"MODIFY {modify.strip()}")
+    for table, clause, index, comment in missing_migrations:
+        if table in tables and (table, index) not in indexes:
+            print(f"# {comment}")
+            alters.setdefault(table, []).append(clause)
+    for table, clauses in alters.items():
+        plan.setdefault(table, []).append(f"ALTER TABLE `{table}` {', '.join(clauses)};")
+    return plan
 
 
-    cnx = mysql.connector.connect(**config)
-    cursor = cnx.cursor()
-    for table in delete_from:
-        try:
-            query = f"DELETE FROM `{table}`;"
-            cursor.execute(query)
-            success_msg(query)
-        except Exception as e:
-            fail_msg(f"Error querying mysql server: '{query}'")
-            print(f"   {e}")
-    for table, queries in alter_tables.items():
-        for modify in queries:
-            try:
-                query = f"ALTER TABLE `{table}` MODIFY {modify};"
-                cursor.execute(query)
-                success_msg(query)
-            except Exception as e:
-                fail_msg(f"Error querying mysql server: '{query}'")
-                print(f"   {e}")
-    for query, comment in missing_migrations:
-        try:
-            print(f"# {comment}")
-            cursor.execute(query)
-            success_msg(query)
-        except Exception as e:
-            fail_msg(f"Error querying mysql server: '{query}'")
-            print(f"   {e}")
-    cursor.close()
-    cnx.close()
+def print_table_timings(title, plan, timings):
+    table = Table(title=title)
+    table.add_column("table")
+    table.add_column("statements")
+    table.add_column("seconds", justify="right")
+    for name, seconds in sorted(timings.items(), key=lambda item: item[1], reverse=True):
+        statements = [query for query in plan[name] if not query.startswith("SET ")]
+        table.add_row(name, "\n".join(statements), f"{seconds:.2f}")
+    rich.print(table)
+    success_msg(f"{title}: {len(timings)} tables in {sum(timings.values()):.1f}s of statement time")
@@ -0,0 +1,275 @@
+"""
+Description: streaming helpers for mysqldump files
+- preprocess a dump before mysql loads it: drop data we would delete anyway, fix boolean columns
+- index a dump by table: CREATE TABLE statement and byte offsets of each table's section and data
+- import a dump into mysql over parallel client sessions, one table per session
+All helpers read the dump line by line as bytes, so memory use does not grow with the dump size
+"""
+
+import gzip
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import perf_counter
+
+import rich
+from rich.table import Table
+
+import migrate_db
+
+table_structure_re = re.compile(rb"^-- Table structure for table `([^`]+)`")
+create_table_re = re.compile(rb"^CREATE TABLE `([^`]+)`")
+insert_into_re = re.compile(rb"^INSERT INTO `([^`]+)`")
+# mysqldump writes these as "/*!40000 DROP DATABASE IF EXISTS `db`*/;", "CREATE DATABASE /*!32312 ...", "USE `db`;"
+database_statement_re = re.compile(rb"^(/\*!\d+ )?(DROP DATABASE|CREATE DATABASE|USE `)", re.IGNORECASE)
+tinyint_column_re = re.compile(rb"^(\s*`([^`]+)`\s+)tinyint\(\d+\)")
+
+
+def is_gzip(path):
+    with open(path, "rb") as f:
+        return f.read(2) == b"\x1f\x8b"
+
+
+def open_dump(path):
+    """ open a plain or gzipped mysqldump file for binary reading """
+    if is_gzip(path):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def index_dump(mysqldump_file):
+    """
+    scan a plain mysqldump file once and return {table: section} in dump order
+    - start/end: byte offsets of the "-- Table structure for table" section (the last one ends at EOF)
+    - create: the CREATE TABLE statement
+    - create_end: byte offset where the table's schema ends and its data (LOCK TABLES, INSERTs, triggers) starts
+    - data_start/data_end/data_bytes: byte range covering the table's INSERT statements
+    - rows: rows in the INSERTs, counted from the "),(" tuple separators so it can run high for text containing one
+    offsets are only meaningful for uncompressed files, since sections are read back with seek()
+    """
+    tables = {}
+    table = None
+    create = None
+    offset = 0
+    with open_dump(mysqldump_file) as f:
+        for line in f:
+            if line.startswith(b"-- Table structure for table "):
+                match = table_structure_re.match(line)
+                if table is not None:
+                    table["end"] = offset
+                table = {
+                    "start": offset,
+                    "end": None,
+                    "create": b"",
+                    "create_end": None,
+                    "data_start": None,
+                    "data_end": None,
+                    "data_bytes": 0,
+                    "rows": 0,
+                }
+                tables[match.group(1).decode()] = table
+            elif table is not None:
+                if line.startswith(b"INSERT INTO "):
+                    if table["data_start"] is None:
+                        table["data_start"] = offset
+                    table["data_end"] = offset + len(line)
+                    table["data_bytes"] += len(line)
+                    table["rows"] += line.count(b"),(") + 1
+                elif line.startswith(b"CREATE TABLE "):
+                    create = [line]
+                elif create is not None:
+                    create.append(line)
+                    if line.startswith(b")"):
+                        table["create"] = b"".join(create)
+                        table["create_end"] = offset + len(line)
+                        create = None
+                elif table["create_end"] == offset and line.startswith(b"/*!40101 SET character_set_client = @saved_cs_client"):
+                    # keep the session variable restore with the CREATE TABLE it belongs to
+                    table["create_end"] += len(line)
+            offset += len(line)
+    if table is not None:
+        table["end"] = offset
+    return tables
+
+
+def row_targets(mysqldump_file, skip_deleted=False):
+    """ {table: rows} expected after loading the dump, skip_deleted zeroes the tables migrate_db empties """
+    targets = {name: table["rows"] for name, table in index_dump(mysqldump_file).items()}
+    if skip_deleted:
+        for name in targets:
+            if name.lower() in migrate_db.delete_from:
+                targets[name] = 0
+    return targets
+
+
+def boolean_columns():
+    """ {table: {column, ...}} for the tinyint(4) columns dotcms uses as booleans """
+    columns = {}
+    for table, modifies in migrate_db.alter_tables.items():
+        columns[table] = {re.match(r"`([^`]+)`", modify).group(1) for modify in modifies}
+    return columns
+
+
+def preprocess_dump(mysqldump_file, preprocessed_file):
+    """
+    write a slimmed copy of a mysqldump file:
+    - INSERTs for the tables in migrate_db.delete_from are dropped
+    - DROP/CREATE DATABASE and USE statements are dropped, the mysql init file creates the db
+    - tinyint(4) columns in migrate_db.alter_tables are rewritten to tinyint(1) in CREATE TABLE
+    returns a per-table report of what was removed or rewritten
+    """
+    delete_from = {table.encode() for table in migrate_db.delete_from}
+    rewrite_columns = {
+        table.encode(): {column.encode() for column in columns}
+        for table, columns in boolean_columns().items()
+    }
+    report = {}
+    statements_removed = []
+    create_table = None
+    bytes_read = 0
+    bytes_written = 0
+    with open_dump(mysqldump_file) as src, open(preprocessed_file, "wb") as dst:
+        for line in src:
+            bytes_read += len(line)
+            if line.startswith(b"INSERT INTO "):
+                match = insert_into_re.match(line)
+                if match and match.group(1).lower() in delete_from:
+                    table = report.setdefault(match.group(1).decode(), _table_report())
+                    table["inserts_removed"] += 1
+                    table["bytes_removed"] += len(line)
+                    continue
+            elif create_table is not None:
+                if line.startswith(b")"):
+                    create_table = None
+                elif create_table in rewrite_columns:
+                    match = tinyint_column_re.match(line)
+                    if match and match.group(2).lower() in rewrite_columns[create_table]:
+                        line = tinyint_column_re.sub(rb"\1tinyint(1)", line, count=1)
+                        table = report.setdefault(create_table.decode(), _table_report())
+                        table["columns_rewritten"].append(match.group(2).decode())
+            elif line.startswith(b"CREATE TABLE "):
+                match = create_table_re.match(line)
+                create_table = match.group(1).lower() if match else None
+            elif database_statement_re.match(line):
+                statements_removed.append(line.decode(errors="replace").strip())
+                continue
+            dst.write(line)
+            bytes_written += len(line)
+    print_preprocess_report(report, statements_removed, bytes_read, bytes_written)
+    return {
+        "tables": report,
+        "statements_removed": statements_removed,
+        "bytes_read": bytes_read,
+        "bytes_written": bytes_written,
+    }
+
+
+def _table_report():
+    return {"inserts_removed": 0, "bytes_removed": 0, "columns_rewritten": []}
+
+
+def print_preprocess_report(report, statements_removed, bytes_read, bytes_written):
+    table = Table(title="mysqldump preprocessing")
+    table.add_column("table")
+    table.add_column("INSERTs removed", justify="right")
+    table.add_column("MB removed", justify="right")
+    table.add_column("columns -> tinyint(1)")
+    for name, removed in sorted(report.items()):
+        table.add_row(
+            name,
+            str(removed["inserts_removed"]),
+            f"{removed['bytes_removed'] / 1024 / 1024:.1f}",
+            ", ".join(removed["columns_rewritten"]),
+        )
+    rich.print(table)
+    for statement in statements_removed:
+        print(f"    removed: {statement}")
+    migrate_db.success_msg(
+        f"preprocessed mysqldump: {bytes_read / 1024 / 1024:.1f} MB -> {bytes_written / 1024 / 1024:.1f} MB"
+    )
+
+
+def import_parallel(mysqldump_file, mysql_command, workers=4):
+    """
+    load an uncompressed mysqldump file over parallel mysql client sessions
+    mysql_command runs a mysql client reading SQL from stdin, e.g. ["docker", "exec", "-i", cid, "mysql", ...]
+    - the dump is split on the "-- Table structure for table" markers by byte offset, nothing is copied to disk
+    - all CREATE TABLE statements run first in one session
+    - then each table's data runs in its own session, largest tables first, with key checks disabled
+    returns {table: {"bytes": n, "seconds": n}}
+    """
+    if is_gzip(mysqldump_file):
+        raise ValueError(f"{mysqldump_file} is gzipped, the parallel import needs an uncompressed (preprocessed) dump")
+    tables = index_dump(mysqldump_file)
+    if not tables:
+        raise ValueError(f"no '-- Table structure for table' markers in {mysqldump_file}, was it dumped with --skip-comments?")
+    with open(mysqldump_file, "rb") as f:
+        header = f.read(min(table["start"] for table in tables.values()))
+    header += b"SET FOREIGN_KEY_CHECKS=0;\nSET UNIQUE_CHECKS=0;\n"
+    started = perf_counter()
+    schema_ranges = [(table["start"], table["create_end"] or table["end"]) for table in tables.values()]
+    _run_mysql(mysql_command, mysqldump_file, header, schema_ranges)
+    migrate_db.success_msg(f"created {len(tables)} tables in {perf_counter() - started:.1f}s")
+    jobs = sorted(
+        ((name, table) for name, table in tables.items() if table["create_end"]),
+        key=lambda item: item[1]["end"] - item[1]["create_end"],
+        reverse=True,
+    )
+    timings = {}
+    rich.print(f"loading data for {len(jobs)} tables over {workers} mysql sessions")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_run_mysql, mysql_command, mysqldump_file, header, [(table["create_end"], table["end"])]): name
+            for name, table in jobs
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            seconds = future.result()
+            timings[name] = {"bytes": tables[name]["data_bytes"], "seconds": seconds}
+            migrate_db.success_msg(f"mysql loaded {name}: {tables[name]['data_bytes'] / 1024 / 1024:.1f} MB in {seconds:.1f}s")
+    print_import_report(timings, perf_counter() - started)
+    return timings
+
+
+def _run_mysql(mysql_command, mysqldump_file, header, ranges):
+    """ pipe the header and the byte ranges of the dump into one mysql client session """
+    started = perf_counter()
+    process = subprocess.Popen(mysql_command, stdin=subprocess.PIPE)
+    try:
+        process.stdin.write(header)
+        with open(mysqldump_file, "rb") as f:
+            for start, end in ranges:
+                f.seek(start)
+                _copy_range(f, process.stdin, end - start)
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+    if process.wait():
+        raise subprocess.CalledProcessError(process.returncode, mysql_command)
+    return perf_counter() - started
+
+
+def _copy_range(src, dst, size, block_size=1024 * 1024):
+    while size > 0:
+        block = src.read(min(block_size, size))
+        if not block:
+            break
+        dst.write(block)
+        size -= len(block)
+
+
+def print_import_report(timings, seconds):
+    table = Table(title="parallel mysql import")
+    table.add_column("table")
+    table.add_column("MB", justify="right")
+    table.add_column("seconds", justify="right")
+    table.add_column("MB/s", justify="right")
+    for name, timing in sorted(timings.items(), key=lambda item: item[1]["seconds"], reverse=True):
+        table.add_row(
+            name,
+            f"{timing['bytes'] / 1024 / 1024:.1f}",
+            f"{timing['seconds']:.1f}",
+            f"{timing['bytes'] / 1024 / 1024 / timing['seconds']:.1f}" if timing["seconds"] else "-",
+        )
+    rich.print(table)
+    migrate_db.success_msg(f"mysql import finished in {seconds:.1f}s")
@@ -0,0 +1,85 @@
+"""
+Description: work of a migrate run that overlaps the stages in front of it
+- Background runs tasks in threads: "docker pull" of the images later phases need while mysql loads the dump,
+  postgres and opensearch starting up while the stages before the ones needing them run
+- the stage that needs a task waits for it with wait(); the task's seconds minus the seconds waited for it
+  are the time the overlap saved, listed in the run report
+"""
+
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import rich
+
+import migrate_db
+
+background_workers = 4
+
+
+def pull_image(image):
+    """ docker pull unless the image is there already, True when it was pulled """
+    if subprocess.run(["docker", "image", "inspect", image], capture_output=True).returncode == 0:
+        return False
+    subprocess.run(["docker", "pull", "-q", image], capture_output=True, text=True, check=True)
+    return True
+
+
+class Background:
+    def __init__(self, run_report, workers=background_workers):
+        self.run_report = run_report
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="background")
+        self.futures = {} # name: (future, task)
+
+    def start(self, name, fn, *args):
+        """ run fn(*args) in the background unless a task of that name runs already """
+        if name in self.futures:
+            return
+        task = {"name": name, "status": "running", "seconds": None, "waited": None, "saved": None}
+        self.run_report.background.append(task)
+
+        def run():
+            started = perf_counter()
+            try:
+                result = fn(*args)
+                task["status"] = "ok"
+                return result
+            except Exception:
+                task["status"] = "failed"
+                raise
+            finally:
+                task["seconds"] = perf_counter() - started
+
+        self.futures[name] = (self.executor.submit(run), task)
+        rich.print(f":twisted_rightwards_arrows: {name}: started in the background")
+
+    def running(self, name):
+        return name in self.futures
+
+    def wait(self, name, required=False):
+        """
+        result of a background task once it is done, None if it wasn't started;
+        its error is raised when required, otherwise reported and the stage goes on without it
+        """
+        if name not in self.futures:
+            return None
+        future, task = self.futures.pop(name)
+        started = perf_counter()
+        try:
+            return future.result()
+        except Exception as e:
+            if required:
+                raise
+            migrate_db.fail_msg(f"{name} failed in the background, going on without it")
+            print(f"   {e}")
+            return None
+        finally:
+            task["waited"] = perf_counter() - started
+            if task["status"] == "ok":
+                task["saved"] = max(0.0, task["seconds"] - task["waited"])
+                rich.print(f":twisted_rightwards_arrows: {name}: done, {task['saved']:.1f}s of {task['seconds']:.1f}s overlapped")
+
+    def close(self):
+        """ tasks nobody waited for are left to finish, their results are dropped """
+        self.executor.shutdown(wait=False)
+        self.futures = {}
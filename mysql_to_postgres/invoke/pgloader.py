@@ -0,0 +1,333 @@
+"""
+Description: pgloader settings sized from the mysql table statistics, and what the copy did from pgloader's output
+- small tables get the largest batches, bigger tables a batch size from their average row length, so a batch stays around batch_bytes in memory;
+  tables with blob/text columns get a quarter of that, their rows vary a lot around the average
+- tables with many rows are read by several readers per thread, split by rows per range
+- tables with the same settings share one LOAD DATABASE command of a load file (see Template.write_pgloader_shard_files),
+  the default group takes every table not named in another group, so tables created after the stats are still copied
+- the tables are bin packed by bytes over one or more pgloader services copying at the same time
+- after the copy, the summary table pgloader prints per load command is parsed into per-table rows read and imported,
+  errors, bytes and seconds, with rows/s and MB/s; errors, ERROR lines and a missing summary fail the migration,
+  the slowest tables show where the batch sizes and readers above are worth tuning
+"""
+
+import re
+
+import rich
+from rich.table import Table
+
+import migrate_db, tuning
+
+# batch sizes in rows, a table's batch size is rounded down to one of these so few load commands are needed
+batch_tiers = (100000, 25000, 5000, 1000, 250)
+batch_bytes = 64 * 1024 * 1024 # target memory per batch
+blob_types = ("blob", "tinyblob", "mediumblob", "longblob", "text", "mediumtext", "longtext")
+rows_per_range = 50000
+# tables with more rows than this get multiple readers per thread
+multiple_readers_rows = 4 * rows_per_range
+
+table_stats_query = """
+    SELECT t.table_name, t.table_rows, t.avg_row_length, t.data_length,
+        SUM(c.data_type IN ({})) AS blob_columns
+    FROM information_schema.tables t
+    JOIN information_schema.columns c ON c.table_schema = t.table_schema AND c.table_name = t.table_name
+    WHERE t.table_schema = %s AND t.table_type = 'BASE TABLE'
+    GROUP BY t.table_name, t.table_rows, t.avg_row_length, t.data_length
+""".format(", ".join(f"'{data_type}'" for data_type in blob_types))
+
+
+def table_stats(session):
+    """ {table: {"rows", "avg_row_length", "bytes", "blob_columns"}} from information_schema, refreshed first """
+    with session.connection("mysql") as cnx:
+        cursor = cnx.cursor()
+        try:
+            cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+        except Exception:
+            # mysql 5.7 has no stats cache
+            pass
+        cursor.execute(table_stats_query, (session.db,))
+        rows = cursor.fetchall()
+        cursor.close()
+    return {
+        table: {
+            "rows": int(table_rows or 0),
+            "avg_row_length": int(avg_row_length or 0),
+            "bytes": int(data_length or 0),
+            "blob_columns": int(blob_columns or 0),
+        }
+        for table, table_rows, avg_row_length, data_length, blob_columns in rows
+    }
+
+
+def table_settings(stats):
+    """ pgloader settings for one table """
+    budget = batch_bytes // 4 if stats["blob_columns"] else batch_bytes
+    # a table smaller than one batch is read in one go whatever its row length
+    batch_rows = budget // max(stats["avg_row_length"], 1) if stats["bytes"] > budget else batch_tiers[0]
+    batch_rows = next((tier for tier in batch_tiers if tier <= batch_rows), batch_tiers[-1])
+    return {
+        "batch_rows": batch_rows,
+        "multiple_readers": stats["rows"] > multiple_readers_rows,
+    }
+
+
+def load_groups(stats, cpus=None, catch_all=True):
+    """
+    [{"tables": [names] or None for the default group, "with": [pgloader WITH options]}]
+    largest groups (by bytes) first, the default group holds the small tables with the largest batches;
+    without catch_all it names its tables too and is left out when it has none
+    """
+    cpus = cpus or tuning.host_resources()[1]
+    grouped = {}
+    for table, table_stats in stats.items():
+        settings = table_settings(table_stats)
+        group = grouped.setdefault((settings["batch_rows"], settings["multiple_readers"]), {"tables": [], "bytes": 0})
+        group["tables"].append(table)
+        group["bytes"] += table_stats["bytes"]
+    default = (batch_tiers[0], False)
+    if catch_all:
+        grouped.setdefault(default, {"tables": [], "bytes": 0})
+    groups = []
+    for (batch_rows, multiple_readers), group in sorted(grouped.items(), key=lambda item: item[1]["bytes"], reverse=True):
+        options = [
+            f"workers = {cpus}",
+            f"concurrency = {min(4, max(1, cpus // 2)) if multiple_readers else 1}",
+            f"batch rows = {batch_rows}",
+            f"prefetch rows = {batch_rows}",
+        ]
+        if multiple_readers:
+            options += ["multiple readers per thread", f"rows per range = {rows_per_range}"]
+        groups.append({
+            "tables": None if catch_all and (batch_rows, multiple_readers) == default else sorted(group["tables"]),
+            "with": options,
+            "bytes": group["bytes"],
+        })
+    return groups
+
+
+def shard_tables(stats, shards):
+    """
+    split the tables into at most `shards` sets of about the same bytes: largest table first, each to the lightest shard.
+    returns [{table: stats}], heaviest shard first, empty shards dropped
+    """
+    bins = [{"tables": {}, "bytes": 0} for _ in range(max(1, shards))]
+    for table, table_stats in sorted(stats.items(), key=lambda item: item[1]["bytes"], reverse=True):
+        lightest = min(bins, key=lambda shard: shard["bytes"])
+        lightest["tables"][table] = table_stats
+        lightest["bytes"] += table_stats["bytes"]
+    return [shard["tables"] for shard in sorted(bins, key=lambda shard: shard["bytes"], reverse=True) if shard["tables"]] or [{}]
+
+
+def shard_groups(stats, shards, cpus=None):
+    """
+    load_groups() per shard, the cpus are split between the shards.
+    the last (lightest) shard takes the tables the stats don't know about, its "excluded" lists the other shards' tables
+    """
+    cpus = cpus or tuning.host_resources()[1]
+    tables = shard_tables(stats, shards)
+    shard_cpus = max(1, cpus // len(tables))
+    plan = []
+    for number, shard in enumerate(tables, 1):
+        last = number == len(tables)
+        plan.append({
+            "shard": number,
+            "bytes": sum(table_stats["bytes"] for table_stats in shard.values()),
+            "groups": load_groups(shard, shard_cpus, catch_all=last),
+            "excluded": sorted(table for other in tables if other is not shard for table in other) if last else [],
+        })
+    return plan
+
+
+log_file_name = "pgloader.log"
+# a summary is a header line, then dashed lines between its sections: steps before the copy, tables, steps after it
+summary_separator_re = re.compile(r"^\s*-{3,}(\s+-{3,})+\s*$")
+# ERROR and FATAL lines of pgloader's log, e.g. "2023-04-12T10:36:24.075000Z ERROR Database error 22P02: ..."
+log_error_re = re.compile(r"^\S+\s+(ERROR|FATAL)\s")
+log_line_re = re.compile(r"^\d{4}-\d\d-\d\dT")
+duration_re = re.compile(r"^(?:(\d+)h)?(?:(\d+)m)?([\d.]+)s$")
+size_re = re.compile(r"^([\d.]+)\s*([kMGT]?B)$")
+size_units = {"B": 1, "kB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4}
+# header name: metric; older pgloader versions print "rows" instead of "read" and "imported"
+summary_columns = {
+    "table name": "name",
+    "errors": "errors",
+    "rows": "rows",
+    "read": "rows_read",
+    "imported": "rows_imported",
+    "bytes": "bytes",
+    "total time": "seconds",
+}
+slowest_tables = 10
+
+
+def parse_duration(value):
+    """ "1m23.456s" -> 83.456 """
+    match = duration_re.match(value)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours or 0) * 3600 + int(minutes or 0) * 60 + float(seconds)
+
+
+def parse_size(value):
+    """ "3.1 MB" -> bytes """
+    match = size_re.match(value)
+    return int(float(match.group(1)) * size_units[match.group(2)]) if match else None
+
+
+def summary_cells(line, ends):
+    """ the cells of a summary line, right aligned so each runs from the end of the column before to its own end """
+    starts = [0] + ends[:-1]
+    return [line[start:end].strip() for start, end in zip(starts, ends)]
+
+
+def summary_keys(names):
+    # the second read and write columns are the seconds spent reading and writing
+    keys = []
+    for name in names:
+        if name in ("read", "write") and "seconds" in keys:
+            keys.append(f"{name}_seconds")
+        else:
+            keys.append(summary_columns.get(name, name))
+    return keys
+
+
+def summary_row(keys, cells):
+    row = {}
+    for key, cell in zip(keys, cells):
+        if key == "name":
+            row[key] = cell.replace('"', "")
+        elif key == "errors":
+            # the total line has a check mark instead of 0
+            row[key] = int(cell) if cell.isdigit() else 0
+        elif key in ("rows", "rows_read", "rows_imported"):
+            row[key] = int(cell) if cell.isdigit() else None
+        elif key == "bytes":
+            row[key] = parse_size(cell)
+        elif key.endswith("seconds"):
+            row[key] = parse_duration(cell)
+    if "rows" in row:
+        row["rows_read"] = row["rows_imported"] = row.pop("rows")
+    return row
+
+
+def add_metrics(total, row):
+    """ sum a row into total, a table or step can show up in the summary of several commands and services """
+    for key, value in row.items():
+        if key != "name" and value is not None:
+            total[key] = (total.get(key) or 0) + value
+
+
+def parse_summary(log):
+    """
+    {"tables": {table: metrics}, "steps": {step: metrics}, "seconds"} from the summaries in pgloader's output,
+    metrics: errors, rows_read, rows_imported, bytes, seconds and, from newer pgloader versions, read_seconds and write_seconds;
+    tables are named without their schema, "seconds" is the total import time of every summary
+    """
+    lines = log.splitlines()
+    summary = {"tables": {}, "steps": {}, "seconds": 0.0}
+    for number, line in enumerate(lines):
+        if not number or not summary_separator_re.match(line) or "table name" not in lines[number - 1]:
+            continue
+        ends = [match.end() for match in re.finditer(r"-+", line)]
+        keys = summary_keys(re.split(r"\s{2,}", lines[number - 1].strip()))
+        for row_line in lines[number + 1:]:
+            if not row_line.strip() or log_line_re.match(row_line):
+                break
+            if summary_separator_re.match(row_line):
+                continue
+            row = summary_row(keys, summary_cells(row_line, ends))
+            name = row.get("name", "")
+            if name == "Total import time":
+                summary["seconds"] += row.get("seconds") or 0
+                break
+            if "." in name and " " not in name:
+                add_metrics(summary["tables"].setdefault(name.split(".")[-1], {}), row)
+            else:
+                add_metrics(summary["steps"].setdefault(name, {}), row)
+    for metrics in summary["tables"].values():
+        seconds, nbytes = metrics.get("seconds") or 0, metrics.get("bytes") or 0
+        metrics["rows_per_second"] = (metrics.get("rows_imported") or 0) / seconds if seconds else None
+        metrics["mb_per_second"] = nbytes / tuning.megabyte / seconds if seconds else None
+    return summary
+
+
+def log_errors(log):
+    """ the ERROR and FATAL lines of pgloader's output, each once """
+    return list(dict.fromkeys(line.strip() for line in log.splitlines() if log_error_re.match(line)))
+
+
+def copy_report(log, row_targets=None):
+    """
+    parse and print what the copy did, returns {"tables", "steps", "seconds", "slowest", "log_errors", "errors", "warnings"};
+    errors are the tables and steps pgloader counted errors for, tables with rows it read but did not import,
+    ERROR and FATAL lines in the log and a missing table summary (pgloader crashed, or printed something else);
+    warnings the tables with rows in the dump (row_targets) that pgloader did not copy, e.g. dropped by a dotcms upgrade
+    """
+    summary = parse_summary(log)
+    tables = summary["tables"]
+    errors = [] if tables else [f"no table summary in the pgloader output, see {log_file_name}"]
+    errors += [f"{name}: {metrics['errors']} errors" for name, metrics in {**summary["steps"], **tables}.items() if metrics.get("errors")]
+    errors += [
+        f"{table}: {metrics['rows_imported']:,} of {metrics['rows_read']:,} rows imported"
+        for table, metrics in tables.items()
+        if (metrics.get("rows_imported") or 0) < (metrics.get("rows_read") or 0)
+    ]
+    copied = {table.lower() for table, metrics in tables.items() if metrics.get("rows_imported")}
+    warnings = [
+        f"{table}: {rows:,} rows in the dump, none copied"
+        for table, rows in sorted((row_targets or {}).items())
+        if rows and table.lower() not in copied
+    ] if tables else []
+    error_lines = log_errors(log)
+    if error_lines:
+        errors.append(f"{len(error_lines)} ERROR or FATAL lines in the pgloader output, see {log_file_name}")
+    slowest = sorted(tables, key=lambda table: tables[table].get("seconds") or 0, reverse=True)[:slowest_tables]
+    report = {**summary, "slowest": slowest, "log_errors": error_lines, "errors": errors, "warnings": warnings}
+    print_copy(report)
+    return report
+
+
+def print_copy(report):
+    tables = report["tables"]
+    if tables:
+        print_tables(report)
+    for warning in report["warnings"]:
+        migrate_db.fail_msg(warning)
+    for error in report["errors"]:
+        migrate_db.fail_msg(error)
+    if not report["errors"]:
+        nbytes = sum(metrics.get("bytes") or 0 for metrics in tables.values())
+        rows = sum(metrics.get("rows_imported") or 0 for metrics in tables.values())
+        migrate_db.success_msg(
+            f"pgloader: {rows:,} rows, {nbytes / tuning.megabyte:,.1f} MB in {len(tables)} tables, "
+            f"{report['seconds']:.1f}s import time"
+        )
+
+
+def print_tables(report):
+    tables = report["tables"]
+    table_seconds = sum(metrics.get("seconds") or 0 for metrics in tables.values())
+    table = Table(title=f"pgloader copy, slowest {len(report['slowest'])} of {len(tables)} tables")
+    table.add_column("table")
+    table.add_column("rows imported", justify="right")
+    table.add_column("errors", justify="right")
+    table.add_column("MB", justify="right")
+    table.add_column("seconds", justify="right")
+    table.add_column("% of table time", justify="right")
+    table.add_column("rows/s", justify="right")
+    table.add_column("MB/s", justify="right")
+    for name in report["slowest"]:
+        metrics = tables[name]
+        seconds = metrics.get("seconds") or 0
+        table.add_row(
+            name if not metrics.get("errors") else f"[red]{name}",
+            f"{metrics.get('rows_imported') or 0:,}",
+            str(metrics.get("errors") or 0),
+            f"{(metrics.get('bytes') or 0) / tuning.megabyte:,.1f}",
+            f"{seconds:.1f}",
+            f"{100 * seconds / table_seconds:.0f}" if table_seconds else "-",
+            f"{metrics['rows_per_second']:,.0f}" if metrics["rows_per_second"] is not None else "-",
+            f"{metrics['mb_per_second']:,.1f}" if metrics["mb_per_second"] is not None else "-",
+        )
+    rich.print(table)
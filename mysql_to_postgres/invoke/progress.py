@@ -0,0 +1,166 @@
+"""
+Description: live per-table progress while mysql loads the dump and while pgloader copies it
+- a background thread samples the row count of every table on one pooled connection
+  (mysql: information_schema.tables.table_rows, postgres: pg_stat_user_tables.n_live_tup, both estimates)
+- progress is rendered as a rich table with rows/s and an ETA per table and overall, against row targets from the dump
+- a table that stops moving before reaching its target is flagged as stalled
+"""
+
+import threading
+from time import monotonic
+
+from rich.live import Live
+from rich.table import Table
+
+sample_every = 10 # seconds
+stalled_after = 120 # seconds without new rows
+rows_shown = 15 # busiest tables shown, the overall row covers all of them
+
+mysql_rows_query = """
+    SELECT table_name, table_rows FROM information_schema.tables
+    WHERE table_schema = %s AND table_type = 'BASE TABLE'
+"""
+# pgloader loads into a schema named like the mysql db, postgres_post_import later moves it to public
+postgres_rows_query = """
+    SELECT relname, n_live_tup FROM pg_stat_user_tables WHERE schemaname IN (%s, 'public')
+"""
+
+
+class ProgressMonitor:
+    """
+    with ProgressMonitor(session, "mysql", targets, "mysql import"):
+        ... long running load ...
+    """
+    def __init__(self, session, kind, targets, title, interval=sample_every):
+        self.session = session
+        self.kind = kind
+        self.targets = {table.lower(): rows for table, rows in targets.items() if rows}
+        self.title = title
+        self.interval = interval
+        self.started = None
+        self.tables = {} # table: {"rows", "rate", "moved", "sampled"}
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._live = None
+
+    def __enter__(self):
+        self.started = monotonic()
+        self._live = Live(self.render(), refresh_per_second=1, transient=False)
+        self._live.start()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._live.update(self.render())
+        self._live.stop()
+        return False
+
+    def _run(self):
+        # one connection for the whole run, reconnect if the db is not up yet or went away
+        while not self._stop.is_set():
+            try:
+                with self.session.connection(self.kind) as cnx:
+                    self._prepare(cnx)
+                    while not self._stop.is_set():
+                        self._sample(cnx)
+                        self._live.update(self.render())
+                        self._stop.wait(self.interval)
+            except Exception as e:
+                self.error = e
+                self._stop.wait(self.interval)
+
+    def _prepare(self, cnx):
+        if self.kind == "mysql":
+            cursor = cnx.cursor()
+            try:
+                # mysql 8 caches table statistics for a day by default
+                cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+            except Exception:
+                pass
+            cursor.close()
+
+    def _sample(self, cnx):
+        cursor = cnx.cursor()
+        try:
+            cursor.execute(mysql_rows_query if self.kind == "mysql" else postgres_rows_query, (self.session.db,))
+            counts = cursor.fetchall()
+        finally:
+            cursor.close()
+        if self.kind == "postgres":
+            # statistics are read once per transaction
+            cnx.rollback()
+        now = monotonic()
+        self.error = None
+        for table, rows in counts:
+            self.update(str(table).lower(), int(rows or 0), now)
+
+    def update(self, table, rows, now):
+        """ record a sample, rates are smoothed so one slow sample does not swing the ETA """
+        previous = self.tables.get(table)
+        if previous is None:
+            self.tables[table] = {"rows": rows, "rate": 0.0, "moved": now, "sampled": now}
+            return
+        elapsed = now - previous["sampled"]
+        if elapsed <= 0:
+            return
+        rate = max(rows - previous["rows"], 0) / elapsed
+        previous["rate"] = rate if not previous["rate"] else 0.5 * previous["rate"] + 0.5 * rate
+        if rows != previous["rows"]:
+            previous["moved"] = now
+        previous["rows"] = rows
+        previous["sampled"] = now
+
+    def _eta(self, remaining, rate):
+        if remaining <= 0:
+            return "done"
+        if not rate:
+            return "-"
+        seconds = int(remaining / rate)
+        return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+    def render(self):
+        elapsed = int(monotonic() - self.started) if self.started else 0
+        table = Table(title=f"{self.title} progress, {elapsed // 60}m{elapsed % 60:02}s")
+        table.add_column("table")
+        table.add_column("rows", justify="right")
+        table.add_column("target", justify="right")
+        table.add_column("%", justify="right")
+        table.add_column("rows/s", justify="right")
+        table.add_column("ETA", justify="right")
+        now = monotonic()
+        rows = []
+        for name, target in self.targets.items():
+            sample = self.tables.get(name, {"rows": 0, "rate": 0.0, "moved": self.started or now})
+            remaining = target - sample["rows"]
+            stalled = 0 < remaining and sample["rows"] and now - sample["moved"] > stalled_after
+            rows.append((name, sample, target, remaining, stalled))
+        # stalled tables first, then the ones with the most left to load
+        rows.sort(key=lambda row: (not row[4], -row[3]))
+        for name, sample, target, remaining, stalled in rows[:rows_shown]:
+            table.add_row(
+                f"[yellow]{name} (stalled)[/yellow]" if stalled else name,
+                f"{sample['rows']:,}",
+                f"{target:,}",
+                f"{min(100, 100 * sample['rows'] / target):.0f}",
+                f"{sample['rate']:,.0f}",
+                self._eta(remaining, sample["rate"]),
+            )
+        total = sum(self.targets.values())
+        loaded = sum(min(self.tables.get(name, {"rows": 0})["rows"], target) for name, target in self.targets.items())
+        rate = sum(sample["rate"] for name, sample in self.tables.items() if name in self.targets)
+        table.add_section()
+        table.add_row(
+            f"[bold]all {len(self.targets)} tables",
+            f"{loaded:,}",
+            f"{total:,}",
+            f"{100 * loaded / total:.0f}" if total else "-",
+            f"{rate:,.0f}",
+            self._eta(total - loaded, rate),
+        )
+        if self.error:
+            table.caption = f"waiting for {self.kind}: {self.error}"
+        return table
+
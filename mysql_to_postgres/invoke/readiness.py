@@ -0,0 +1,197 @@
+"""
+Description: readiness detection for the migration phases
+- probes (tcp, http, sql) are retried with exponential backoff starting in milliseconds, no sleep before the first try
+- an optional log follower (e.g. "docker compose logs -f mysql") wakes the probe up as soon as
+  the service logs its ready line, instead of waiting for the next poll
+- deadlines are derived from the size of the mysqldump file instead of fixed attempt counts
+"""
+
+import json
+import os
+import re
+import socket
+import subprocess
+import threading
+from datetime import datetime
+from time import monotonic, sleep
+from urllib.request import Request, urlopen
+
+import rich
+
+gigabyte = 1024 * 1024 * 1024
+# a 16G mysqldump with ~1M contentlets took about 2.25 hours end to end, these leave plenty of headroom
+# phase: (minimum seconds, seconds per GB of mysqldump)
+phase_deadlines = {
+    "mysql_start": (300, 0),
+    "mysql_load": (600, 900),
+    "dotcms_mysql": (900, 300),
+    "pgloader": (600, 900),
+    "postgres_start": (300, 0),
+    "opensearch_start": (300, 0),
+    "dotcms_postgres": (900, 120),
+}
+# ready lines in the service logs
+# mysqld logs "ready for connections" and then "Version: ... socket: ... port: 3306",
+# the temporary server the image runs the init files with listens on port 0
+mysql_ready_log = r"socket: .*port: 3306"
+postgres_ready_log = r"database system is ready to accept connections"
+pgloader_done_log = r"Total import time"
+opensearch_ready_log = r"o\.o\.n\.Node.*\] started"
+dotcms_ready_log = r"Server startup in"
+status_every = 60 # seconds between "still waiting" messages
+
+
+def deadline(phase, dump_bytes, factor=1.0):
+    """ seconds to wait for a phase, scaled by the mysqldump size """
+    minimum, per_gigabyte = phase_deadlines[phase]
+    return factor * max(minimum, per_gigabyte * dump_bytes / gigabyte)
+
+
+def dump_size(mysqldump_file):
+    """ size of the uncompressed dump, gzipped dumps are read from the gzip trailer (exact below 4G) """
+    size = os.path.getsize(mysqldump_file)
+    with open(mysqldump_file, "rb") as f:
+        if f.read(2) != b"\x1f\x8b":
+            return size
+        f.seek(-4, os.SEEK_END)
+        uncompressed = int.from_bytes(f.read(4), "little")
+    # the trailer holds the size modulo 4G, dumps compress at least 4:1
+    return max(uncompressed, size * 4)
+
+
+def compose_logs(compose_file, *services):
+    """ command following compose services' logs """
+    return ["docker", "compose", "-f", str(compose_file), "logs", "--follow", "--no-log-prefix", *services]
+
+
+def tcp_probe(host, port):
+    def probe():
+        with socket.create_connection((host, port), timeout=2):
+            return True
+    return probe
+
+
+def http_probe(url):
+    def probe():
+        with urlopen(Request(url), timeout=10) as response:
+            return 200 <= response.status < 300
+    return probe
+
+
+def opensearch_probe(compose_file):
+    """ true once opensearch answers with a green or yellow cluster, asked from inside its container """
+    def probe():
+        result = subprocess.run(
+            ["docker", "compose", "-f", str(compose_file), "exec", "-T", "opensearch",
+             "curl", "-sk", "-u", "admin:admin", "https://localhost:9200/_cluster/health"],
+            capture_output=True, text=True, check=True,
+        )
+        return json.loads(result.stdout)["status"] in ("green", "yellow")
+    return probe
+
+
+def service_exited_probe(compose_file, *services):
+    """ true once compose services ran to completion, e.g. pgloader """
+    def probe():
+        result = subprocess.run(
+            ["docker", "compose", "-f", str(compose_file), "ps", "--all", "--status", "exited", "--services"],
+            capture_output=True, text=True, check=True,
+        )
+        return set(services) <= set(result.stdout.split())
+    return probe
+
+
+def service_runs(compose_file, *services):
+    """ {service: {"seconds", "exit_code"}} of exited compose services, from the container start and finish times """
+    runs = {}
+    for service in services:
+        cid = subprocess.run(
+            ["docker", "compose", "-f", str(compose_file), "ps", "--all", "-q", service],
+            capture_output=True, text=True, check=True,
+        ).stdout.split()[0]
+        started, finished, exit_code = subprocess.run(
+            ["docker", "inspect", "-f", "{{.State.StartedAt}} {{.State.FinishedAt}} {{.State.ExitCode}}", cid],
+            capture_output=True, text=True, check=True,
+        ).stdout.split()
+        runs[service] = {
+            "seconds": (docker_time(finished) - docker_time(started)).total_seconds(),
+            "exit_code": int(exit_code),
+        }
+    return runs
+
+
+def docker_time(value):
+    """
+    docker's RFC 3339 times have up to 9 fraction digits, trailing zeros trimmed, or none;
+    datetime.fromisoformat takes exactly 6 (or 3) before python 3.11
+    """
+    value = re.sub(r"\.(\d+)", lambda match: "." + (match[1] + "000000")[:6], value).replace("Z", "+00:00")
+    return datetime.fromisoformat(value)
+
+
+class LogFollower:
+    """ follow a log stream in a background thread and set an event when a line matches """
+    def __init__(self, command, pattern):
+        self.pattern = re.compile(pattern)
+        self.matched = threading.Event()
+        self.last_line = ""
+        self.process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace"
+        )
+        self.thread = threading.Thread(target=self._follow, daemon=True)
+        self.thread.start()
+
+    def _follow(self):
+        for line in self.process.stdout:
+            self.last_line = line.strip()
+            if self.pattern.search(line):
+                self.matched.set()
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.wait()
+
+
+def wait_for(description, probe, timeout, log_command=None, log_pattern=None, first_interval=0.05, max_interval=10):
+    """
+    call probe() until it returns something truthy and return that
+    probe exceptions count as "not ready"; between tries the wait doubles from first_interval up to max_interval,
+    and a matching log line ends the wait early
+    raises TimeoutError after timeout seconds
+    """
+    follower = LogFollower(log_command, log_pattern) if log_command else None
+    started = monotonic()
+    last_status = started
+    interval = first_interval
+    last_error = None
+    rich.print(f"waiting for {description}, up to {int(timeout)}s")
+    try:
+        while True:
+            try:
+                result = probe()
+            except Exception as e:
+                result = None
+                last_error = e
+            if result:
+                rich.print(f":white_check_mark: {description} after {monotonic() - started:.1f}s")
+                return result
+            elapsed = monotonic() - started
+            if elapsed >= timeout:
+                raise TimeoutError(f"{description}: not ready after {int(elapsed)}s, last error: {last_error}")
+            if monotonic() - last_status >= status_every:
+                last_status = monotonic()
+                log = f", log: {follower.last_line[:120]}" if follower and follower.last_line else ""
+                rich.print(f"   still waiting for {description} ({int(elapsed)}s{log})")
+            wait = min(interval, timeout - elapsed)
+            if follower and follower.matched.wait(wait):
+                # the service says it's ready, probe right away and then keep polling quickly
+                follower.matched.clear()
+                interval = first_interval
+            else:
+                if not follower:
+                    sleep(wait)
+                interval = min(interval * 2, max_interval)
+    finally:
+        if follower:
+            follower.stop()
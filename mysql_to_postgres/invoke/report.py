@@ -0,0 +1,209 @@
+"""
+Description: timing report for a migration run
+- every phase of tasks.migrate runs inside RunReport.phase(), which records its wall time
+  and the SQL statements the MigrationSession ran meanwhile (statement, seconds, rows)
+- a background sampler keeps the peak cpu and memory of each container of the run's compose project from "docker stats"
+- work overlapping the phases (overlap.Background, e.g. image pulls) is listed with the seconds it saved
+- the report is written as JSON to the workdir and summarized as a rich table, to compare runs across hosts and releases
+"""
+
+import json
+import os
+import platform
+import re
+import subprocess
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from time import perf_counter
+
+import rich
+from rich.table import Table
+
+report_file_name = "migration-report.json"
+stats_every = 5 # seconds between "docker stats" samples
+memory_units = {"b": 1, "kib": 1024, "mib": 1024 ** 2, "gib": 1024 ** 3, "tib": 1024 ** 4,
+                "kb": 1000, "mb": 1000 ** 2, "gb": 1000 ** 3, "tb": 1000 ** 4}
+memory_re = re.compile(r"([\d.]+)\s*([a-zA-Z]+)")
+
+
+def parse_memory(value):
+    """ "1.25GiB" -> bytes """
+    match = memory_re.match(value.strip())
+    if not match:
+        return 0
+    return int(float(match.group(1)) * memory_units.get(match.group(2).lower(), 1))
+
+
+def compose_project(workdir):
+    """ the project name compose derives from the directory of the compose file """
+    return re.sub(r"[^a-z0-9_-]", "", Path(workdir).name.lower())
+
+
+class ContainerStats:
+    """
+    sample "docker stats" in a background thread and keep the peaks per container
+    only the containers of the compose project, not the other jobs of a migrate-batch or whatever else runs on the host
+    """
+    def __init__(self, project, interval=stats_every):
+        self.project = project
+        self.interval = interval
+        self.peaks = {} # container: {"cpu_percent", "memory_bytes"}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception:
+                pass # docker not up yet or between compose runs
+            self._stop.wait(self.interval)
+
+    def sample(self):
+        containers = subprocess.run(
+            ["docker", "ps", "-q", "--filter", f"label=com.docker.compose.project={self.project}"],
+            capture_output=True, text=True, timeout=60,
+        ).stdout.split()
+        if not containers:
+            return
+        result = subprocess.run(
+            ["docker", "stats", "--no-stream", "--format", "{{json .}}", *containers],
+            capture_output=True, text=True, timeout=60,
+        )
+        for line in result.stdout.splitlines():
+            stats = json.loads(line)
+            peak = self.peaks.setdefault(stats["Name"], {"cpu_percent": 0.0, "memory_bytes": 0})
+            peak["cpu_percent"] = max(peak["cpu_percent"], float(stats["CPUPerc"].rstrip("%") or 0))
+            peak["memory_bytes"] = max(peak["memory_bytes"], parse_memory(stats["MemUsage"].split("/")[0]))
+
+
+class RunReport:
+    def __init__(self, session, workdir, **run):
+        self.session = session
+        self.path = Path(workdir) / report_file_name
+        self.run = {
+            "started": datetime.now(timezone.utc).isoformat(),
+            "host": platform.node(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "memory_bytes": os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES"),
+            **run,
+        }
+        self.phases = []
+        # overlap.Background tasks: {"name", "status", "seconds", "waited", "saved"}
+        self.background = []
+        self.containers = ContainerStats(compose_project(workdir))
+        self.started = perf_counter()
+
+    def __enter__(self):
+        self.containers.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.containers.stop()
+        self.run["seconds"] = perf_counter() - self.started
+        self.run["overlap_saved_seconds"] = sum(task["saved"] or 0 for task in self.background)
+        self.run["status"] = "failed" if exc[0] or any(phase["status"] == "failed" for phase in self.phases) else "ok"
+        self.write()
+        self.print_summary()
+        return False
+
+    @contextmanager
+    def phase(self, name):
+        """
+        time a phase, yields a dict the phase can add details to (e.g. per table stats)
+        statements are the ones the session ran while the phase was open
+        """
+        first_statement = len(self.session.statements)
+        phase = {"name": name, "status": "ok", "details": {}}
+        started = perf_counter()
+        try:
+            yield phase["details"]
+        except Exception:
+            phase["status"] = "failed"
+            raise
+        finally:
+            statements = self.session.statements[first_statement:]
+            phase["seconds"] = perf_counter() - started
+            phase["statements"] = statements
+            phase["statement_count"] = len(statements)
+            phase["statement_seconds"] = sum(statement["seconds"] for statement in statements)
+            phase["rows"] = sum(statement["rows"] for statement in statements if isinstance(statement["rows"], int) and statement["rows"] > 0)
+            self.phases.append(phase)
+
+    def skip_phase(self, name, saved):
+        """ a phase a resumed run skipped, saved is the checkpoint of the run that completed it """
+        self.phases.append({
+            "name": name,
+            "status": "skipped",
+            "details": {"completed": saved["completed"], "seconds": saved["seconds"]},
+            "seconds": 0.0,
+            "statements": [],
+            "statement_count": 0,
+            "statement_seconds": 0.0,
+            "rows": 0,
+        })
+
+    def as_dict(self):
+        return {
+            "run": self.run,
+            "phases": self.phases,
+            "background": self.background,
+            "containers": self.containers.peaks,
+        }
+
+    def write(self):
+        with open(self.path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2, default=str)
+        rich.print(f":page_facing_up: run report: {self.path}")
+
+    def print_summary(self):
+        table = Table(title=f"migration phases, {self.run['seconds'] / 60:.1f} minutes")
+        table.add_column("phase")
+        table.add_column("seconds", justify="right")
+        table.add_column("%", justify="right")
+        table.add_column("SQL statements", justify="right")
+        table.add_column("SQL seconds", justify="right")
+        table.add_column("rows", justify="right")
+        for phase in self.phases:
+            name = {"ok": phase["name"], "skipped": f"[dim]{phase['name']} (skipped)"}.get(phase["status"], f"[red]{phase['name']} (failed)")
+            table.add_row(
+                name,
+                f"{phase['seconds']:.1f}",
+                f"{100 * phase['seconds'] / self.run['seconds']:.0f}" if self.run["seconds"] else "-",
+                str(phase["statement_count"]),
+                f"{phase['statement_seconds']:.1f}",
+                f"{phase['rows']:,}",
+            )
+        rich.print(table)
+        if self.background:
+            background = Table(title=f"overlapped work, {self.run['overlap_saved_seconds']:.1f} seconds saved")
+            background.add_column("task")
+            background.add_column("seconds", justify="right")
+            background.add_column("waited", justify="right")
+            background.add_column("saved", justify="right")
+            for task in self.background:
+                background.add_row(
+                    task["name"] if task["status"] != "failed" else f"[red]{task['name']} (failed)",
+                    f"{task['seconds']:.1f}" if task["seconds"] is not None else "-",
+                    f"{task['waited']:.1f}" if task["waited"] is not None else "-",
+                    f"{task['saved']:.1f}" if task["saved"] is not None else "-",
+                )
+            rich.print(background)
+        if self.containers.peaks:
+            containers = Table(title="container peaks")
+            containers.add_column("container")
+            containers.add_column("cpu %", justify="right")
+            containers.add_column("memory MB", justify="right")
+            for name, peak in sorted(self.containers.peaks.items()):
+                containers.add_row(name, f"{peak['cpu_percent']:.0f}", f"{peak['memory_bytes'] / 1024 / 1024:,.0f}")
+            rich.print(containers)
@@ -0,0 +1,140 @@
+"""
+Description: what runs the databases of a migration, behind tasks.start_docker/stop_docker/stop_container
+- DockerRunner: docker compose with the compose files Template writes, the default
+- LocalRunner: a throwaway postgres from the local binaries as a subprocess, its data directory on a local disk of choice
+  and its settings in a config file Template writes instead of compose YAML (write_local_postgres_config());
+  the native converter, the schema check and pg_dump need nothing else, so they run on a plain linux box.
+  dotcms, opensearch and pgloader only come as images, and mysql is only needed for them
+Both keep their data when stopped unless asked, for migrate --resume
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+import rich
+
+import readiness
+
+runner_names = ("docker", "local")
+
+
+def runner(name, template, data_dir=None, bin_dir=None):
+    assert name in runner_names, f"runner must be one of {', '.join(runner_names)}"
+    if name == "local":
+        return LocalRunner(template, data_dir=data_dir, bin_dir=bin_dir)
+    return DockerRunner(template)
+
+
+class DockerRunner:
+    name = "docker"
+
+    def __init__(self, template):
+        self.template = template
+
+    def start(self, c, compose_file, hide=None):
+        """
+        bring the running services in line with the compose file: compose only creates what is new or changed
+        (e.g. postgres with other settings) and removes the services an earlier phase's compose file had
+        """
+        c.run(f"docker compose -f {compose_file} up -d --build --remove-orphans", hide=hide)
+        rich.print(":arrow_up: docker compose up")
+
+    def stop(self, c, compose_file, hide=None, volumes=False):
+        # the volumes are kept for migrate --resume unless asked for
+        c.run(f"docker compose -f {compose_file} down --remove-orphans{' -v' if volumes else ''}", hide=hide)
+        rich.print(":arrow_down: docker compose down")
+
+    def stop_service(self, c, compose_file, service):
+        c.run(f"docker compose -f {compose_file} stop {service}")
+
+    def cid(self, c, compose_file, service):
+        """ id of the running container of a compose service, "" when it doesn't run """
+        return c.run(f"docker compose -f {compose_file} ps -q {service}", hide="both", warn=True).stdout.strip()
+
+    def running(self, c, compose_file, service):
+        return bool(self.cid(c, compose_file, service))
+
+    def command(self, c, compose_file, service, *args, host_user=False):
+        """ argv running a client program next to a service, host_user runs it as the calling user """
+        user = ["-u", f"{os.getuid()}:{os.getgid()}"] if host_user else []
+        return ["docker", "exec", "-i", *user, self.cid(c, compose_file, service), *args]
+
+    def logs_command(self, compose_file, *services):
+        return readiness.compose_logs(compose_file, *services)
+
+    def export_mount(self):
+        """ (host directory, its path for the postgres server) for pg_dump's directory format """
+        return self.template.workdir, self.template.container_export_path
+
+
+class LocalRunner:
+    name = "local"
+    # client option for the port of each service
+    port_options = {"postgres": "-p"}
+
+    def __init__(self, template, data_dir=None, bin_dir=None):
+        self.template = template
+        # named like the docker volume, so several runs can share a data_dir
+        self.data_dir = Path(data_dir or template.workdir).resolve() / f"{template.workdir.name}-{template.pg_volume}"
+        self.bin_dir = bin_dir
+        self.log_file = template.workdir / "postgres.log"
+        # settings postgres was started with by this run, a changed tuning profile restarts it
+        self.started_config = None
+
+    def binary(self, name):
+        path = Path(self.bin_dir) / name if self.bin_dir else shutil.which(name)
+        if not path or not Path(path).exists():
+            raise FileNotFoundError(f"{name} not found, install postgres or point --local-bin at its binaries")
+        return str(path)
+
+    def start(self, c, compose_file, hide=None):
+        assert not self.template.with_mysql, "the local runner only runs postgres, use --converter=native"
+        if self.template.target_postgres:
+            return
+        pg_ctl = self.binary("pg_ctl")
+        created = not (self.data_dir / "PG_VERSION").exists()
+        if created:
+            c.run(f"{self.binary('initdb')} -D {self.data_dir} -U {self.template.username} --auth=trust -E UTF8 --locale=C",
+                  hide=hide or "both")
+        config_file = self.template.write_local_postgres_config(self.data_dir)
+        if created:
+            with open(self.data_dir / "postgresql.conf", "a") as f:
+                f.write(f"include '{config_file}'\n")
+        config = config_file.read_text()
+        if not self.running(c, compose_file, "postgres"):
+            c.run(f"{pg_ctl} -D {self.data_dir} -l {self.log_file} -w start", hide=hide)
+        elif config != self.started_config:
+            c.run(f"{pg_ctl} -D {self.data_dir} -l {self.log_file} -w restart", hide=hide)
+        self.started_config = config
+        if created:
+            c.run(f"{self.binary('createdb')} -h 127.0.0.1 -p {self.template.postgres_port} "
+                  f"-U {self.template.username} {self.template.dbname}", hide=hide)
+        rich.print(f":arrow_up: local postgres on port {self.template.postgres_port}, data in {self.data_dir}")
+
+    def stop(self, c, compose_file, hide=None, volumes=False):
+        if (self.data_dir / "PG_VERSION").exists() and self.running(c, compose_file, "postgres"):
+            c.run(f"{self.binary('pg_ctl')} -D {self.data_dir} -m fast -w stop", hide=hide)
+        self.started_config = None
+        if volumes:
+            shutil.rmtree(self.data_dir, ignore_errors=True)
+        rich.print(":arrow_down: local postgres stopped")
+
+    def stop_service(self, c, compose_file, service):
+        if service == "postgres":
+            self.stop(c, compose_file)
+
+    def running(self, c, compose_file, service):
+        if service != "postgres" or not (self.data_dir / "PG_VERSION").exists():
+            return False
+        return c.run(f"{self.binary('pg_ctl')} -D {self.data_dir} status", hide="both", warn=True).ok
+
+    def command(self, c, compose_file, service, program, *args, host_user=False):
+        """ the local client program, on the service's port """
+        return [self.binary(program), self.port_options[service], str(self.template.postgres_port), *args]
+
+    def logs_command(self, compose_file, *services):
+        return ["tail", "-n", "+1", "-F", str(self.log_file)]
+
+    def export_mount(self):
+        return self.template.workdir, self.template.workdir
@@ -0,0 +1,177 @@
+"""
+Description: check the converted postgres schema against a reference dotcms 21.06 postgres schema, in seconds
+- the reference is reduced from a pg_dump of a working dotcms 21.06 db (tests/dotcms-demo-21.06-postgres.sql.gz):
+  tables, column types, primary key names, sequences and the quartz lock rows
+- the converted db is read from the catalog, types with format_type() as pg_dump writes them
+- an opt-in substitute for booting dotcms on postgres (migrate --validate=schema), it does not run dotcms' own checks
+migra needs a live reference db, this only needs the dump file
+"""
+
+import gzip
+import re
+from pathlib import Path
+from time import perf_counter
+
+import rich
+from rich.table import Table
+
+import migrate_db
+
+default_reference = Path(__file__).resolve().parent.parent / "tests" / "dotcms-demo-21.06-postgres.sql.gz"
+quartz_lock_tables = ("qrtz_locks", "qrtz_excl_locks")
+
+create_table_re = re.compile(r"^CREATE TABLE public\.(\S+) \($")
+column_re = re.compile(r'^    ("[^"]+"|\S+) (.+?)(?: COLLATE \S+)?(?: DEFAULT .+?)?(?: NOT NULL)?,?$')
+alter_table_re = re.compile(r"^ALTER TABLE ONLY public\.(\S+)$")
+primary_key_re = re.compile(r"^    ADD CONSTRAINT (\S+) PRIMARY KEY ")
+sequence_re = re.compile(r"^CREATE SEQUENCE public\.(\S+)$")
+copy_re = re.compile(r"^COPY public\.(\S+) \(")
+
+
+def reference_schema(path=default_reference):
+    """ {"tables": {table: {column: type}}, "primary_keys": {table: name}, "sequences": set, "quartz_locks": {table: set}} """
+    reference = {"tables": {}, "primary_keys": {}, "sequences": set(), "quartz_locks": {}}
+    opener = gzip.open if str(path).endswith(".gz") else open
+    table = None
+    altered = None
+    copying = None
+    with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if copying is not None:
+                if line == "\\.":
+                    copying = None
+                else:
+                    copying.add(line.upper())
+                continue
+            if table is not None:
+                if line == ");":
+                    table = None
+                elif not line.lstrip().startswith("CONSTRAINT "):
+                    match = column_re.match(line)
+                    if match:
+                        reference["tables"][table][match.group(1).strip('"')] = match.group(2)
+                continue
+            if match := create_table_re.match(line):
+                table = match.group(1)
+                reference["tables"][table] = {}
+            elif match := alter_table_re.match(line):
+                altered = match.group(1)
+            elif altered and (match := primary_key_re.match(line)):
+                reference["primary_keys"][altered] = match.group(1)
+                altered = None
+            elif match := sequence_re.match(line):
+                reference["sequences"].add(match.group(1))
+            elif (match := copy_re.match(line)) and match.group(1) in quartz_lock_tables:
+                copying = reference["quartz_locks"].setdefault(match.group(1), set())
+    # the reference dump predates the sequence renames of postgres_post_import
+    reference["sequences"] = {migrate_db.sequence_renames.get(name, name) for name in reference["sequences"]}
+    return reference
+
+
+def converted_schema(session, schema="public"):
+    """ the same structure as reference_schema(), read from the catalog """
+    converted = {"tables": {}, "primary_keys": {}, "sequences": set(), "quartz_locks": {}}
+    for table, column, column_type in session.execute(
+        "postgres",
+        """
+        SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relkind IN ('r', 'p') AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY c.relname, a.attnum
+        """,
+        (schema,),
+        fetch=True,
+    ):
+        converted["tables"].setdefault(table, {})[column] = column_type
+    for table, name in session.execute(
+        "postgres",
+        "SELECT c.relname, con.conname FROM pg_constraint con JOIN pg_class c ON c.oid = con.conrelid "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace WHERE n.nspname = %s AND con.contype = 'p'",
+        (schema,),
+        fetch=True,
+    ):
+        converted["primary_keys"][table] = name
+    converted["sequences"] = {
+        name for name, in session.execute(
+            "postgres",
+            "SELECT c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace WHERE n.nspname = %s AND c.relkind = 'S'",
+            (schema,),
+            fetch=True,
+        )
+    }
+    for table in quartz_lock_tables:
+        if table in converted["tables"]:
+            converted["quartz_locks"][table] = {
+                lock.upper() for lock, in session.execute("postgres", f'SELECT lock_name FROM "{schema}"."{table}"', fetch=True)
+            }
+    return converted
+
+
+def diff(reference, converted):
+    """
+    [(severity, object, problem)], severity "error" for anything dotcms needs and the converted db lacks or has different,
+    "warning" for extra tables, columns and sequences (e.g. from plugins)
+    """
+    problems = []
+    for table, columns in sorted(reference["tables"].items()):
+        if table not in converted["tables"]:
+            problems.append(("error", table, "table missing"))
+            continue
+        for column, column_type in columns.items():
+            converted_type = converted["tables"][table].get(column)
+            if converted_type is None:
+                problems.append(("error", f"{table}.{column}", "column missing"))
+            elif converted_type != column_type:
+                problems.append(("error", f"{table}.{column}", f"type {converted_type}, expected {column_type}"))
+        for column in converted["tables"][table]:
+            if column not in columns:
+                problems.append(("warning", f"{table}.{column}", "extra column"))
+    for table in sorted(set(converted["tables"]) - set(reference["tables"])):
+        problems.append(("warning", table, "extra table"))
+    for table, name in sorted(reference["primary_keys"].items()):
+        if table not in converted["tables"]:
+            continue
+        converted_name = converted["primary_keys"].get(table)
+        if converted_name != name:
+            problems.append(("error", table, f"primary key {converted_name or 'missing'}, expected {name}"))
+    for sequence in sorted(reference["sequences"] - converted["sequences"]):
+        problems.append(("error", sequence, "sequence missing"))
+    for sequence in sorted(converted["sequences"] - reference["sequences"]):
+        problems.append(("warning", sequence, "extra sequence"))
+    # the reference has the lock names lower cased, compared case insensitively
+    for table, locks in sorted(reference["quartz_locks"].items()):
+        missing = locks - converted["quartz_locks"].get(table, set())
+        if missing:
+            problems.append(("error", table, f"quartz lock rows missing: {', '.join(sorted(missing))}"))
+    return problems
+
+
+def validate(session, schema="public", reference=default_reference):
+    """ diff the converted schema against the reference, print and return the problems """
+    started = perf_counter()
+    expected = reference_schema(reference)
+    problems = diff(expected, converted_schema(session, schema))
+    print_problems(problems, len(expected["tables"]), perf_counter() - started)
+    return problems
+
+
+def errors(problems):
+    return [problem for problem in problems if problem[0] == "error"]
+
+
+def print_problems(problems, tables, seconds):
+    if problems:
+        table = Table(title="converted schema vs dotcms 21.06 reference")
+        table.add_column("")
+        table.add_column("object")
+        table.add_column("problem")
+        for severity, name, problem in problems:
+            table.add_row("[red]error" if severity == "error" else "[yellow]warning", name, problem)
+        rich.print(table)
+    if errors(problems):
+        migrate_db.fail_msg(f"{len(errors(problems))} schema errors against {tables} reference tables, checked in {seconds:.1f}s")
+    else:
+        migrate_db.success_msg(f"schema matches the {tables} reference tables, checked in {seconds:.1f}s")
@@ -0,0 +1,248 @@
+"""
+Description: pooled, reusable database connections for a migration run
+- mysql and postgres connections are opened lazily and handed back to a small pool after use
+- connections are health checked when taken from the pool and reopened after a failure
+- every statement is timed, migrate_db and the run report read MigrationSession.statements
+"""
+
+import queue
+from contextlib import contextmanager
+from time import monotonic, perf_counter
+
+import mysql.connector
+import psycopg2
+from mysql.connector import errorcode
+
+# connections idle longer than this get a "SELECT 1" before they are reused
+health_check_after = 30 # seconds
+# mysql errors of a lost connection, others (deadlocks, timeouts) leave it usable
+mysql_connection_lost = (errorcode.CR_SERVER_GONE_ERROR, errorcode.CR_SERVER_LOST, errorcode.CR_SERVER_LOST_EXTENDED)
+
+
+class MigrationSession:
+    def __init__(
+        self,
+        username=None,
+        password=None,
+        db="dotcms",
+        mysql_host="127.0.0.1",
+        postgres_host="127.0.0.1",
+        mysql_port=3306,
+        postgres_port=5432,
+        pool_size=4,
+        target_dsn=None,
+    ):
+        assert username and password
+        self.username = username
+        self.password = password
+        self.db = db
+        self.mysql_host = mysql_host
+        self.postgres_host = postgres_host
+        self.mysql_port = mysql_port
+        self.postgres_port = postgres_port
+        self.pool_size = pool_size
+        # libpq dsn of an existing postgres, replaces username/password/postgres_host for postgres
+        self.target_dsn = target_dsn
+        self.statements = []
+        self._pools = {"mysql": queue.LifoQueue(), "postgres": queue.LifoQueue()}
+        self._opened = {"mysql": 0, "postgres": 0}
+
+    @property
+    def postgres_dsn(self):
+        if self.target_dsn:
+            return self.target_dsn
+        return f"dbname={self.db} user={self.username} password={self.password} host={self.postgres_host} port={self.postgres_port}"
+
+    @property
+    def connections_opened(self):
+        return dict(self._opened)
+
+    def _connect(self, kind):
+        self._opened[kind] += 1
+        if kind == "mysql":
+            return mysql.connector.connect(
+                user=self.username,
+                password=self.password,
+                host=self.mysql_host,
+                port=self.mysql_port,
+                database=self.db,
+                raise_on_warnings=True,
+                autocommit=True,
+            )
+        return psycopg2.connect(self.postgres_dsn)
+
+    def _healthy(self, kind, cnx, idle):
+        if kind == "postgres" and cnx.closed:
+            return False
+        if kind == "mysql" and not cnx.is_connected():
+            return False
+        if idle < health_check_after:
+            return True
+        try:
+            cursor = cnx.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            if kind == "postgres":
+                cnx.rollback()
+        except Exception:
+            return False
+        return True
+
+    def _checkout(self, kind):
+        pool = self._pools[kind]
+        while True:
+            try:
+                cnx, returned = pool.get_nowait()
+            except queue.Empty:
+                return self._connect(kind)
+            if self._healthy(kind, cnx, monotonic() - returned):
+                return cnx
+            self._discard(cnx)
+
+    def _checkin(self, kind, cnx):
+        pool = self._pools[kind]
+        if pool.qsize() >= self.pool_size:
+            self._discard(cnx)
+        else:
+            pool.put((cnx, monotonic()))
+
+    @staticmethod
+    def _discard(cnx):
+        try:
+            cnx.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self, kind):
+        """
+        a pooled mysql or postgres connection
+        postgres work is committed when the block exits, rolled back on error
+        a connection that failed is closed instead of going back to the pool
+        """
+        cnx = self._checkout(kind)
+        try:
+            yield cnx
+            if kind == "postgres":
+                cnx.commit()
+        except Exception:
+            try:
+                if kind == "postgres" and not cnx.closed:
+                    cnx.rollback()
+                    self._checkin(kind, cnx)
+                else:
+                    self._discard(cnx)
+            except Exception:
+                self._discard(cnx)
+            raise
+        self._checkin(kind, cnx)
+
+    def mysql(self):
+        return self.connection("mysql")
+
+    def postgres(self):
+        return self.connection("postgres")
+
+    def execute(self, kind, query, params=None, fetch=False, retry=True):
+        """
+        run one statement, returns the fetched rows when fetch=True, else the affected row count
+        when the connection is lost the statement is retried once on a new one, if it can't have taken effect:
+        it wasn't sent yet, it was a postgres statement whose transaction died with the connection, or a mysql read
+        """
+        state = {"cnx": None, "sent": False, "done": False}
+
+        def run(cursor):
+            state["sent"] = True
+            cursor.execute(query, params)
+
+        try:
+            with self.connection(kind) as cnx:
+                state["cnx"] = cnx
+                result = self._timed(kind, cnx, query, fetch, run)
+                # postgres commits when the block exits, a commit that broke may have gone through
+                state["done"] = True
+                return result
+        except (psycopg2.OperationalError, psycopg2.InterfaceError, mysql.connector.errors.OperationalError,
+                mysql.connector.errors.InterfaceError) as e:
+            if not retry or not self._lost(kind, state["cnx"], e):
+                raise
+            if state["done"] or (state["sent"] and kind == "mysql" and not fetch):
+                raise
+            return self.execute(kind, query, params=params, fetch=fetch, retry=False)
+
+    @staticmethod
+    def _lost(kind, cnx, error):
+        """ True when error is the connection going away, not a failed statement (QueryCanceled, deadlocks) """
+        if cnx is None:
+            # it couldn't be opened
+            return True
+        if kind == "postgres":
+            return bool(cnx.closed)
+        return error.errno in mysql_connection_lost
+
+    def execute_all(self, kind, queries, autocommit=False):
+        """
+        run statements in order on one connection, for session settings like FOREIGN_KEY_CHECKS; returns row counts
+        autocommit runs postgres statements outside a transaction, e.g. VACUUM
+        the connection is closed when a statement fails, so the settings the ones before it made don't go back to the pool
+        """
+        with self.connection(kind) as cnx:
+            if autocommit and kind == "postgres":
+                cnx.autocommit = True
+            try:
+                return [self._timed(kind, cnx, query, False, lambda cursor, query=query: cursor.execute(query)) for query in queries]
+            except Exception:
+                self._discard(cnx)
+                raise
+            finally:
+                if autocommit and kind == "postgres" and not cnx.closed:
+                    cnx.autocommit = False
+
+    def execute_batch(self, kind, queries, page_size=100):
+        """
+        run a list of statements on one connection with few round trips, returns the number of statements
+        postgres gets page_size statements per round trip, all in one transaction; mysql runs them in order
+        the connection is closed when a statement fails, like execute_all
+        """
+        queries = list(queries)
+        if not queries:
+            return 0
+        rows = []
+
+        def run(cursor):
+            pages = [queries[i:i + page_size] for i in range(0, len(queries), page_size)] if kind == "postgres" else queries
+            for page in pages:
+                cursor.execute("\n".join(page) if kind == "postgres" else page)
+                # postgres reports the rows of the last statement of a page
+                rows.append(max(cursor.rowcount, 0))
+
+        with self.connection(kind) as cnx:
+            try:
+                self._timed(kind, cnx, f"{len(queries)} statements: {queries[0]}", False, run, rows=lambda: sum(rows))
+            except Exception:
+                self._discard(cnx)
+                raise
+        return len(queries)
+
+    def _timed(self, kind, cnx, query, fetch, run, rows=None):
+        started = perf_counter()
+        cursor = cnx.cursor()
+        try:
+            run(cursor)
+            result = cursor.fetchall() if fetch else cursor.rowcount
+        finally:
+            cursor.close()
+        self.statements.append({
+            "db": kind,
+            "statement": " ".join(str(query).split())[:200],
+            "seconds": perf_counter() - started,
+            "rows": rows() if rows else len(result) if fetch else result,
+        })
+        return result
+
+    def close(self):
+        for pool in self._pools.values():
+            while not pool.empty():
+                cnx, _ = pool.get_nowait()
+                self._discard(cnx)
@@ -0,0 +1,174 @@
+"""
+Description: generate dotcms shaped mysqldump files of any size from the demo dump, for benchmarks
+- the demo dump is copied as is, and cloned content is added to the sections of the content tables:
+  contentlet, inode, identifier, contentlet_version_info, workflow_task and workflow_history
+- clones copy real demo rows, so text and binary values keep the demo's size distribution
+- every clone gets new ids derived from (seed, round, original id), so the tables written in separate passes
+  agree with each other and foreign keys stay valid; asset names get a "-copyN" suffix to keep paths unique
+"""
+
+import hashlib
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+import rich
+
+import convert, mysqldump
+
+default_source = Path(__file__).resolve().parent.parent / "tests" / "dotcms-demo-21.06-mysqldump.sql.gz"
+cloned_tables = ("contentlet", "inode", "identifier", "contentlet_version_info", "workflow_task", "workflow_history")
+statement_bytes = 1024 * 1024 # close an INSERT statement after ~1MB, like mysqldump's net_buffer_length
+
+
+def copy_name(literal, round):
+    """ 'logo.png' -> 'logo-copy3.png', works on the escaped literal """
+    if not literal.startswith(b"'"):
+        return literal
+    name = literal[1:-1]
+    stem, dot, extension = name.rpartition(b".")
+    if not stem:
+        stem, dot, extension = name, b"", b""
+    return b"'" + stem + f"-copy{round}".encode() + dot + extension + b"'"
+
+
+class Synthesizer:
+    """
+    Synthesizer(source).write(dst, contentlets=100000)
+    contentlets: total contentlet rows in the generated dump, demo rows included (rounded up to whole identifiers)
+    versions: contentlet rows per cloned content version, the extra ones are older working copies
+    history: workflow_history rows per cloned workflow task
+    """
+    def __init__(self, source=default_source, seed=0):
+        self.source = source
+        self.seed = seed
+        self.columns = {}
+        self.rows = defaultdict(list)
+        self._read_template()
+
+    def _read_template(self):
+        sections = mysqldump.index_dump(self.source)
+        for table in cloned_tables:
+            columns = convert.parse_create_table(sections[table]["create"])["columns"]
+            self.columns[table] = [column["name"] for column in columns if not column["generated"]]
+        table = None
+        with mysqldump.open_dump(self.source) as f:
+            for line in f:
+                if line.startswith(b"-- Table structure for table "):
+                    table = mysqldump.table_structure_re.match(line).group(1).decode()
+                elif table in cloned_tables and line.startswith(b"INSERT INTO "):
+                    match = convert.insert_columns_re.match(line)
+                    names = [n.strip().strip("`") for n in match.group(1).decode().split(",")] if match else self.columns[table]
+                    for row in convert.parse_insert(line):
+                        self.rows[table].append(dict(zip(names, row)))
+        identifiers = {
+            row["id"]: row for row in self.rows["identifier"]
+            if row["asset_type"] == b"'contentlet'" and row["host_inode"] != b"'SYSTEM_HOST'"
+        }
+        self.contentlets = defaultdict(list)
+        for row in self.rows["contentlet"]:
+            if row["identifier"] in identifiers:
+                self.contentlets[row["identifier"]].append(row)
+        # identifiers of content (not hosts or system objects) and everything hanging off them
+        self.identifiers = {id: identifiers[id] for id in sorted(self.contentlets)}
+        self.inodes = {row["inode"]: row for row in self.rows["inode"]}
+        self.version_info = defaultdict(list)
+        for row in self.rows["contentlet_version_info"]:
+            self.version_info[row["identifier"]].append(row)
+        self.tasks = defaultdict(list)
+        for row in self.rows["workflow_task"]:
+            self.tasks[row["webasset"]].append(row)
+
+    def clone_id(self, literal, round, *salt):
+        """ stable new uuid literal for a cloned id """
+        digest = hashlib.md5(b":".join([str(self.seed).encode(), str(round).encode(), *salt, literal])).digest()
+        return b"'" + str(uuid.UUID(bytes=digest)).encode() + b"'"
+
+    def schedule(self, contentlets, versions):
+        """ yield (round, identifier) until the dump holds the requested number of contentlet rows """
+        total = len(self.rows["contentlet"])
+        round = 0
+        while total < contentlets and self.identifiers:
+            round += 1
+            for identifier in self.identifiers:
+                if total >= contentlets:
+                    return
+                yield round, identifier
+                total += len(self.contentlets[identifier]) * versions
+
+    def clones(self, table, contentlets, versions, history):
+        """ yield the cloned rows of one table """
+        for round, identifier in self.schedule(contentlets, versions):
+            new_identifier = self.clone_id(identifier, round)
+            if table == "identifier":
+                row = dict(self.identifiers[identifier], id=new_identifier)
+                row["asset_name"] = copy_name(row["asset_name"], round)
+                yield row
+            elif table == "contentlet_version_info":
+                for row in self.version_info[identifier]:
+                    yield dict(
+                        row,
+                        identifier=new_identifier,
+                        working_inode=self.clone_id(row["working_inode"], round),
+                        live_inode=self.clone_id(row["live_inode"], round) if row["live_inode"] != b"NULL" else b"NULL",
+                    )
+            elif table in ("contentlet", "inode"):
+                for contentlet in self.contentlets[identifier]:
+                    for version in range(versions):
+                        salt = (str(version).encode(),) if version else ()
+                        inode = self.clone_id(contentlet["inode"], round, *salt)
+                        if table == "contentlet":
+                            yield dict(contentlet, inode=inode, identifier=new_identifier)
+                        elif contentlet["inode"] in self.inodes:
+                            yield dict(self.inodes[contentlet["inode"]], inode=inode)
+            elif table == "workflow_task":
+                for row in self.tasks[identifier]:
+                    yield dict(row, id=self.clone_id(row["id"], round), webasset=new_identifier)
+            elif table == "workflow_history":
+                for task in self.tasks[identifier]:
+                    for entry in range(history):
+                        yield {
+                            "id": self.clone_id(task["id"], round, b"history", str(entry).encode()),
+                            "creation_date": task["mod_date"],
+                            "made_by": task["created_by"],
+                            "change_desc": task["title"],
+                            "workflowtask_id": self.clone_id(task["id"], round),
+                            "workflow_action_id": b"NULL",
+                            "workflow_step_id": task["status"],
+                        }
+
+    def write(self, dst, contentlets=100000, versions=1, history=2):
+        """ write the demo dump plus clones to dst (plain sql), returns {table: rows added} """
+        added = {}
+        table = None
+        with mysqldump.open_dump(self.source) as src, open(dst, "wb") as out:
+            for line in src:
+                if line.startswith(b"-- Table structure for table "):
+                    table = mysqldump.table_structure_re.match(line).group(1).decode()
+                elif table in cloned_tables and line.startswith(f"/*!40000 ALTER TABLE `{table}` ENABLE KEYS".encode()):
+                    eol = b"\r\n" if line.endswith(b"\r\n") else b"\n"
+                    rows = self.clones(table, contentlets, versions, history)
+                    added[table] = write_inserts(out, table, self.columns[table], rows, eol)
+                out.write(line)
+        rich.print(f":test_tube: wrote {dst}: " + ", ".join(f"{table} +{rows:,}" for table, rows in added.items()))
+        return added
+
+
+def write_inserts(out, table, names, rows, eol=b"\n"):
+    """ write rows as extended INSERT statements with a column list, returns the row count """
+    prefix = f"INSERT INTO `{table}` ({', '.join(f'`{name}`' for name in names)}) VALUES ".encode()
+    count = 0
+    statement = []
+    size = 0
+    for row in rows:
+        values = b"(" + b",".join(row[name] for name in names) + b")"
+        statement.append(values)
+        size += len(values) + 1
+        count += 1
+        if size >= statement_bytes:
+            out.write(prefix + b",".join(statement) + b";" + eol)
+            statement = []
+            size = 0
+    if statement:
+        out.write(prefix + b",".join(statement) + b";" + eol)
+    return count
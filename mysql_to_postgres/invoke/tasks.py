@@ -1,19 +1,24 @@
 import os
+import shutil
+import subprocess
 import sys
+from functools import partial
 from pathlib import Path
 from tempfile import mkdtemp
-from time import sleep
 
 import rich
 from invoke import task
 
-import templates, migrate_db
+import templates, migrate_db, mysqldump, convert, readiness, progress, report, synthesize, bench, verify, export, pgloader, tuning, indexes, schema_check, checkpoint, batch, runners, overlap
+from session import MigrationSession
 
-# Bump these a lot for big DBs!
-retry_interval = 15 # seconds
-retry_attempts = 400 # very large db's will need this increased
+# readiness deadlines scale with the dump size, see readiness.phase_deadlines
+dump_bytes = 0
+deadline_factor = 1.0
+run_report = None # report.RunReport of the current migrate run
+run_state = None # checkpoint.Checkpoint of the current migrate run
+background = None # overlap.Background of the current migrate run
 
-dotcms_port = 8082
 workdir = mkdtemp(prefix="dotcms_migrate_")
 workdir_basedir = workdir.split('/')[-1]
 
@@ -25,107 +30,578 @@ template = templates.Template(
         workdir=workdir,
     )
 
+# runs the databases: docker compose, or a local postgres with migrate --runner=local
+db_runner = runners.DockerRunner(template)
+
+session = MigrationSession(
+        username=template.username,
+        password=template.password,
+        db=template.dbname,
+    )
+
 class MigrationException(Exception):
     pass
 
 
-result = os.uname()
-if result.machine != 'x86_64':
-    rich.print(":x: The 'pgloader' Docker image is only supported on Intel hardware, bailing...")
-    sys.exit()
-
-@task(optional=["pg_dump_file"])
-def migrate(c, mysqldump_file, pg_dump_file=None):
+@task(optional=["pg_dump_file"], help={
+    "preprocess": "strip data and statements from the mysqldump file before loading it (default: on)",
+    "converter": "'pgloader' (default) loads mysql, upgrades dotcms on mysql and runs pgloader; "
+        "'native' copies the dump straight into postgres, for dumps from dotcms 21.06",
+    "convert-workers": "worker processes for the native converter (default: cpu count)",
+    "mysql-workers": "parallel mysql sessions loading the dump, one table each; 0 loads it with a single SOURCE (default: 4)",
+    "timeout-factor": "multiply the wait deadlines, which are derived from the dump size (default: 1.0)",
+    "verify-data": "compare row counts and checksums of every table in mysql and postgres after pgloader (default: on)",
+    "dump-format": "'plain' (default) sql file, 'custom' pg_dump -Fc file or 'directory' pg_dump -Fd; "
+        "custom and directory restore in parallel with pg_restore -j N",
+    "compressor": "compressor for the plain format: 'gzip' (default), 'pigz' or 'zstd', run on the host",
+    "dump-jobs": "parallel pg_dump jobs for the directory format (default: 4)",
+    "tuning-profile": "'bulk' (default) runs mysql and postgres without durability and with memory sized to the host while loading, "
+        "'safe' keeps the default settings; the final dotcms check and pg_dump always run with the safe settings, "
+        "a target postgres is never changed",
+    "defer-indexes": "pgloader creates the tables with primary keys only, the other indexes and the foreign keys are built "
+        "after the copy by --index-workers connections (default: off, the copy loads the tables with all their indexes)",
+    "index-workers": "parallel index and constraint builds with --defer-indexes (default: 4)",
+    "validate": "'dotcms' (default) boots dotcms 21.06 on the converted db; 'schema' checks tables, column types, "
+        "primary key names, sequences and quartz locks against the 21.06 reference schema instead, in seconds",
+    "maintenance-workers": "tables vacuumed and analyzed at the same time after the post import fixups (default: 4)",
+    "lean": "run opensearch only with dotcms, with a smaller heap, set memory limits on every service "
+        "and keep the dotcms starts from queueing a reindex, for smaller hosts (default: off)",
+    "pgloader-shards": "pgloader services copying at the same time, the tables are split between them by size (default: 1)",
+    "target-dsn": "libpq connection string of an existing, empty postgres db to load into instead of writing a pg_dump file, "
+        "e.g. 'host=127.0.0.1 port=5432 dbname=dotcms user=dbuser password=...'",
+    "resume": "workdir of an earlier run to continue: stages it completed are skipped while their output is still there, "
+        "the docker volumes are reused; the dump file, converter, --preprocess, --target-dsn and --defer-indexes must be the same",
+    "directory": "run in this existing, empty directory instead of a new temp dir, its name is the compose project name",
+    "mysql-port": "host port of the mysql service (default: 3306)",
+    "postgres-port": "host port of the postgres service (default: 5432)",
+    "dotcms-port": "host port of the dotcms services (default: 8082)",
+    "memory-mb": "memory the servers, batches and container limits are sized to, instead of the host's (default: the host's)",
+    "cpus": "cpus the servers and parallel copies are sized to, instead of the host's (default: the host's)",
+    "runner": "'docker' (default) runs the databases with docker compose; 'local' runs a throwaway postgres from the local "
+        "binaries instead, for --converter=native --validate=schema on a host without docker",
+    "local-data-dir": "directory for the local runner's postgres data, e.g. on a fast local disk (default: the workdir)",
+    "local-bin": "directory of the postgres binaries for the local runner (default: from PATH)",
+})
+def migrate(c, mysqldump_file, pg_dump_file=None, preprocess=True, converter="pgloader", convert_workers=0, mysql_workers=4,
+            timeout_factor=1.0, verify_data=True, dump_format="plain", compressor="gzip", dump_jobs=4, target_dsn=None,
+            pgloader_shards=1, tuning_profile="bulk", defer_indexes=False, index_workers=4,
+            validate="dotcms", lean=False, maintenance_workers=4, resume=None, directory=None,
+            mysql_port=3306, postgres_port=5432, dotcms_port=8082, memory_mb=0, cpus=0, runner="docker",
+            local_data_dir=None, local_bin=None):
     """ Convert the provided mysql dump file to dotCMS 21.06 Postgres pg_dump file """
+    global dump_bytes, deadline_factor, run_report, run_state, db_runner, background
     assert mysqldump_file.startswith("/"), "Provide absolute, not relative, path to mysqldump file"
-    try:
-        if pg_dump_file is None:
-            pg_dump_file = Path(workdir) / "dotcms-21.06-postgres.sql.gz"
-        else:
-            pg_dump_file = Path(pg_dump_file)
-        # import provided mysqldump file
-        print("---------------------------------------------------")
-        rich.print(f":keycap_1:  loading mysqldump file: {mysqldump_file}")
-        compose_file = template_all_dbs(mysqldump_file)
+    assert converter in ("pgloader", "native"), "converter must be 'pgloader' or 'native'"
+    if converter == "pgloader" and os.uname().machine != 'x86_64':
+        rich.print(":x: The 'pgloader' Docker image is only supported on Intel hardware, use --converter=native, bailing...")
+        sys.exit()
+    assert validate in ("dotcms", "schema"), "validate must be 'dotcms' or 'schema'"
+    assert dump_format in export.formats, f"dump format must be one of {', '.join(export.formats)}"
+    assert compressor in export.compressors, f"compressor must be one of {', '.join(export.compressors)}"
+    assert pg_dump_file is None or export.suffix_matches(pg_dump_file, dump_format, compressor), \
+        f"{pg_dump_file} doesn't match the {dump_format} format{f' with {compressor}' if dump_format == 'plain' else ''}, " \
+        f"name it *{export.output_suffix(dump_format, compressor)}"
+    assert tuning_profile in tuning.profiles, f"tuning profile must be one of {', '.join(tuning.profiles)}"
+    assert not (resume and directory), "--resume already names the directory"
+    # dotcms and pgloader only come as docker images
+    assert runner != "local" or (converter == "native" and validate == "schema"), \
+        "the local runner only runs postgres, use it with --converter=native --validate=schema"
+    if resume or directory:
+        use_workdir(resume or directory)
+    db_runner = runners.runner(runner, template, data_dir=local_data_dir, bin_dir=local_bin)
+    template.mysql_port, template.postgres_port, template.dotcms_port = mysql_port, postgres_port, dotcms_port
+    session.mysql_port, session.postgres_port = mysql_port, postgres_port
+    if memory_mb or cpus:
+        host_memory, host_cpus = tuning.host_resources()
+        tuning.budget = (memory_mb * tuning.megabyte or host_memory, cpus or host_cpus)
+    dump_bytes = readiness.dump_size(mysqldump_file)
+    deadline_factor = float(timeout_factor)
+    template.tuning_profile = tuning_profile
+    template.lean = lean
+    if target_dsn:
+        # pgloader or the native converter, the post import, verification and dotcms all use the target
+        template.set_target_postgres(target_dsn)
+        session.target_dsn = target_dsn
+    run_report = report.RunReport(
+        session,
+        workdir,
+        mysqldump_file=mysqldump_file,
+        dump_bytes=os.path.getsize(mysqldump_file),
+        dump_bytes_uncompressed=dump_bytes,
+        converter=converter,
+        dotcms_version=template.dotcms_version,
+        target=bool(target_dsn),
+        tuning_profile=tuning_profile,
+        lean=lean,
+        runner=runner,
+        resumed=bool(resume),
+        budget=tuning.budget,
+    )
+    background = overlap.Background(run_report)
+    if pg_dump_file is None:
+        pg_dump_file = export.default_path(workdir, dump_format, compressor)
+    else:
+        pg_dump_file = Path(pg_dump_file)
+    preprocessed_file = Path(workdir) / "mysqldump-preprocessed.sql"
+    run_state = checkpoint.Checkpoint(workdir, session, run_report, markers={
+        "preprocess": checkpoint.file_marker(preprocessed_file),
+        "mysql_import": checkpoint.mysql_contentlets,
+        "mysql_post_import": checkpoint.mysql_pending_alters,
+        "dotcms_mysql": checkpoint.mysql_db_version,
+        "pgloader": checkpoint.postgres_contentlets,
+        "native_convert": checkpoint.postgres_contentlets,
+        "index_build": checkpoint.postgres_indexes,
+        "postgres_post_import": checkpoint.postgres_renamed,
+        "pg_dump": checkpoint.file_marker(pg_dump_file),
+    })
+    options = {
+        "mysqldump_file": mysqldump_file,
+        "converter": converter,
+        "preprocess": preprocess,
+        "target_dsn": target_dsn,
+        "defer_indexes": defer_indexes,
+    }
+    if not resume:
+        run_state.start(options)
+    elif not run_state.path.exists():
+        raise MigrationException(f"no {checkpoint.state_file_name} in {workdir}, nothing to resume")
+    elif differ := run_state.resume(options):
+        raise MigrationException(f"resuming needs the options of the first run, these differ: {', '.join(differ)}")
+    compose_file = str(template.compose_file_path)
+    with run_report:
+        try:
+            if db_runner.name == "docker":
+                prefetch_images(converter, validate)
+            # the native converter needs the uncompressed, slimmed dump
+            if preprocess or converter == "native":
+                if not run_state.skip("preprocess"):
+                    print("---------------------------------------------------")
+                    rich.print(f":scissors:  preprocessing mysqldump file: {mysqldump_file}")
+                    with run_state.stage("preprocess") as details:
+                        preprocessed = mysqldump.preprocess_dump(mysqldump_file, preprocessed_file)
+                        details.update(bytes_read=preprocessed["bytes_read"], bytes_written=preprocessed["bytes_written"])
+                mysqldump_file = str(preprocessed_file)
+            if converter == "native":
+                compose_file = native_convert(
+                    c,
+                    mysqldump_file,
+                    workers=convert_workers,
+                    maintenance_workers=maintenance_workers,
+                    warm_up_dotcms=lean and validate == "dotcms",
+                )
+            else:
+                # import provided mysqldump file
+                print("---------------------------------------------------")
+                rich.print(f":keycap_1:  loading mysqldump file: {mysqldump_file}")
+                if mysql_workers:
+                    template.mysql_source_dump = False
+                    template.write_mysql_init_file()
+                with run_report.phase("start_dbs"):
+                    compose_file = template_all_dbs(mysqldump_file)
+                    c.run(f"cp {compose_file} {compose_file}-dbs")
+                    if run_state.resuming and run_state.saved_stage("mysql_import"):
+                        resume_dbs(c, compose_file)
+                if not run_state.skip("mysql_import"):
+                    with run_state.stage("mysql_import") as details:
+                        if resume:
+                            # mysql only runs its init scripts on an empty volume, start over from one
+                            stop_docker(c, compose_file, hide="both", volumes=True)
+                        start_docker(c, compose_file)
+                        if not target_dsn:
+                            # postgres starts up while mysql loads, pgloader waits for it
+                            background.start("postgres start", postgres_ready, compose_file)
+                        row_targets = mysqldump.row_targets(mysqldump_file)
+                        details["rows_in_dump"] = sum(row_targets.values())
+                        with progress.ProgressMonitor(session, "mysql", row_targets, "mysql import"):
+                            if mysql_workers:
+                                mysql_import_parallel(c, compose_file, mysqldump_file, mysql_workers)
+                            # check if mysql loaded dotcms content
+                            mysql_query_content(compose_file)
+                if lean and not (run_state.resuming and run_state.saved_stage("dotcms_mysql")):
+                    warm_up_opensearch(c, "mysql")
+                if not run_state.skip("mysql_post_import"):
+                    print("cleaning up mysql db")
+                    with run_state.stage("mysql_post_import") as details:
+                        _, details["table_seconds"] = migrate_db.mysql_post_import(session, workers=max(1, mysql_workers))
+                if not run_state.skip("dotcms_mysql"):
+                    print("---------------------------------------------------")
+                    rich.print(f":keycap_2:  start dotcms 21.06 on mysql to execute migrations")
+                    with run_state.stage("dotcms_mysql"):
+                        template_dotcms_mysql()
+                        c.run(f"cp {compose_file} {compose_file}-dotcms-mysql")
+                        wait_images("opensearch", "dotcms")
+                        background.wait("opensearch start")
+                        if lean:
+                            before_lean_dotcms("mysql")
+                        start_docker(c, compose_file)
+                        # wait for dotcms to complete migrations
+                        if not migrate_db.check_dotcms_appconfiguration(
+                            port=template.dotcms_port,
+                            timeout=phase_timeout("dotcms_mysql"),
+                            log_command=db_runner.logs_command(compose_file, "dotcms_mysql"),
+                        ):
+                            raise MigrationException("dotcms did not start on mysql")
+                        # stop dotcms and remove dotcms service from compose file
+                        stop_container(c, compose_file, "dotcms_mysql")
+                        if lean:
+                            after_lean_dotcms(c, compose_file, "mysql")
+                if not run_state.skip("pgloader"):
+                    print("---------------------------------------------------")
+                    # run pgloader 
+                    rich.print(f":keycap_3:  running pgloader to convert mysql -> postgres")
+                    # index definitions an earlier, failed copy deferred belong to the schema this copy drops
+                    (Path(workdir) / indexes.definitions_file_name).unlink(missing_ok=True)
+                    with run_state.stage("pgloader") as details:
+                        pgloader_services = write_pgloader_files(pgloader_shards)
+                        template.write_pgloader_compose()
+                        c.run(f"cp {compose_file} {compose_file}-pgloader")
+                        details["load_file"] = str(template.pgloader_file_path)
+                        wait_images("pgloader")
+                        background.wait("postgres start", required=True)
+                        if "pgloader" not in pgloader_services:
+                            # create the schema alone, with --defer-indexes drop what the copy doesn't need, then copy
+                            c.run(f"docker compose -f {compose_file} up -d pgloader")
+                            pgloader_done(compose_file)
+                            if defer_indexes:
+                                details["deferred_indexes"] = len(indexes.capture(session, session.db, workdir))
+                            c.run(f"docker compose -f {compose_file} up -d --no-deps {' '.join(pgloader_services)}")
+                        else:
+                            # the single command pgloader used to run with builds the indexes after the copy itself
+                            start_docker(c, compose_file)
+                        pgloader_targets = mysqldump.row_targets(mysqldump_file, skip_deleted=True)
+                        details["rows_in_dump"] = sum(pgloader_targets.values())
+                        with progress.ProgressMonitor(session, "postgres", pgloader_targets, "pgloader"):
+                            try:
+                                details["services"] = pgloader_done(compose_file, pgloader_services)
+                            finally:
+                                pgloader_log = save_pgloader_log(c, compose_file, pgloader_services)
+                        details["copy"] = pgloader.copy_report(pgloader_log, pgloader_targets)
+                        if details["copy"]["errors"]:
+                            raise MigrationException(f"pgloader reported errors, see {Path(workdir) / pgloader.log_file_name}")
+                        postgres_query_content()
+                # saved by indexes.capture() with --defer-indexes, when the copy ran from load files written from the mysql table stats
+                if (Path(workdir) / indexes.definitions_file_name).exists() and not run_state.skip("index_build"):
+                    _, deferred_indexes = indexes.load(workdir)
+                    with run_state.stage("index_build") as details:
+                        details["builds"] = indexes.build(session, session.db, deferred_indexes, workers=index_workers)
+                        # raised once every build ran, so the stage isn't checkpointed and --resume builds again
+                        if indexes.failed(details["builds"]):
+                            raise MigrationException("indexes or constraints could not be built, see the index build table")
+                if verify_data and not run_state.skip("verify"):
+                    with run_state.stage("verify") as details:
+                        details["tables"] = verify.verify(session)
+                        # checksum differences are reported, missing rows stop the run before the long dotcms boot
+                        if any(verify.rows_differ(result) for result in details["tables"].values()):
+                            raise MigrationException("postgres is missing tables or rows, see the verification table")
+                postgres_fixups(c, maintenance_workers, warm_up_dotcms=lean and validate == "dotcms")
+                # mysql is done: the next phase's compose file leaves it out, starting it removes mysql
+                template.with_mysql = False
+            print("---------------------------------------------------")
+            # back to durable settings for the dotcms check and pg_dump, the next start recreates postgres on the same volume
+            template.tuning_profile = "safe"
+            if validate == "schema":
+                if not run_state.skip("schema_check"):
+                    rich.print(f":keycap_4:  Check the converted postgres schema against the dotcms 21.06 reference")
+                    with run_state.stage("schema_check") as details:
+                        compose_file = template.write_dbs_compose()
+                        if not target_dsn:
+                            start_docker(c, compose_file)
+                            postgres_ready(compose_file)
+                        details["problems"] = schema_check.validate(session)
+                        if schema_check.errors(details["problems"]):
+                            raise MigrationException("the converted schema differs from dotcms 21.06, see the schema table")
+            elif not run_state.skip("dotcms_postgres"):
+                rich.print(f":keycap_4:  Start dotcms 21.06 on converted postgres db")
+                with run_state.stage("dotcms_postgres"):
+                    template_dotcms_postgres()
+                    c.run(f"cp {compose_file} {compose_file}-dotcms-postgres")
+                    wait_images("opensearch", "dotcms")
+                    background.wait("opensearch start")
+                    if lean:
+                        before_lean_dotcms("postgres")
+                    start_docker(c, compose_file)
+                    if not migrate_db.check_dotcms_appconfiguration(
+                        port=template.dotcms_port,
+                        timeout=phase_timeout("dotcms_postgres"),
+                        log_command=db_runner.logs_command(compose_file, "dotcms_postgres"),
+                    ):
+                        raise MigrationException("dotcms did not start on the converted postgres db")
+                    stop_container(c, compose_file, "dotcms_postgres")
+                    if lean:
+                        after_lean_dotcms(c, compose_file, "postgres")
+            print("---------------------------------------------------")
+            if target_dsn:
+                target = template.target_postgres
+                rich.print(f":keycap_5:  :keycap_6:  [bold]Done! dotCMS data is in postgres db '{target.get('dbname')}' on {target.get('host', 'localhost')}")
+            else:
+                rich.print(f":keycap_5:  Dump postgres database")
+                if not run_state.skip("pg_dump"):
+                    with run_state.stage("pg_dump") as details:
+                        if not db_runner.running(c, compose_file, "postgres"):
+                            # resumed after the check in step 4, nothing started postgres yet
+                            compose_file = template.write_dbs_compose()
+                            start_docker(c, compose_file)
+                            postgres_ready(compose_file)
+                        details.update(export.export(
+                            partial(db_runner.command, c, compose_file, "postgres"),
+                            template.username,
+                            template.dbname,
+                            pg_dump_file,
+                            dump_format=dump_format,
+                            compressor=compressor,
+                            jobs=dump_jobs,
+                            export_mount=db_runner.export_mount(),
+                        ))
+                print(f"\nDone! For reference, all docker compose files are in {workdir_basedir}")
+                rich.print(f":keycap_6:  [bold]Here is your postgres {dump_format} dump:")
+                c.run(f"ls -lhd {pg_dump_file}")
+        except Exception as e:
+            migrate_db.fail_msg("error encountered")
+            print(e)
+            print(f"    continue from the last completed stage with the same options and --resume={workdir}")
+            # the run report is written as failed on the way out, migrate-batch and scripts see the exit code
+            sys.exit(1)
+        finally:
+            stop_docker(c, compose_file, hide="both")
+            background.close()
+
+
+def native_convert(c, mysqldump_file, workers=0, maintenance_workers=4, warm_up_dotcms=False):
+    """ steps 1-3 without mysql and pgloader: copy the dump straight into postgres """
+    print("---------------------------------------------------")
+    rich.print(f":keycap_1:  loading mysqldump file into postgres with the native converter: {mysqldump_file}")
+    template.with_mysql = False
+    with run_report.phase("start_dbs"):
+        compose_file = template.write_dbs_compose()
         c.run(f"cp {compose_file} {compose_file}-dbs")
-        start_docker(c, compose_file)
-        sleep(5)
-        # check if mysql loaded dotcms content
-        print("waiting for mysql to load mysqldump file")
-        mysql_query_content()
-        print("cleaning up mysql db")
-        migrate_db.mysql_post_import(template.username, template.password,)
-        print("---------------------------------------------------")
-        rich.print(f":keycap_2:  start dotcms 21.06 on mysql to execute migrations")
-        template_dotcms_mysql()
-        c.run(f"cp {compose_file} {compose_file}-dotcms-mysql")
-        start_docker(c, compose_file)
-        # wait for dotcms to complete migrations
-        migrate_db.check_dotcms_appconfiguration(port=dotcms_port, attempts=retry_attempts, interval=retry_interval)
-        # stop dotcms and remove dotcms service from compose file
-        stop_container(c, f"{workdir_basedir}_dotcms_mysql_1")
-        print("---------------------------------------------------")
-        # run pgloader 
-        rich.print(f":keycap_3:  running pgloader to convert mysql -> postgres")
-        template.write_pgloader_compose()
-        c.run(f"cp {compose_file} {compose_file}-pgloader")
-        start_docker(c, compose_file)
-        sleep(10)
-        print("waiting for pgloader to complete")
-        postgres_query_content()
-        pgloader_cid = get_cid_from_container_name(c, f"{workdir_basedir}_pgloader_1")
-        if pgloader_cid:
-            c.run(f"docker logs {pgloader_cid}")
-        migrate_db.postgres_post_import(template.username, template.password)
-        print("stop containers")
-        stop_docker(c, compose_file, hide="both")
-        print("---------------------------------------------------")
-        rich.print(f":keycap_4:  Start dotcms 21.06 on converted postgres db")
-        template_dotcms_postgres()
-        c.run(f"cp {compose_file} {compose_file}-dotcms-postgres")
-        start_docker(c, compose_file)
-        migrate_db.check_dotcms_appconfiguration(port=dotcms_port, attempts=retry_attempts, interval=retry_interval)
-        stop_container(c, f"{workdir_basedir}-dotcms_postgres-1")
-        print("---------------------------------------------------")
-        rich.print(f":keycap_5:  Dump postgres database")
-        pg_cid = get_cid_from_container_name(c, f"{workdir_basedir}_postgres_1")
-        c.run(f"docker exec -i {pg_cid} pg_dump --no-owner --clean --no-password -h localhost -U dbuser dotcms -f /tmp/db.sql")
-        c.run(f"docker exec -i {pg_cid} gzip /tmp/db.sql")
-        c.run(f"rm -f {pg_dump_file}")
-        c.run(f"docker cp {pg_cid}:/tmp/db.sql.gz {pg_dump_file}")
-        print(f"\nDone! For reference, all docker compose files are in {workdir_basedir}")
-        c.run(f"docker exec -i {pg_cid} rm -f /tmp/db.sql.gz")
-        rich.print(f":keycap_6:  [bold]Here is your postgres sql file:")
-        c.run(f"ls -lh {pg_dump_file}")
-    except Exception as e:
-        migrate_db.fail_msg("error encountered")
-        print(e)
-    stop_docker(c, compose_file, hide="both")
+        if not template.target_postgres:
+            start_docker(c, compose_file)
+        postgres_ready(compose_file)
+    if not run_state.skip("native_convert"):
+        with run_state.stage("native_convert") as details:
+            details["tables"] = convert.load_dump(
+                mysqldump_file,
+                session.postgres_dsn,
+                schema=template.dbname,
+                workers=workers or tuning.host_resources()[1],
+            )
+    postgres_fixups(c, maintenance_workers, warm_up_dotcms=warm_up_dotcms)
+    rich.print(":keycap_2:  :keycap_3:  skipped dotcms on mysql and pgloader")
+    return compose_file
+
+
+def postgres_fixups(c, maintenance_workers=4, warm_up_dotcms=False):
+    """
+    the post import fixups, then vacuum and analyze, for both converters;
+    warm_up_dotcms starts opensearch for the dotcms check meanwhile
+    """
+    if warm_up_dotcms and not (run_state.resuming and run_state.saved_stage("dotcms_postgres")):
+        warm_up_opensearch(c, "postgres")
+    if not run_state.skip("postgres_post_import"):
+        with run_state.stage("postgres_post_import"):
+            migrate_db.postgres_post_import(session)
+    if not run_state.skip("postgres_maintenance"):
+        with run_state.stage("postgres_maintenance") as details:
+            _, details["table_seconds"] = migrate_db.postgres_maintenance(session, workers=maintenance_workers)
+
+
+@task(help={
+    "dumps": "comma separated absolute paths of mysqldump files, glob patterns too, e.g. '/dumps/*.sql.gz'",
+    "max-memory-mb": "memory the running jobs may be sized to together (default: the host's)",
+    "max-cpus": "cpus the running jobs may be sized to together (default: the host's)",
+    "max-jobs": "jobs running at the same time, 0 for as many as fit (default: 0)",
+    "options": "migrate options for every job, e.g. '--converter=native --validate=schema'",
+})
+def migrate_batch(c, dumps, max_memory_mb=0, max_cpus=0, max_jobs=0, options=""):
+    """ Migrate several mysql dump files at the same time, each in its own compose project with its own ports """
+    dump_files = batch.expand_dumps(dumps)
+    assert dump_files, "no dump files"
+    for dump_file in dump_files:
+        assert os.path.isfile(dump_file), f"{dump_file} does not exist"
+    host_memory, host_cpus = tuning.host_resources()
+    max_memory = max_memory_mb * tuning.megabyte or host_memory
+    max_cpus = max_cpus or host_cpus
+    rich.print(f":card_file_box:  {len(dump_files)} dumps, up to {max_memory // tuning.megabyte:,} MB and {max_cpus} cpus, "
+               f"job directories in {workdir}")
+    jobs = batch.plan_jobs(dump_files, workdir, max_memory, max_cpus)
+    jobs = batch.run_batch(jobs, workdir, max_memory, max_cpus, max_jobs=max_jobs, options=options)
+    if any(job["status"] != "ok" for job in jobs):
+        raise MigrationException("some migrations failed, see the batch report")
+
+
+@task(help={
+    "pg-dsn": "libpq connection string of the target postgres, e.g. 'dbname=dotcms user=dbuser host=127.0.0.1'",
+    "schema": "schema to (re)create and load, default 'dotcms'",
+    "workers": "worker processes (default: cpu count)",
+})
+def convert_dump(c, mysqldump_file, pg_dsn, schema="dotcms", workers=0):
+    """ Load a mysqldump file into a running postgres with the native converter, no docker needed """
+    preprocessed_file = Path(workdir) / "mysqldump-preprocessed.sql"
+    mysqldump.preprocess_dump(mysqldump_file, preprocessed_file)
+    convert.load_dump(str(preprocessed_file), pg_dsn, schema=schema, workers=workers or None)
+
+
+@task(help={
+    "dry-run": "print the rename/cleanup plan without running it",
+    "host": "postgres host (default: 127.0.0.1)",
+})
+def postgres_post_import(c, dry_run=False, host="127.0.0.1"):
+    """ Run (or print) the postgres post import fixups against a converted database """
+    post_import_session = MigrationSession(
+        username=template.username,
+        password=template.password,
+        db=template.dbname,
+        postgres_host=host,
+    )
+    migrate_db.postgres_post_import(post_import_session, dry_run=dry_run)
+    post_import_session.close()
+
+
+@task(help={
+    "contentlets": "contentlet rows in the generated dump, demo rows included (default: 100000)",
+    "versions": "contentlet rows per cloned content, extra ones are old versions (default: 1)",
+    "history": "workflow_history rows per cloned workflow task (default: 2)",
+    "source": "dump to clone content from (default: the demo dump in tests/)",
+    "seed": "changes the generated ids",
+})
+def generate_dump(c, output_file, contentlets=100000, versions=1, history=2, source=None, seed=0):
+    """ Write a dotCMS 21.06 mysqldump file of any size, cloned from the demo dump """
+    synthesizer = synthesize.Synthesizer(source or synthesize.default_source, seed=seed)
+    synthesizer.write(output_file, contentlets=contentlets, versions=versions, history=history)
+
+
+@task(help={
+    "sizes": "comma separated contentlet counts (default: 10000,100000,1000000)",
+    "pg-host": "postgres for the native converter stages (default: skip)",
+    "pg-db": f"database on --pg-host whose schemas are renamed and dropped, created when it doesn't exist (default: {bench.scratch_db})",
+    "scratch": "--pg-db exists and bench didn't create it, but it is a scratch database",
+    "mysql-command": "mysql client command for a scratch db, e.g. 'mysql -uroot -h127.0.0.1 dotcms' (default: skip)",
+    "workers": "worker processes / mysql sessions (default: cpu count / 4)",
+    "keep-dumps": "keep the generated dumps in the workdir",
+})
+def benchmark(c, sizes="10000,100000,1000000", pg_host=None, pg_db=bench.scratch_db, scratch=False, mysql_command=None, workers=0,
+              keep_dumps=False):
+    """ Time the migration stages on generated dumps of several sizes """
+    bench_session = None
+    if pg_host:
+        bench_session = MigrationSession(
+            username=template.username,
+            password=template.password,
+            db=pg_db,
+            postgres_host=pg_host,
+        )
+        if not bench.prepare_scratch_db(bench_session, scratch=scratch):
+            bench_session.close()
+            raise MigrationException(f"{pg_db} on {pg_host} wasn't created by the benchmark, pass --scratch if it may be emptied")
+    bench.run_benchmark(
+        [int(size) for size in sizes.split(",")],
+        workdir,
+        session=bench_session,
+        mysql_command=mysql_command.split() if mysql_command else None,
+        workers=workers or None,
+        keep_dumps=keep_dumps,
+    )
+    if bench_session:
+        bench_session.close()
+
+
+@task(help={
+    "mysql-host": "mysql host with the source db (default: 127.0.0.1)",
+    "postgres-host": "postgres host with the converted db, in schema 'dotcms' or 'public' (default: 127.0.0.1)",
+    "workers": "tables compared at the same time (default: 4)",
+})
+def verify_dbs(c, mysql_host="127.0.0.1", postgres_host="127.0.0.1", workers=4):
+    """ Compare row counts and checksums of every table in mysql and postgres """
+    verify_session = MigrationSession(
+        username=template.username,
+        password=template.password,
+        db=template.dbname,
+        mysql_host=mysql_host,
+        postgres_host=postgres_host,
+    )
+    results = verify.verify(verify_session, workers=workers)
+    verify_session.close()
+    if any(verify.failed(result) for result in results.values()):
+        raise MigrationException("mysql and postgres differ")
+
+
+@task(help={
+    "postgres-host": "postgres host with the converted db, after the post import fixups (default: 127.0.0.1)",
+    "target-dsn": "libpq connection string of the converted db instead of --postgres-host",
+    "reference": "pg_dump file of a working dotcms 21.06 postgres db (default: tests/dotcms-demo-21.06-postgres.sql.gz)",
+})
+def validate_schema(c, postgres_host="127.0.0.1", target_dsn=None, reference=None):
+    """ Check the converted schema against the dotCMS 21.06 reference schema """
+    validate_session = MigrationSession(
+        username=template.username,
+        password=template.password,
+        db=template.dbname,
+        postgres_host=postgres_host,
+        target_dsn=target_dsn,
+    )
+    problems = schema_check.validate(validate_session, reference=reference or schema_check.default_reference)
+    validate_session.close()
+    if schema_check.errors(problems):
+        raise MigrationException("the converted schema differs from dotcms 21.06")
 
 
 @task
 def start_docker(c, compose_file, hide=None):
-    c.run(f"docker compose -f {compose_file} up -d --build", hide=hide)
-    rich.print(":arrow_up: docker compose up")
+    # services whose settings changed are recreated, pooled connections don't survive that
+    session.close()
+    db_runner.start(c, compose_file, hide=hide)
 
 @task
-def stop_docker(c, compose_file, hide=None):
-    c.run(f"docker compose -f {compose_file} down", hide=hide)
-    rich.print(":arrow_down: docker compose down")
-
-def get_cid_from_container_name(c, container_name):
-    """ deal with "slash/underscore" issues in container names """
-    container_name = container_name.replace("-", ".").replace("_", ".")
-    command = f"docker ps | grep '{container_name}' " + "| awk '{print $1}'"
-    response = c.run(command)
-    return response.stdout.strip()
-
-def stop_container(c, container_name):
-    print(f"Stopping container {container_name}...")
-    cid = get_cid_from_container_name(c, container_name)
-    c.run(f"docker stop {cid}")
+def stop_docker(c, compose_file, hide=None, volumes=False):
+    # pooled connections don't survive the containers
+    session.close()
+    db_runner.stop(c, compose_file, hide=hide, volumes=volumes)
+
+def stop_container(c, compose_file, service):
+    print(f"Stopping {service}...")
+    db_runner.stop_service(c, compose_file, service)
     print(f"Stopped ")
 
+def use_workdir(path):
+    """ run in an existing directory, e.g. the workdir of an earlier run: its files, compose project and docker volumes """
+    global workdir, workdir_basedir, template
+    assert os.path.isdir(path), f"{path} is not a directory"
+    # the temp dir made for this run is not needed
+    shutil.rmtree(workdir, ignore_errors=True)
+    workdir = str(Path(path).resolve())
+    workdir_basedir = workdir.split('/')[-1]
+    template = templates.Template(
+        username=template.username,
+        dbname=template.dbname,
+        password=template.password,
+        workdir=workdir,
+    )
+
+def resume_dbs(c, compose_file):
+    """ start mysql and postgres of a resumed run on their kept volumes, the completed stages are checked against them """
+    start_docker(c, compose_file)
+    mysql_ready(compose_file)
+    postgres_ready(compose_file)
+
+def mysql_ready(compose_file):
+    """ wait until mysql accepts connections """
+    readiness.wait_for(
+        "mysql to accept connections",
+        sql_probe("mysql", "SELECT 1"),
+        phase_timeout("mysql_start"),
+        log_command=db_runner.logs_command(compose_file, "mysql"),
+        log_pattern=readiness.mysql_ready_log,
+    )
+
+def mysql_import_parallel(c, compose_file, mysqldump_file, workers):
+    """ load the dump table by table over parallel mysql sessions next to the mysql server """
+    mysql_ready(compose_file)
+    mysql_command = db_runner.command(
+        c, compose_file, "mysql",
+        "mysql", "-uroot", f"-p{template.password}", "-h127.0.0.1", "--max_allowed_packet=32M", template.dbname,
+    )
+    mysqldump.import_parallel(mysqldump_file, mysql_command, workers=workers)
+
 def template_all_dbs(mysqldump_file):
     """
     create docker-compose.yml running
@@ -142,34 +618,170 @@ def template_dotcms_postgres():
     """ create docker-compose.yml running dotcms on postgres """
     return template.compose_dotcms_postgres()
 
-def mysql_query_content():
+def phase_timeout(phase):
+    return readiness.deadline(phase, dump_bytes, factor=deadline_factor)
+
+def sql_probe(kind, query):
+    """ probe returning the first column of the first row, errors mean "not ready" """
+    def probe():
+        return session.execute(kind, query, fetch=True, retry=False)[0][0]
+    return probe
+
+def mysql_query_content(compose_file):
     """ confirm mysql db has dotcms content """
-    count = 1
-    while count <= retry_attempts:
-        sleep(retry_interval)
-        contentlet_count = migrate_db.mysql_query_content(
-            template.username,
-            template.password,
+    try:
+        readiness.wait_for(
+            "mysql to load the mysqldump file",
+            sql_probe("mysql", "SELECT COUNT(*) FROM contentlet"),
+            phase_timeout("mysql_load"),
+            log_command=db_runner.logs_command(compose_file, "mysql"),
+            log_pattern=readiness.mysql_ready_log,
+        )
+    except TimeoutError as e:
+        raise MigrationException(f"mysldump data does not appear to be imported in mysql: {e}")
+    return migrate_db.mysql_query_content(session)
+
+
+def prefetch_images(converter, validate):
+    """
+    pull the images of the phases after the first one in the background, while the dump is preprocessed and loaded;
+    compose pulls the first phase's images, and any image whose pull failed, when it starts them
+    """
+    services = ["dotcms", "pgloader"] if converter == "pgloader" else ["dotcms"] if validate == "dotcms" else []
+    if services and template.lean:
+        # otherwise opensearch starts with the databases
+        services.append("opensearch")
+    for service in services:
+        image = template.service_images[service]
+        background.start(f"pull {image}", overlap.pull_image, image)
+
+def wait_images(*services):
+    """ wait for the pulls of prefetch_images() a phase starts services from """
+    for service in services:
+        background.wait(f"pull {template.service_images[service]}")
+
+def warm_up_opensearch(c, kind):
+    """
+    lean layout: write the compose file of the dotcms phase on kind and start only its opensearch, which boots in the
+    background while the stages before the phase run; the phase then adds dotcms to the running services
+    """
+    if kind == "postgres":
+        # what the dotcms phase runs with, nothing but opensearch is started from this compose file before it
+        template.tuning_profile = "safe"
+        template.with_mysql = False
+        compose_file = template_dotcms_postgres()
+    else:
+        compose_file = template_dotcms_mysql()
+    background.start("opensearch start", opensearch_up, compose_file)
+
+def opensearch_up(compose_file):
+    """ start the opensearch service alone and wait until it answers """
+    subprocess.run(
+        ["docker", "compose", "-f", compose_file, "up", "-d", "--no-deps", "opensearch"], capture_output=True, check=True,
+    )
+    return readiness.wait_for(
+        "opensearch to start",
+        readiness.opensearch_probe(compose_file),
+        phase_timeout("opensearch_start"),
+        log_command=db_runner.logs_command(compose_file, "opensearch"),
+        log_pattern=readiness.opensearch_ready_log,
+    )
+
+def before_lean_dotcms(kind):
+    """
+    lean layout: dotcms starting on an empty index queues a full reindex, into an index that is thrown away;
+    the reindex queue drops it until after_lean_dotcms(), so the boot doesn't spend cpu and io on indexing
+    """
+    try:
+        session.execute_batch(kind, migrate_db.skip_reindex[kind])
+    except Exception as e:
+        migrate_db.fail_msg(f"cannot turn off the {kind} reindex queue, dotcms reindexes while it starts")
+        print(f"   {e}")
+
+def after_lean_dotcms(c, compose_file, kind):
+    """
+    lean layout: stop opensearch until the next dotcms phase, empty the reindex queue (rows from the dump, or
+    the reindex of a boot before_lean_dotcms() could not stop) and let it store rows again;
+    dotcms queues a full reindex when it starts on an empty index again
+    """
+    c.run(f"docker compose -f {compose_file} stop opensearch")
+    session.execute(kind, "DELETE FROM dist_reindex_journal")
+    session.execute_batch(kind, migrate_db.restore_reindex[kind])
+
+def write_pgloader_files(shards=1):
+    """
+    pgloader load files with per-table settings from the mysql table stats: the pgloader service creates the schema,
+    `shards` pgloader services copy the tables. one command for every table if the stats can't be read
+    """
+    try:
+        stats = pgloader.table_stats(session)
+    except Exception as e:
+        migrate_db.fail_msg("cannot read mysql table stats, pgloader runs with its default settings")
+        print(f"   {e}")
+        template.write_pgloader_file()
+        return template.pgloader_services()
+    plan = pgloader.shard_groups(stats, shards)
+    for shard in plan:
+        rich.print(f"   shard {shard['shard']}: {shard['bytes'] / 1024 / 1024:,.0f} MB")
+        print_pgloader_groups(shard["groups"])
+    return template.write_pgloader_shard_files(plan)
+
+def print_pgloader_groups(groups):
+    for group in groups:
+        tables = ", ".join(group["tables"][:5]) + (" ..." if len(group["tables"]) > 5 else "") if group["tables"] else "all other tables"
+        print(f"    {group['bytes'] / 1024 / 1024:,.0f} MB, {', '.join(group['with'][2:])}: {tables}")
+
+def pgloader_done(compose_file, services=("pgloader",)):
+    """ wait for the pgloader containers to finish, returns {service: {"seconds", "exit_code"}} """
+    try:
+        readiness.wait_for(
+            f"{', '.join(services)} to complete",
+            readiness.service_exited_probe(compose_file, *services),
+            phase_timeout("pgloader"),
+            log_command=db_runner.logs_command(compose_file, *services),
+            log_pattern=readiness.pgloader_done_log,
         )
-        if contentlet_count:
-            return True
-        rich.print(f"   attempt [yellow]{count}[/yellow] of {retry_attempts}")
-        count += 1
-    raise MigrationException("mysldump data does not appear to be imported in mysql")
+    except TimeoutError as e:
+        raise MigrationException(f"pgloader did not finish: {e}")
+    runs = readiness.service_runs(compose_file, *services)
+    if len(runs) > 1:
+        for service, run in sorted(runs.items()):
+            rich.print(f"   {service}: {run['seconds']:.1f}s, exit code {run['exit_code']}")
+    failed = [service for service, run in runs.items() if run["exit_code"]]
+    if failed:
+        raise MigrationException(f"{', '.join(failed)} failed, see {Path(workdir) / pgloader.log_file_name}")
+    return runs
+
+def save_pgloader_log(c, compose_file, services):
+    """ the output of the pgloader services, saved to the workdir for pgloader.copy_report(); its error lines are printed """
+    services = " ".join(dict.fromkeys(["pgloader", *services]))
+    log = c.run(f"docker compose -f {compose_file} logs --no-log-prefix {services}", hide="both", warn=True).stdout
+    path = Path(workdir) / pgloader.log_file_name
+    with open(path, "w") as f:
+        f.write(log)
+    rich.print(f":page_facing_up: pgloader log: {path}")
+    for line in pgloader.log_errors(log)[:10]:
+        print(f"   {line}")
+    return log
 
 
 def postgres_query_content():
     """ confirm postgres db has dotcms content """
-    count = 1
-    while count <= retry_attempts:
-        sleep(retry_interval)
-        contentlet_count = migrate_db.postgres_query_content(
-            template.username,
-            template.password,
-        )
-        if contentlet_count:
-            return True
-        rich.print(f"   attempt [yellow]{count}[/yellow] of {retry_attempts}")
-        count += 1
-    raise MigrationException("data does not appear to be imported in postgres")
+    contentlet_count = migrate_db.postgres_query_content(session)
+    if not contentlet_count:
+        raise MigrationException("data does not appear to be imported in postgres")
+    return True
+
 
+def postgres_ready(compose_file):
+    """ wait until postgres accepts connections """
+    try:
+        readiness.wait_for(
+            "postgres to accept connections",
+            sql_probe("postgres", "SELECT 1"),
+            phase_timeout("postgres_start"),
+            log_command=None if template.target_postgres else db_runner.logs_command(compose_file, "postgres"),
+            log_pattern=readiness.postgres_ready_log,
+        )
+    except TimeoutError as e:
+        raise MigrationException(f"postgres does not accept connections: {e}")
@@ -0,0 +1,116 @@
+"""
+Description: server settings for the mysql and postgres containers, sized to the host
+- "bulk": for the load phases of a throwaway staging db, durability off (fsync, doublewrite, log flushes)
+  and memory sized to the host RAM; a crash of the host means starting the migration over
+- "safe": the settings the containers always ran with, used for the final dotcms check and pg_dump
+Template renders the profile into the service commands, changing it recreates the container on the same volume
+- memory_limits(): per service container memory limits for the lean compose layout (Template.lean)
+- budget: the share of the host a run sizes everything to when it shares the host (migrate --memory-mb/--cpus, migrate-batch)
+"""
+
+import os
+
+profiles = ("bulk", "safe")
+megabyte = 1024 * 1024
+gigabyte = 1024 * megabyte
+budget = None # (memory bytes, cpus) instead of the whole host
+
+
+def host_resources():
+    """ (memory bytes, cpu count) of the docker host, assumed to be this host, or the budget of this run """
+    if budget:
+        return budget
+    try:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        # macOS docker desktop runs a VM of its own size, stay modest
+        memory = 4 * gigabyte
+    return memory, os.cpu_count() or 1
+
+
+def size(nbytes):
+    """ server setting notation, whole megabytes """
+    return f"{max(1, int(nbytes // megabyte))}MB"
+
+
+def postgres_settings(profile="safe", memory=None, cpus=None):
+    """ {setting: value} for postgres -c options """
+    settings = {
+        "max_connections": "400",
+        "shared_buffers": "128MB",
+    }
+    if profile != "bulk":
+        return settings
+    if memory is None or cpus is None:
+        memory, cpus = host_resources()
+    settings.update({
+        # mysql, pgloader and dotcms share the host, postgres gets an eighth of it for buffers
+        "shared_buffers": size(min(memory // 8, 8 * gigabyte)),
+        "maintenance_work_mem": size(min(max(memory // 16, 64 * megabyte), 2 * gigabyte)),
+        "max_parallel_maintenance_workers": str(max(1, min(cpus // 2, 8))),
+        "fsync": "off",
+        "synchronous_commit": "off",
+        "full_page_writes": "off",
+        "wal_level": "minimal",
+        # wal_level = minimal needs the wal senders off
+        "max_wal_senders": "0",
+        "max_wal_size": size(min(max(memory // 4, gigabyte), 16 * gigabyte)),
+        "checkpoint_timeout": "30min",
+        "autovacuum": "off",
+    })
+    return settings
+
+
+def mysql_settings(profile="safe", memory=None, cpus=None):
+    """ {option: value} for mysqld --option=value """
+    settings = {
+        "lower_case_table_names": "1",
+        "max_allowed_packet": "32M",
+    }
+    if profile != "bulk":
+        return settings
+    if memory is None or cpus is None:
+        memory, cpus = host_resources()
+    settings.update({
+        "innodb_buffer_pool_size": size(min(memory // 4, 16 * gigabyte)),
+        "innodb_buffer_pool_instances": str(max(1, min(cpus, 8))),
+        "innodb_flush_log_at_trx_commit": "0",
+        "innodb_doublewrite": "0",
+        "innodb_log_file_size": "1G",
+        "innodb_log_buffer_size": "256M",
+        "innodb_io_capacity": "2000",
+        "innodb_write_io_threads": str(max(4, min(cpus, 16))),
+        "sync_binlog": "0",
+    })
+    return settings
+
+
+def postgres_command(profile="safe", memory=None, cpus=None):
+    return "postgres " + " ".join(f"-c '{key}={value}'" for key, value in postgres_settings(profile, memory, cpus).items())
+
+
+def mysql_command(profile="safe", memory=None, cpus=None):
+    return " ".join(f"--{key}={value}" for key, value in mysql_settings(profile, memory, cpus).items())
+
+
+def memory_limits(memory=None):
+    """
+    {service: bytes} container limits sized to the host, above what the settings of the bulk profile let each server use;
+    opensearch and dotcms have fixed heaps
+    """
+    if memory is None:
+        memory, _ = host_resources()
+    return {
+        # the bulk buffer pool plus connections and logs
+        "mysql": min(memory // 4, 16 * gigabyte) + gigabyte,
+        # the bulk shared_buffers plus the index builds' maintenance_work_mem (indexes.session_memory)
+        "postgres": min(memory // 8, 8 * gigabyte) + memory // 4 + gigabyte,
+        "pgloader": max(memory // 4, 2 * gigabyte),
+        "opensearch": gigabyte,
+        "dotcms": 2 * gigabyte,
+    }
+
+
+def compose_size(nbytes):
+    """ docker compose byte notation """
+    return f"{max(1, int(nbytes // megabyte))}m"
@@ -0,0 +1,242 @@
+"""
+Description: compare the mysql source and the converted postgres db table by table
+- exact row counts for every table on both sides
+- order independent checksums: every row is hashed (md5 of its normalized columns) and hashes are summed per chunk
+  - single integer primary keys are chunked by key range, other tables by an md5 bucket of the primary key
+  - values are normalized before hashing: booleans as 1/0, datetimes as UTC "YYYY-MM-DD HH:MM:SS" with zero dates as
+    NULL, floats rounded to 3 decimals, binary as lowercase hex
+- tables run concurrently over pooled connections, mismatching chunks are reported as key ranges
+Run it after pgloader and before postgres_post_import, which changes the quartz tables
+"""
+
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import perf_counter
+
+import rich
+from rich.table import Table
+
+import migrate_db
+
+chunk_rows = 100000 # rows per checksum chunk
+null_marker = "<NULL>"
+integer_types = ("tinyint", "smallint", "mediumint", "int", "bigint")
+
+
+def mysql_tables(session):
+    """ {table: {"columns": [(name, data_type)], "primary_key": [name]}} """
+    tables = {}
+    for table, column, data_type in session.execute(
+        "mysql",
+        "SELECT table_name, column_name, data_type FROM information_schema.columns "
+        "WHERE table_schema = %s ORDER BY table_name, ordinal_position",
+        (session.db,),
+        fetch=True,
+    ):
+        tables.setdefault(table.lower(), {"columns": [], "primary_key": []})["columns"].append((column.lower(), data_type.lower()))
+    for table, column in session.execute(
+        "mysql",
+        "SELECT table_name, column_name FROM information_schema.key_column_usage "
+        "WHERE table_schema = %s AND constraint_name = 'PRIMARY' ORDER BY table_name, ordinal_position",
+        (session.db,),
+        fetch=True,
+    ):
+        if table.lower() in tables:
+            tables[table.lower()]["primary_key"].append(column.lower())
+    return tables
+
+
+def postgres_tables(session, schema):
+    """ {table: {column: data_type}} """
+    tables = {}
+    for table, column, data_type in session.execute(
+        "postgres",
+        "SELECT table_name, column_name, data_type FROM information_schema.columns "
+        "WHERE table_schema = %s ORDER BY table_name, ordinal_position",
+        (schema,),
+        fetch=True,
+    ):
+        tables.setdefault(table, {})[column] = data_type
+    return tables
+
+
+def postgres_schema(session):
+    """ pgloader loads into a schema named like the db until postgres_post_import renames it to public """
+    rows = session.execute("postgres", "SELECT 1 FROM pg_namespace WHERE nspname = %s", (session.db,), fetch=True)
+    return session.db if rows else "public"
+
+
+def column_sql(column, mysql_type, postgres_type):
+    """ (mysql expression, postgres expression) giving the same text for the same value """
+    mysql_column = f"`{column}`"
+    postgres_column = f'"{column}"'
+    if postgres_type == "boolean":
+        return (
+            f"IF({mysql_column} IS NULL, NULL, IF({mysql_column} <> 0, '1', '0'))",
+            f"CASE WHEN {postgres_column} THEN '1' WHEN NOT {postgres_column} THEN '0' END",
+        )
+    if postgres_type.startswith("timestamp"):
+        at_utc = " AT TIME ZONE 'UTC'" if "with time zone" in postgres_type else ""
+        return (
+            f"NULLIF(DATE_FORMAT({mysql_column}, '%Y-%m-%d %H:%i:%s'), '0000-00-00 00:00:00')",
+            f"to_char({postgres_column}{at_utc}, 'YYYY-MM-DD HH24:MI:SS')",
+        )
+    if postgres_type == "date":
+        return (
+            f"NULLIF(DATE_FORMAT({mysql_column}, '%Y-%m-%d'), '0000-00-00')",
+            f"to_char({postgres_column}, 'YYYY-MM-DD')",
+        )
+    if postgres_type == "bytea":
+        return f"LOWER(HEX({mysql_column}))", f"encode({postgres_column}, 'hex')"
+    if postgres_type in ("double precision", "real"):
+        return f"CAST({mysql_column} AS DECIMAL(38,3))", f"{postgres_column}::numeric(38,3)::text"
+    return f"CAST({mysql_column} AS CHAR)", f"{postgres_column}::text"
+
+
+def table_plan(schema, name, mysql_table, postgres_columns, mysql_count, key_range):
+    """ checksum queries for one table, chunked by primary key range or primary key hash bucket """
+    shared = [
+        (column, mysql_type, postgres_columns[column])
+        for column, mysql_type in mysql_table["columns"]
+        if column in postgres_columns
+    ]
+    expressions = {column: column_sql(column, mysql_type, postgres_type) for column, mysql_type, postgres_type in shared}
+    mysql_row = "CONCAT_WS('|', " + ", ".join(f"COALESCE({m}, '{null_marker}')" for m, _ in expressions.values()) + ")"
+    # postgres functions take at most 100 arguments, contentlet has more columns
+    postgres_row = " || '|' || ".join(f"COALESCE({p}, '{null_marker}')" for _, p in expressions.values())
+    chunks = max(1, math.ceil(mysql_count / chunk_rows))
+    primary_key = [column for column in mysql_table["primary_key"] if column in expressions]
+    key_types = dict(mysql_table["columns"])
+    if len(primary_key) == 1 and key_types[primary_key[0]] in integer_types and key_range[0] is not None:
+        key = primary_key[0]
+        low, high = key_range
+        width = max(1, math.ceil((high - low + 1) / chunks))
+        mysql_chunk = f"FLOOR((`{key}` - {low}) / {width})"
+        postgres_chunk = f'floor(("{key}" - {low}) / {width}::numeric)::bigint'
+        describe = lambda chunk: f"{key} {low + chunk * width}..{low + (chunk + 1) * width - 1}"
+    else:
+        # string keys sort differently in mysql and postgres collations, bucket them by hash instead
+        mysql_key = "CONCAT_WS('|', " + ", ".join(f"COALESCE({expressions[c][0]}, '')" for c in primary_key) + ")" if primary_key else mysql_row
+        postgres_key = " || '|' || ".join(f"COALESCE({expressions[c][1]}, '')" for c in primary_key) if primary_key else postgres_row
+        mysql_chunk = f"CONV(SUBSTRING(MD5({mysql_key}), 1, 4), 16, 10) % {chunks}"
+        postgres_chunk = f"('x' || substr(md5({postgres_key}), 1, 4))::bit(16)::int % {chunks}"
+        key_name = ", ".join(primary_key) or "all columns"
+        describe = lambda chunk: f"md5({key_name}) bucket {chunk} of {chunks}"
+    mysql_hash = f"CAST(CONV(SUBSTRING(MD5({mysql_row}), 1, 15), 16, 10) AS UNSIGNED)"
+    postgres_hash = f"('x' || substr(md5({postgres_row}), 1, 15))::bit(60)::bigint"
+    return {
+        "mysql": f"SELECT {mysql_chunk} AS chunk, COUNT(*), SUM({mysql_hash}) FROM `{name}` GROUP BY chunk",
+        "postgres": f'SELECT {postgres_chunk} AS chunk, count(*), sum({postgres_hash}) FROM "{schema}"."{name}" GROUP BY chunk',
+        "describe": describe,
+        "columns": [column for column, _, _ in shared],
+    }
+
+
+def _chunks(session, kind, query):
+    with session.connection(kind) as cnx:
+        if kind == "mysql":
+            # CAST rounding raises notes, which the session's connections turn into errors
+            cnx.raise_on_warnings = False
+        cursor = cnx.cursor()
+        try:
+            cursor.execute(query)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            if kind == "mysql":
+                cnx.raise_on_warnings = True
+    return {int(chunk): (int(count), int(checksum or 0)) for chunk, count, checksum in rows}
+
+
+def verify_table(session, schema, name, mysql_table, postgres_columns):
+    """ compare one table, returns its result dict """
+    started = perf_counter()
+    key = mysql_table["primary_key"]
+    integer_key = len(key) == 1 and dict(mysql_table["columns"])[key[0]] in integer_types
+    stats = f", MIN(`{key[0]}`), MAX(`{key[0]}`)" if integer_key else ", NULL, NULL"
+    mysql_count, low, high = session.execute("mysql", f"SELECT COUNT(*){stats} FROM `{name}`", fetch=True)[0]
+    plan = table_plan(schema, name, mysql_table, postgres_columns, mysql_count, (low, high))
+    mysql_chunks = _chunks(session, "mysql", plan["mysql"])
+    postgres_chunks = _chunks(session, "postgres", plan["postgres"])
+    mismatched = [
+        plan["describe"](chunk)
+        for chunk in sorted(set(mysql_chunks) | set(postgres_chunks))
+        if mysql_chunks.get(chunk) != postgres_chunks.get(chunk)
+    ]
+    return {
+        "mysql_rows": sum(count for count, _ in mysql_chunks.values()),
+        "postgres_rows": sum(count for count, _ in postgres_chunks.values()),
+        "chunks": len(mysql_chunks),
+        "mismatched_chunks": mismatched,
+        "columns_missing": [column for column, _ in mysql_table["columns"] if column not in postgres_columns],
+        "seconds": perf_counter() - started,
+    }
+
+
+def verify(session, workers=4, schema=None):
+    """
+    compare every mysql table with its postgres copy
+    returns {table: result}, where result has "mysql_rows", "postgres_rows", "mismatched_chunks", "columns_missing"
+    or "error" (e.g. the table is missing in postgres)
+    """
+    started = perf_counter()
+    schema = schema or postgres_schema(session)
+    source = mysql_tables(session)
+    target = postgres_tables(session, schema)
+    results = {}
+    rich.print(f":mag: verifying {len(source)} tables against postgres schema '{schema}' with {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(verify_table, session, schema, name, table, target[name]): name
+            for name, table in source.items()
+            if name in target
+        }
+        for name in source:
+            if name not in target:
+                results[name] = {"error": "missing in postgres"}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = {"error": str(e)}
+    print_results(results, perf_counter() - started)
+    return results
+
+
+def rows_differ(result):
+    return bool(result.get("error") or result["mysql_rows"] != result["postgres_rows"])
+
+
+def failed(result):
+    return bool(
+        result.get("error")
+        or result["mysql_rows"] != result["postgres_rows"]
+        or result["mismatched_chunks"]
+        or result["columns_missing"]
+    )
+
+
+def print_results(results, seconds):
+    failures = {name: result for name, result in results.items() if failed(result)}
+    if failures:
+        table = Table(title="mysql -> postgres verification failures")
+        table.add_column("table")
+        table.add_column("mysql rows", justify="right")
+        table.add_column("postgres rows", justify="right")
+        table.add_column("problem")
+        for name, result in sorted(failures.items()):
+            if result.get("error"):
+                table.add_row(name, "-", "-", f"[red]{result['error']}")
+                continue
+            problems = result["mismatched_chunks"][:5]
+            if len(result["mismatched_chunks"]) > 5:
+                problems.append(f"... {len(result['mismatched_chunks']) - 5} more chunks")
+            if result["columns_missing"]:
+                problems.append("columns missing: " + ", ".join(result["columns_missing"]))
+            table.add_row(name, f"{result['mysql_rows']:,}", f"{result['postgres_rows']:,}", "\n".join(problems))
+        rich.print(table)
+        migrate_db.fail_msg(f"{len(failures)} of {len(results)} tables differ, verified in {seconds:.1f}s")
+    else:
+        rows = sum(result["mysql_rows"] for result in results.values())
+        migrate_db.success_msg(f"{len(results)} tables, {rows:,} rows match in mysql and postgres, verified in {seconds:.1f}s")
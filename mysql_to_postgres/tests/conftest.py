@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# tasks.py imports its modules by name from the invoke directory, the tests do the same
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "invoke"))
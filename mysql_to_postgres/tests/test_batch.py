@@ -0,0 +1,70 @@
+import sys
+from pathlib import Path
+
+import batch
+import tuning
+
+gigabyte = tuning.gigabyte
+
+
+def dumps(tmp_path, sizes):
+    """ plain dumps of these sizes in bytes, by name """
+    paths = {}
+    for name, size in sizes.items():
+        path = tmp_path / name
+        with open(path, "wb") as f:
+            f.truncate(size)
+        paths[name] = str(path)
+    return paths
+
+
+def test_expand_dumps(tmp_path, monkeypatch):
+    dumps(tmp_path, {"b.sql.gz": 1, "a.sql.gz": 1, "c.sql": 1})
+    monkeypatch.chdir(tmp_path)
+    expanded = batch.expand_dumps(f"c.sql, *.sql.gz,,{tmp_path / 'a.sql.gz'}")
+    # globs sorted, relative paths made absolute, each dump once
+    assert expanded == [str(tmp_path / name) for name in ("c.sql", "a.sql.gz", "b.sql.gz")]
+    # a path that matches nothing is kept, migrate fails on it
+    assert batch.expand_dumps("missing.sql") == [str(tmp_path / "missing.sql")]
+
+
+def test_job_resources():
+    assert batch.job_resources(0, 64 * gigabyte, 16) == (batch.job_base_memory, batch.job_min_cpus)
+    assert batch.job_resources(8 * gigabyte, 64 * gigabyte, 16) == (batch.job_base_memory + 4 * gigabyte, 4)
+    assert batch.job_resources(100 * gigabyte, 64 * gigabyte, 16) == (56 * gigabyte, batch.job_max_cpus)
+    # capped by the host
+    assert batch.job_resources(100 * gigabyte, 8 * gigabyte, 2) == (8 * gigabyte, 2)
+    assert batch.job_resources(0, 8 * gigabyte, 1) == (batch.job_base_memory, 1)
+
+
+def test_plan_jobs(tmp_path):
+    paths = dumps(tmp_path, {"small.sql": 1000, "Big Site.sql.gz": 5000, "other.sql": 3000})
+    jobs = batch.plan_jobs(list(paths.values()), tmp_path, 64 * gigabyte, 16)
+    assert [job["name"] for job in jobs] == ["2-big_site", "3-other", "1-small"]
+    assert [job["dump_bytes"] for job in jobs] == [5000, 3000, 1000]
+    for job in jobs:
+        assert Path(job["directory"]).parent == tmp_path and Path(job["directory"]).is_dir()
+        assert job["status"] == "queued"
+    ports = [port for job in jobs for port in job["ports"].values()]
+    assert len(set(ports)) == 9
+
+
+def test_job_command():
+    job = {
+        "dump": "/dumps/site.sql.gz",
+        "directory": "/batch/dotcms_migrate_site_1",
+        "ports": {"mysql": 13306, "postgres": 15432, "dotcms": 18080},
+        "memory": 8 * gigabyte,
+        "cpus": 4,
+    }
+    assert batch.job_command(job, "--converter=convert --timeout='1 hour'") == [
+        sys.executable, "-m", "invoke", "migrate", "/dumps/site.sql.gz",
+        "--directory=/batch/dotcms_migrate_site_1",
+        "--mysql-port=13306",
+        "--postgres-port=15432",
+        "--dotcms-port=18080",
+        "--memory-mb=8192",
+        "--cpus=4",
+        "--converter=convert",
+        "--timeout=1 hour",
+    ]
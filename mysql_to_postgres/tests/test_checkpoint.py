@@ -0,0 +1,97 @@
+import json
+
+import checkpoint
+import report
+
+
+class Session:
+    """ what RunReport and the markers read: the statements run and the contentlet rows in mysql """
+    def __init__(self):
+        self.statements = []
+        self.contentlets = 100
+
+
+def markers():
+    return {"mysql_import": lambda session: session.contentlets}
+
+
+def run(tmp_path, session, stages, options=None, resume=False):
+    """ the stages a (resumed) run ran, and its checkpoint """
+    point = checkpoint.Checkpoint(tmp_path, session, report.RunReport(session, tmp_path), markers())
+    options = options or {"mysqldump_file": "dump.sql.gz", "workers": 4}
+    differ = point.resume(options) if resume else point.start(options)
+    ran = []
+    for name in stages:
+        if not point.skip(name):
+            with point.stage(name):
+                ran.append(name)
+    return ran, point, differ
+
+
+def test_new_run_saves_every_stage(tmp_path):
+    ran, point, _ = run(tmp_path, Session(), ["mysql_import", "mysql_post_import", "pgloader"])
+    assert ran == ["mysql_import", "mysql_post_import", "pgloader"]
+    with open(tmp_path / checkpoint.state_file_name) as f:
+        state = json.load(f)
+    assert [stage["name"] for stage in state["stages"]] == ran
+    assert state["stages"][0]["marker"] == 100 and state["stages"][1]["marker"] is None
+    assert state["options"]["mysqldump_file"] == "dump.sql.gz"
+
+
+def test_resume_skips_the_completed_stages(tmp_path):
+    session = Session()
+    run(tmp_path, session, ["mysql_import", "mysql_post_import"])
+    ran, point, differ = run(tmp_path, session, ["mysql_import", "mysql_post_import", "pgloader"], resume=True)
+    assert differ == []
+    assert ran == ["pgloader"]
+    assert point.skipped == ["mysql_import", "mysql_post_import"]
+    assert [phase["status"] for phase in point.run_report.phases] == ["skipped", "skipped", "ok"]
+    assert point.completed() == ["mysql_import", "mysql_post_import", "pgloader"]
+
+
+def test_changed_marker_runs_the_stage_and_the_later_ones_again(tmp_path):
+    session = Session()
+    run(tmp_path, session, ["mysql_import", "mysql_post_import"])
+    session.contentlets = 99
+    ran, point, _ = run(tmp_path, session, ["mysql_import", "mysql_post_import"], resume=True)
+    assert ran == ["mysql_import", "mysql_post_import"]
+    assert point.skipped == []
+
+
+def test_stage_running_again_drops_the_later_stages(tmp_path):
+    session = Session()
+    run(tmp_path, session, ["export", "mysql_import", "mysql_post_import"])
+    session.contentlets = 99
+    ran, point, _ = run(tmp_path, session, ["export"], resume=True)
+    assert ran == []
+    # export completed, mysql_import runs again: it and mysql_post_import leave the state
+    assert not point.skip("mysql_import")
+    assert point.completed() == ["export"]
+    assert not point.skip("mysql_post_import")
+
+
+def test_resume_with_other_data_options(tmp_path):
+    session = Session()
+    run(tmp_path, session, ["mysql_import"])
+    options = {"mysqldump_file": "other.sql.gz", "workers": 8}
+    ran, point, differ = run(tmp_path, session, [], options=options, resume=True)
+    assert differ == ["mysqldump_file"]
+    assert point.state["options"]["mysqldump_file"] == "dump.sql.gz"
+
+
+def test_resume_with_other_tuning_options(tmp_path):
+    session = Session()
+    run(tmp_path, session, ["mysql_import"])
+    ran, point, differ = run(tmp_path, session, ["mysql_import"], options={"mysqldump_file": "dump.sql.gz", "workers": 8}, resume=True)
+    assert differ == [] and ran == []
+    assert point.state["options"]["workers"] == 8
+
+
+def test_file_marker(tmp_path):
+    assert checkpoint.file_marker(tmp_path / "missing.sql.gz")(None) is None
+    (tmp_path / "dump.sql.gz").write_bytes(b"x" * 10)
+    assert checkpoint.file_marker(tmp_path / "dump.sql.gz")(None) == 10
+    (tmp_path / "dir").mkdir()
+    (tmp_path / "dir" / "1.dat").write_bytes(b"x" * 3)
+    (tmp_path / "dir" / "2.dat").write_bytes(b"x" * 4)
+    assert checkpoint.file_marker(tmp_path / "dir")(None) == 7
@@ -0,0 +1,86 @@
+import convert
+
+
+def rows(line, kinds):
+    return list(convert.parse_insert(line, kinds))
+
+
+def test_parse_insert_numbers_strings_and_nulls():
+    line = b"INSERT INTO `t` VALUES (1,'a',NULL,-2.5e3),(2,'',NULL,0);\n"
+    assert rows(line, ["number", "text", "text", "number"]) == [
+        b"1\ta\t\\N\t-2.5e3\n",
+        b"2\t\t\\N\t0\n",
+    ]
+
+
+def test_parse_insert_quotes_and_separators_inside_strings():
+    line = b"INSERT INTO `t` VALUES (1,'it''s','a),(b','\\'q\\'');\n"
+    assert rows(line, ["number", "text", "text", "text"]) == [b"1\tit's\ta),(b\t'q'\n"]
+
+
+def test_parse_insert_mysql_escapes_become_copy_escapes():
+    # \n \t \r and \\ in mysql, backslash escaped again for COPY; NUL is dropped like pgloader does
+    line = b"INSERT INTO `t` VALUES ('a\\nb\\tc\\rd\\\\e\\0f\\Zg');\n"
+    assert rows(line, ["text"]) == [b"a\\nb\\tc\\rd\\\\ef\x1ag\n"]
+
+
+def test_parse_insert_utf8_passes_through():
+    line = "INSERT INTO `t` VALUES ('caf\u00e9 \u2713');\n".encode()
+    assert rows(line, ["text"]) == ["caf\u00e9 \u2713\n".encode()]
+
+
+def test_parse_insert_booleans():
+    line = b"INSERT INTO `t` VALUES (1,0,NULL,b'1',b'0','\\0');\n"
+    assert rows(line, ["bool"] * 6) == [b"t\tf\t\\N\tt\tf\tf\n"]
+
+
+def test_parse_insert_binary_values():
+    line = b"INSERT INTO `t` VALUES (0x0aff,_binary 'a\\0b',0x);\n"
+    assert rows(line, ["bytea"] * 3) == [b"\\\\x0aff\t\\\\x610062\t\\\\x\n"]
+
+
+def test_parse_insert_zero_dates_become_null():
+    line = b"INSERT INTO `t` VALUES ('0000-00-00 00:00:00','2021-06-01 10:00:00');\n"
+    assert rows(line, ["date", "date"]) == [b"\\N\t2021-06-01 10:00:00\n"]
+
+
+def test_parse_insert_with_column_list():
+    line = b"INSERT INTO `t` (`a`, `b`) VALUES (1,'x'),(2,'y');\n"
+    assert rows(line, ["number", "text"]) == [b"1\tx\n", b"2\ty\n"]
+
+
+def test_parse_insert_table_without_columns():
+    assert rows(b"INSERT INTO `t` VALUES ();\n", []) == [b"\n"]
+
+
+def test_parse_create_table():
+    create = b"""CREATE TABLE `contentlet` (
+  `inode` varchar(36) NOT NULL,
+  `identifier` char(36) DEFAULT NULL,
+  `show_on_menu` tinyint(1) DEFAULT NULL,
+  `mod_date` datetime NOT NULL DEFAULT '0000-00-00 00:00:00',
+  `sort_order` int(11) DEFAULT '0',
+  PRIMARY KEY (`inode`),
+  KEY `idx_contentlet_3` (`inode`,`sort_order`),
+  CONSTRAINT `fk_contentlet_inode` FOREIGN KEY (`inode`) REFERENCES `inode` (`inode`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+"""
+    table = convert.parse_create_table(create)
+    assert [(c["name"], c["type"], c["kind"], c["not_null"], c["default"]) for c in table["columns"]] == [
+        ("inode", "character varying(36)", "text", True, None),
+        ("identifier", "character(36)", "text", False, None),
+        ("show_on_menu", "boolean", "bool", False, None),
+        ("mod_date", "timestamp with time zone", "date", False, None),
+        ("sort_order", "bigint", "number", False, "'0'"),
+    ]
+    assert table["primary_key"] == ["inode"]
+    assert table["indexes"] == [{"name": "idx_contentlet_3", "unique": False, "columns": ["inode", "sort_order"]}]
+    assert table["foreign_keys"][0]["references"] == "inode"
+
+
+def test_parse_insert_raw_literals_without_kinds():
+    line = b"INSERT INTO `t` VALUES (1,'it''s',NULL,0x0a),(2,'a\\'b','',_binary 'x');\n"
+    assert list(convert.parse_insert(line)) == [
+        [b"1", b"'it''s'", b"NULL", b"0x0a"],
+        [b"2", b"'a\\'b'", b"''", b"_binary 'x'"],
+    ]
@@ -0,0 +1,40 @@
+from pathlib import Path
+
+import export
+
+
+def test_default_path():
+    assert export.default_path("/tmp/run") == Path("/tmp/run/dotcms-21.06-postgres.sql.gz")
+    assert export.default_path("/tmp/run", compressor="zstd") == Path("/tmp/run/dotcms-21.06-postgres.sql.zst")
+    assert export.default_path("/tmp/run", compressor="pigz") == Path("/tmp/run/dotcms-21.06-postgres.sql.gz")
+    assert export.default_path("/tmp/run", "custom") == Path("/tmp/run/dotcms-21.06-postgres.dump")
+    assert export.default_path("/tmp/run", "directory") == Path("/tmp/run/dotcms-21.06-postgres.dir")
+
+
+def test_suffix_matches():
+    assert export.suffix_matches("/out/site.sql.gz")
+    assert export.suffix_matches("/out/site.sql.zst", compressor="zstd")
+    assert export.suffix_matches("/out/site.dump", "custom")
+    assert export.suffix_matches("/out/site.dir", "directory")
+    # other suffixes are used as given
+    assert export.suffix_matches("/out/site.backup", "custom")
+    assert export.suffix_matches("/out/site-2024.06", compressor="zstd")
+
+
+def test_suffix_of_another_format_or_compressor():
+    assert not export.suffix_matches("/out/site.sql.gz", compressor="zstd")
+    assert not export.suffix_matches("/out/site.sql", compressor="gzip")
+    assert not export.suffix_matches("/out/site.sql.gz", "custom")
+    assert not export.suffix_matches("/out/site.dump", "directory")
+    # export() replaces the directory
+    assert not export.suffix_matches("/out/site", "directory")
+
+
+def test_export_writes_the_given_path(tmp_path):
+    path = tmp_path / "site.backup"
+    path.write_bytes(b"old")
+    command = lambda *args, host_user=False: ["printf", "dump"]
+    stats = export.export(command, "dotcms", "dotcms", path, dump_format="custom")
+    assert stats["path"] == str(path)
+    assert path.read_bytes() == b"dump"
+    assert stats["bytes"] == 4
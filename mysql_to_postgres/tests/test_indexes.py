@@ -0,0 +1,119 @@
+import indexes
+
+index = ("index", "contentlet", "idx_contentlet_3", "CREATE INDEX idx_contentlet_3 ON dotcms.contentlet USING btree (inode)", None)
+unique = ("unique", "identifier", "identifier_host_key", "UNIQUE (parent_path, asset_name, host_inode)", None)
+foreign_key = ("foreign_key", "contentlet", "fk_contentlet_inode", "FOREIGN KEY (inode) REFERENCES dotcms.inode(inode)", "inode")
+
+
+class Session:
+    """ answers the catalog queries of capture() and build() and records the statements it runs """
+    def __init__(self, definitions=(), sizes=(), fail=()):
+        self.answers = {"pg_get_indexdef": list(definitions), "pg_relation_size": list(sizes)}
+        self.fail = fail
+        self.params = []
+        self.statements = []
+
+    def execute(self, kind, query, params=None, fetch=False):
+        if fetch:
+            self.params.append(params)
+            return next((rows for key, rows in self.answers.items() if key in query), [])
+        self.statements.append(query)
+        return 0
+
+    def execute_batch(self, kind, queries):
+        self.statements += queries
+        return len(queries)
+
+    def execute_all(self, kind, queries):
+        self.statements.append(queries[-1])
+        if any(name in queries[-1] for name in self.fail):
+            raise RuntimeError(f"could not build {queries[-1]}")
+
+
+def definition(kind, table, name, sql, references):
+    return {"kind": kind, "table": table, "name": name, "definition": sql, "references": references}
+
+
+def test_capture_drops_foreign_keys_before_what_they_reference(tmp_path):
+    session = Session([index, unique, foreign_key])
+    definitions = indexes.capture(session, "dotcms", tmp_path)
+    assert definitions == [definition(*index), definition(*unique), definition(*foreign_key)]
+    assert session.statements == [
+        'ALTER TABLE "dotcms"."contentlet" DROP CONSTRAINT "fk_contentlet_inode";',
+        'ALTER TABLE "dotcms"."identifier" DROP CONSTRAINT "identifier_host_key";',
+        'DROP INDEX "dotcms"."idx_contentlet_3";',
+    ]
+    assert indexes.load(tmp_path) == ("dotcms", definitions)
+
+
+def test_capture_of_a_bare_schema():
+    session = Session()
+    assert indexes.capture(session, "dotcms") == []
+    assert session.statements == []
+    assert session.params == [{"schema": "dotcms"}]
+
+
+def test_create_sql():
+    assert indexes.create_sql("dotcms", definition(*index)) == index[3] + ";"
+    assert indexes.create_sql("dotcms", definition(*unique)) == \
+        'ALTER TABLE "dotcms"."identifier" ADD CONSTRAINT "identifier_host_key" UNIQUE (parent_path, asset_name, host_inode);'
+    # added without checking the rows, validated after
+    assert indexes.create_sql("dotcms", definition(*foreign_key)) == \
+        'ALTER TABLE "dotcms"."contentlet" ADD CONSTRAINT "fk_contentlet_inode" FOREIGN KEY (inode) REFERENCES dotcms.inode(inode) NOT VALID;'
+
+
+def test_build_biggest_tables_first_foreign_keys_last():
+    session = Session(sizes=[("contentlet", 1000), ("identifier", 10)])
+    definitions = [definition(*unique), definition(*foreign_key), definition(*index)]
+    results = indexes.build(session, "dotcms", definitions, workers=1)
+    assert session.statements == [
+        indexes.create_sql("dotcms", definition(*index)),
+        indexes.create_sql("dotcms", definition(*unique)),
+        indexes.create_sql("dotcms", definition(*foreign_key)),
+        'ALTER TABLE "dotcms"."contentlet" VALIDATE CONSTRAINT "fk_contentlet_inode";',
+    ]
+    assert {key: (result["kind"], result["error"]) for key, result in results.items()} == {
+        "contentlet.idx_contentlet_3": ("index", None),
+        "identifier.identifier_host_key": ("unique", None),
+        "contentlet.fk_contentlet_inode": ("foreign_key", None),
+    }
+
+
+def test_build_goes_on_after_a_failed_build():
+    session = Session(fail=["idx_contentlet_3"])
+    results = indexes.build(session, "dotcms", [definition(*index), definition(*unique)], workers=2)
+    assert results["contentlet.idx_contentlet_3"]["error"].startswith("could not build CREATE INDEX idx_contentlet_3")
+    assert results["identifier.identifier_host_key"]["error"] is None
+
+
+
+def test_build_goes_on_after_a_foreign_key_that_cannot_be_added():
+    other = ("foreign_key", "identifier", "fk_identifier_host", "FOREIGN KEY (host_inode) REFERENCES dotcms.identifier(id)", "identifier")
+    session = Session(fail=["fk_contentlet_inode"])
+    results = indexes.build(session, "dotcms", [definition(*foreign_key), definition(*other)], workers=1)
+    # the failed one is not validated
+    assert session.statements == [
+        indexes.create_sql("dotcms", definition(*foreign_key)),
+        indexes.create_sql("dotcms", definition(*other)),
+        'ALTER TABLE "dotcms"."identifier" VALIDATE CONSTRAINT "fk_identifier_host";',
+    ]
+    assert results["contentlet.fk_contentlet_inode"]["error"].startswith("could not build ALTER TABLE")
+    assert results["identifier.fk_identifier_host"]["error"] is None
+    assert indexes.failed(results) == ["contentlet.fk_contentlet_inode"]
+
+def test_build_again_skips_what_was_built():
+    session = Session()
+    session.answers["SELECT t.relname, i.relname"] = [("contentlet", "idx_contentlet_3"), ("contentlet", "fk_contentlet_inode")]
+    results = indexes.build(session, "dotcms", [definition(*index), definition(*unique), definition(*foreign_key)], workers=1)
+    # the foreign key added before is only validated
+    assert session.statements == [
+        indexes.create_sql("dotcms", definition(*unique)),
+        'ALTER TABLE "dotcms"."contentlet" VALIDATE CONSTRAINT "fk_contentlet_inode";',
+    ]
+    assert sorted(results) == ["contentlet.fk_contentlet_inode", "identifier.identifier_host_key"]
+
+
+def test_failed_lists_the_failed_builds():
+    results = indexes.build(Session(fail=["identifier_host_key"]), "dotcms", [definition(*index), definition(*unique)])
+    assert indexes.failed(results) == ["identifier.identifier_host_key"]
+    assert indexes.failed({}) == []
@@ -0,0 +1,74 @@
+import migrate_db
+
+
+class Session:
+    """ answers catalog queries with canned rows, by a piece of the query """
+    db = "dotcms"
+
+    def __init__(self, answers):
+        self.answers = answers
+
+    def execute(self, kind, query, params=None, fetch=False):
+        return next(rows for key, rows in self.answers.items() if key in query)
+
+
+def mysql_catalog(columns, indexes=()):
+    return Session({"information_schema.columns": columns, "information_schema.statistics": indexes})
+
+
+def test_mysql_post_import_plan_one_alter_per_table():
+    plan = migrate_db.mysql_post_import_plan(mysql_catalog([
+        ("user_", "userid", "varchar(100)", "NO"),
+        ("user_", "male", "tinyint(4)", "YES"),
+        ("user_", "dottedskins", "tinyint(4)", "YES"),
+        ("Company", "AUTOLOGIN", "tinyint(4)", "YES"),
+    ]))
+    assert plan == {
+        "company": ["ALTER TABLE `company` MODIFY `autologin` tinyint(1);"],
+        "user_": ["ALTER TABLE `user_` MODIFY `male` tinyint(1), MODIFY `dottedskins` tinyint(1);"],
+    }
+
+
+def test_mysql_post_import_plan_leaves_out_columns_with_the_right_type():
+    plan = migrate_db.mysql_post_import_plan(mysql_catalog([
+        # rewritten by the mysqldump preprocessing
+        ("user_", "male", "tinyint(1)", "YES"),
+        ("sitesearch_audit", "incremental", "tinyint(1)", "NO"),
+        # NOT NULL is part of the wanted type
+        ("sitesearch_audit", "all_hosts", "tinyint(1)", "YES"),
+    ]))
+    assert plan == {"sitesearch_audit": ["ALTER TABLE `sitesearch_audit` MODIFY `all_hosts` tinyint(1) NOT NULL;"]}
+
+
+def test_mysql_post_import_plan_truncates_emptied_tables_that_exist():
+    plan = migrate_db.mysql_post_import_plan(mysql_catalog([
+        ("clickstream", "clickstream_id", "bigint(20)", "NO"),
+        ("dist_reindex_journal", "id", "bigint(20)", "NO"),
+    ]))
+    assert plan == {
+        table: ["SET FOREIGN_KEY_CHECKS=0;", f"TRUNCATE TABLE `{table}`;", "SET FOREIGN_KEY_CHECKS=1;"]
+        for table in ("clickstream", "dist_reindex_journal")
+    }
+
+
+def test_mysql_post_import_plan_adds_a_missing_index():
+    columns = [("workflow_action", "step_id", "varchar(36)", "YES")]
+    assert migrate_db.mysql_post_import_plan(mysql_catalog(columns)) == {
+        "workflow_action": ["ALTER TABLE `workflow_action` ADD INDEX workflow_idx_action_step (step_id);"],
+    }
+    assert migrate_db.mysql_post_import_plan(mysql_catalog(columns, [("workflow_action", "WORKFLOW_IDX_ACTION_STEP")])) == {}
+
+
+def test_postgres_maintenance_plan_largest_tables_first():
+    plan = migrate_db.postgres_maintenance_plan(Session({
+        "c.relkind = 'r'": [("contentlet",), ("inode",), ("trackback",)],
+        "pg_depend": [("trackback_sequence", "trackback", "id"), ("dropped_seq", "dropped", "id")],
+    }))
+    assert list(plan) == ["contentlet", "inode", "trackback"]
+    assert plan["contentlet"] == ['VACUUM (ANALYZE) "public"."contentlet";']
+    # owned sequences move up to the column's max in the same pass, sequences of tables not vacuumed are left alone
+    assert plan["trackback"] == [
+        'VACUUM (ANALYZE) "public"."trackback";',
+        """SELECT setval('"public"."trackback_sequence"', m) FROM (SELECT max("id") AS m FROM "public"."trackback") x """
+        """WHERE m >= (SELECT last_value FROM "public"."trackback_sequence");""",
+    ]
@@ -0,0 +1,135 @@
+import gzip
+
+import mysqldump
+
+header = b"""-- MySQL dump 10.13  Distrib 5.7.40, for Linux (x86_64)
+--
+-- Host: localhost    Database: dotcms
+/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */;
+/*!40014 SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS, FOREIGN_KEY_CHECKS=0 */;
+
+/*!40000 DROP DATABASE IF EXISTS `dotcms`*/;
+CREATE DATABASE /*!32312 IF NOT EXISTS*/ `dotcms` /*!40100 DEFAULT CHARACTER SET utf8 */;
+USE `dotcms`;
+"""
+
+user_table = b"""
+--
+-- Table structure for table `user_`
+--
+
+DROP TABLE IF EXISTS `user_`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `user_` (
+  `userid` varchar(100) NOT NULL,
+  `male` tinyint(4) DEFAULT NULL,
+  `failedloginattempts` tinyint(4) DEFAULT NULL,
+  PRIMARY KEY (`userid`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `user_`
+--
+
+LOCK TABLES `user_` WRITE;
+/*!40000 ALTER TABLE `user_` DISABLE KEYS */;
+INSERT INTO `user_` VALUES ('dotcms.org.1',1,0),('system',NULL,3);
+/*!40000 ALTER TABLE `user_` ENABLE KEYS */;
+UNLOCK TABLES;
+"""
+
+summary_table = b"""
+--
+-- Table structure for table `analytic_summary`
+--
+
+DROP TABLE IF EXISTS `analytic_summary`;
+CREATE TABLE `analytic_summary` (
+  `id` bigint(20) NOT NULL,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+LOCK TABLES `analytic_summary` WRITE;
+INSERT INTO `analytic_summary` VALUES (1),(2),(3);
+UNLOCK TABLES;
+"""
+
+trailer = b"""/*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;
+
+/*!40014 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS */;
+/*!40101 SET CHARACTER_SET_CLIENT=@OLD_CHARACTER_SET_CLIENT */;
+
+-- Dump completed on 2022-12-02  2:27:34
+"""
+
+dump = header + user_table + summary_table + trailer
+
+
+def preprocess(tmp_path, content, gzipped=False):
+    src = tmp_path / ("dump.sql.gz" if gzipped else "dump.sql")
+    src.write_bytes(gzip.compress(content) if gzipped else content)
+    dst = tmp_path / "preprocessed.sql"
+    return mysqldump.preprocess_dump(src, dst), dst.read_bytes()
+
+
+def test_preprocess_drops_the_inserts_of_emptied_tables(tmp_path):
+    report, output = preprocess(tmp_path, dump)
+    assert b"INSERT INTO `analytic_summary`" not in output
+    assert b"CREATE TABLE `analytic_summary`" in output
+    assert b"INSERT INTO `user_` VALUES ('dotcms.org.1',1,0),('system',NULL,3);" in output
+    assert report["tables"]["analytic_summary"]["inserts_removed"] == 1
+
+
+def test_preprocess_drops_database_statements(tmp_path):
+    report, output = preprocess(tmp_path, dump)
+    assert b"DROP DATABASE" not in output
+    assert b"CREATE DATABASE" not in output
+    assert b"USE `dotcms`" not in output
+    assert len(report["statements_removed"]) == 3
+
+
+def test_preprocess_rewrites_boolean_columns_only(tmp_path):
+    report, output = preprocess(tmp_path, dump)
+    assert b"  `male` tinyint(1) DEFAULT NULL,\n" in output
+    assert b"  `failedloginattempts` tinyint(4) DEFAULT NULL,\n" in output
+    assert report["tables"]["user_"]["columns_rewritten"] == ["male"]
+
+
+def test_preprocess_keeps_the_trailer_and_counts_bytes(tmp_path):
+    report, output = preprocess(tmp_path, dump)
+    assert output.endswith(trailer)
+    assert report["bytes_read"] == len(dump)
+    assert report["bytes_written"] == len(output)
+
+
+def test_preprocess_reads_gzipped_dumps(tmp_path):
+    _, plain = preprocess(tmp_path, dump)
+    _, gzipped = preprocess(tmp_path, dump, gzipped=True)
+    assert gzipped == plain
+
+
+def test_index_dump_sections_and_rows(tmp_path):
+    path = tmp_path / "dump.sql"
+    path.write_bytes(dump)
+    tables = mysqldump.index_dump(path)
+    assert list(tables) == ["user_", "analytic_summary"]
+    user, summary = tables["user_"], tables["analytic_summary"]
+    assert user["start"] == dump.index(b"-- Table structure for table `user_`")
+    assert user["end"] == summary["start"] == dump.index(b"-- Table structure for table `analytic_summary`")
+    assert user["create"].startswith(b"CREATE TABLE `user_` (") and user["create"].endswith(b"CHARSET=utf8;\n")
+    assert user["rows"] == 2 and summary["rows"] == 3
+
+
+def test_index_dump_data_range_and_trailer(tmp_path):
+    path = tmp_path / "dump.sql"
+    path.write_bytes(dump)
+    tables = mysqldump.index_dump(path)
+    summary = tables["analytic_summary"]
+    insert = b"INSERT INTO `analytic_summary` VALUES (1),(2),(3);\n"
+    assert dump[summary["data_start"]:summary["data_end"]] == insert
+    assert summary["data_bytes"] == len(insert)
+    # the trailer after the last table belongs to its section
+    assert summary["end"] == len(dump)
+    assert summary["create_end"] <= summary["data_start"]
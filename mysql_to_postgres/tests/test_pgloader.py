@@ -0,0 +1,173 @@
+import pgloader
+
+
+def stats(rows, avg_row_length, blob_columns=0):
+    return {"rows": rows, "avg_row_length": avg_row_length, "bytes": rows * avg_row_length, "blob_columns": blob_columns}
+
+
+def test_table_settings_small_tables_get_the_largest_batches():
+    assert pgloader.table_settings(stats(1000, 20000)) == {"batch_rows": 100000, "multiple_readers": False}
+
+
+def test_table_settings_batch_rows_from_the_row_length():
+    # 64MB batches of 2kB rows, rounded down to a tier
+    assert pgloader.table_settings(stats(100000, 2048))["batch_rows"] == 25000
+    assert pgloader.table_settings(stats(100000, 200000))["batch_rows"] == 250
+
+
+def test_table_settings_blob_tables_get_a_quarter():
+    assert pgloader.table_settings(stats(100000, 2048, blob_columns=1))["batch_rows"] == 5000
+
+
+def test_table_settings_many_rows_get_multiple_readers():
+    assert pgloader.table_settings(stats(pgloader.multiple_readers_rows + 1, 100))["multiple_readers"] is True
+    assert pgloader.table_settings(stats(pgloader.multiple_readers_rows, 100))["multiple_readers"] is False
+
+
+def test_load_groups_largest_first_with_a_default_group():
+    groups = pgloader.load_groups({
+        "contentlet": stats(1000000, 4096, blob_columns=3),
+        "inode": stats(1000000, 100),
+        "identifier": stats(500000, 300),
+        "company": stats(1, 500),
+    }, cpus=8)
+    assert [group["tables"] for group in groups] == [["contentlet"], ["identifier", "inode"], None]
+    assert groups[0]["with"] == [
+        "workers = 8", "concurrency = 4", "batch rows = 1000", "prefetch rows = 1000",
+        "multiple readers per thread", f"rows per range = {pgloader.rows_per_range}",
+    ]
+    # the default group takes the small tables and every table the stats don't know about
+    assert groups[-1]["with"] == ["workers = 8", "concurrency = 1", "batch rows = 100000", "prefetch rows = 100000"]
+    assert groups[-1]["bytes"] == 500
+
+
+def test_load_groups_without_stats():
+    assert pgloader.load_groups({}, cpus=2) == [{
+        "tables": None, "with": ["workers = 2", "concurrency = 1", "batch rows = 100000", "prefetch rows = 100000"], "bytes": 0,
+    }]
+
+
+def test_shard_tables_balances_bytes_largest_first():
+    shards = pgloader.shard_tables({
+        "contentlet": stats(1000, 900), "inode": stats(1000, 500), "identifier": stats(1000, 400), "company": stats(1, 100),
+    }, 2)
+    assert [sorted(shard) for shard in shards] == [["company", "contentlet"], ["identifier", "inode"]]
+
+
+def test_shard_tables_drops_empty_shards():
+    assert list(pgloader.shard_tables({"inode": stats(10, 10)}, 4)) == [{"inode": stats(10, 10)}]
+    assert pgloader.shard_tables({}, 4) == [{}]
+
+
+def test_shard_groups_last_shard_catches_the_rest():
+    plan = pgloader.shard_groups({"contentlet": stats(1000, 900), "inode": stats(1000, 500)}, 2, cpus=8)
+    assert [(shard["shard"], shard["bytes"], shard["excluded"]) for shard in plan] == [
+        (1, 900000, []), (2, 500000, ["contentlet"]),
+    ]
+    assert plan[0]["groups"][0]["tables"] == ["contentlet"]
+    assert plan[0]["groups"][0]["with"][0] == "workers = 4"
+    assert [group["tables"] for group in plan[1]["groups"]] == [None]
+
+
+def summary(header, *sections, total):
+    """ a pgloader summary table, cells right aligned to the dashes like pgloader prints them """
+    widths = [max(len(cell) for cell in column) for column in zip(header, total, *(row for rows in sections for row in rows))]
+    line = lambda cells: "  ".join(cell.rjust(width) for cell, width in zip(cells, widths))
+    separator = "  ".join("-" * width for width in widths)
+    lines = [line(header), separator]
+    for rows in sections:
+        lines += [line(row) for row in rows] + [separator]
+    return "\n".join(lines + [line(total)]) + "\n"
+
+
+old_summary = summary(
+    ["table name", "errors", "rows", "bytes", "total time"],
+    [["fetch meta data", "0", "185", "", "0.123s"], ["Create Schemas", "0", "0", "", "0.001s"]],
+    [['"dotcms"."inode"', "0", "15000", "1.5 MB", "0.500s"], ['"dotcms"."contentlet"', "0", "3000", "12.0 MB", "2m3.000s"]],
+    [["Create Indexes", "0", "42", "", "1.250s"]],
+    total=["Total import time", "✓", "18000", "13.5 MB", "2m4.874s"],
+)
+
+new_summary = summary(
+    ["table name", "errors", "read", "imported", "bytes", "total time", "read", "write"],
+    [["fetch meta data", "0", "185", "185", "", "0.123s", "", ""]],
+    [['"dotcms"."inode"', "0", "15000", "15000", "1.5 MB", "0.500s", "0.250s", "0.400s"],
+     ['"dotcms"."contentlet"', "2", "3000", "2998", "12.0 MB", "1h2m0.000s", "30.000s", "1m0.000s"]],
+    total=["Total import time", "2", "18000", "17998", "13.5 MB", "1h2m0.623s", "", ""],
+)
+
+log_prefix = "2023-04-12T10:36:24.075000Z LOG pgloader version \"3.6.7\"\n"
+
+
+def test_parse_summary_with_a_rows_column():
+    parsed = pgloader.parse_summary(log_prefix + old_summary)
+    assert parsed["tables"]["inode"] == {
+        "errors": 0, "rows_read": 15000, "rows_imported": 15000, "bytes": int(1.5 * 1024 ** 2), "seconds": 0.5,
+        "rows_per_second": 30000.0, "mb_per_second": 3.0,
+    }
+    assert parsed["tables"]["contentlet"]["seconds"] == 123.0
+    assert parsed["steps"]["fetch meta data"]["rows_read"] == 185
+    assert parsed["steps"]["Create Indexes"]["seconds"] == 1.25
+    assert parsed["seconds"] == 124.874
+
+
+def test_parse_summary_with_read_and_imported_columns():
+    parsed = pgloader.parse_summary(log_prefix + new_summary)
+    contentlet = parsed["tables"]["contentlet"]
+    assert (contentlet["errors"], contentlet["rows_read"], contentlet["rows_imported"]) == (2, 3000, 2998)
+    assert (contentlet["seconds"], contentlet["read_seconds"], contentlet["write_seconds"]) == (3720.0, 30.0, 60.0)
+    assert parsed["tables"]["inode"]["read_seconds"] == 0.25
+    assert parsed["seconds"] == 3720.623
+
+
+def test_parse_summary_adds_up_several_summaries():
+    parsed = pgloader.parse_summary(old_summary + "\n" + old_summary)
+    assert parsed["tables"]["inode"]["rows_imported"] == 30000
+    assert parsed["seconds"] == 2 * 124.874
+
+
+def test_parse_summary_of_empty_or_garbled_output():
+    empty = {"tables": {}, "steps": {}, "seconds": 0.0}
+    assert pgloader.parse_summary("") == empty
+    assert pgloader.parse_summary(log_prefix + "KABOOM\nAn unhandled error condition has been signalled\n") == empty
+    # dashes without a header line are not a summary
+    assert pgloader.parse_summary("------  ------\n\"dotcms\".\"inode\"  0\n") == empty
+
+
+def test_parse_summary_stops_at_a_truncated_table():
+    truncated = old_summary.split("Create Indexes")[0].rsplit("\n", 1)[0] + "\n" + log_prefix
+    parsed = pgloader.parse_summary(truncated)
+    assert set(parsed["tables"]) == {"inode", "contentlet"}
+    assert parsed["seconds"] == 0.0
+
+
+def test_copy_report_of_a_clean_copy():
+    report = pgloader.copy_report(log_prefix + old_summary, {"inode": 15000, "contentlet": 3000})
+    assert report["errors"] == []
+    assert report["warnings"] == []
+    assert report["slowest"] == ["contentlet", "inode"]
+
+
+def test_copy_report_errors_for_errors_and_rows_not_imported():
+    report = pgloader.copy_report(new_summary)
+    assert report["errors"] == ["contentlet: 2 errors", "contentlet: 2,998 of 3,000 rows imported"]
+
+
+def test_copy_report_warns_about_tables_not_copied():
+    report = pgloader.copy_report(old_summary, {"inode": 15000, "Dropped_Table": 10, "empty_table": 0})
+    assert report["errors"] == []
+    assert report["warnings"] == ["Dropped_Table: 10 rows in the dump, none copied"]
+
+
+def test_copy_report_errors_without_a_summary():
+    report = pgloader.copy_report(log_prefix, {"inode": 15000})
+    assert report["errors"] == [f"no table summary in the pgloader output, see {pgloader.log_file_name}"]
+    # without a summary nothing is known about the tables
+    assert report["warnings"] == []
+
+
+def test_copy_report_errors_for_error_lines():
+    error = "2023-04-12T10:36:25.000000Z ERROR Database error 22P02: invalid input syntax for type boolean"
+    report = pgloader.copy_report(log_prefix + error + "\n" + error + "\n" + old_summary)
+    assert report["log_errors"] == [error]
+    assert report["errors"] == [f"1 ERROR or FATAL lines in the pgloader output, see {pgloader.log_file_name}"]
@@ -0,0 +1,104 @@
+import gzip
+import os
+import sys
+from time import perf_counter
+
+import pytest
+
+import readiness
+
+gigabyte = readiness.gigabyte
+
+
+def test_deadline_has_a_minimum():
+    assert readiness.deadline("mysql_load", 0) == 600
+    assert readiness.deadline("mysql_start", 100 * gigabyte) == 300
+
+
+def test_deadline_scales_with_the_dump_size():
+    assert readiness.deadline("mysql_load", 10 * gigabyte) == 9000
+    assert readiness.deadline("pgloader", 10 * gigabyte, factor=1.5) == 13500
+
+
+def test_dump_size_of_a_plain_dump(tmp_path):
+    path = tmp_path / "dump.sql"
+    path.write_bytes(b"x" * 1000)
+    assert readiness.dump_size(path) == 1000
+
+
+def test_dump_size_of_a_gzipped_dump_from_its_trailer(tmp_path):
+    content = b"INSERT INTO `t` VALUES (1);\n" * 10000
+    path = tmp_path / "dump.sql.gz"
+    path.write_bytes(gzip.compress(content))
+    assert readiness.dump_size(path) == len(content)
+
+
+def test_dump_size_of_a_gzipped_dump_is_at_least_four_times_the_file(tmp_path):
+    # the trailer holds the size modulo 4G
+    path = tmp_path / "dump.sql.gz"
+    path.write_bytes(gzip.compress(os.urandom(1000)))
+    assert readiness.dump_size(path) == 4 * path.stat().st_size
+
+
+def test_wait_for_returns_the_probe_result_without_waiting():
+    started = perf_counter()
+    assert readiness.wait_for("ready", lambda: "up", timeout=60, first_interval=10) == "up"
+    assert perf_counter() - started < 1
+
+
+def test_wait_for_wakes_up_on_a_log_line():
+    results = iter([None, "up"])
+    started = perf_counter()
+    assert readiness.wait_for(
+        "ready", lambda: next(results), timeout=60,
+        log_command=[sys.executable, "-c", "print('database system is ready to accept connections')"],
+        log_pattern=readiness.postgres_ready_log,
+        first_interval=30,
+    ) == "up"
+    # the first interval is 30s, the log line ended it
+    assert perf_counter() - started < 10
+
+
+class Clock:
+    """ monotonic() and sleep() for readiness, sleeping moves the clock """
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(readiness, "monotonic", clock.monotonic)
+    monkeypatch.setattr(readiness, "sleep", clock.sleep)
+    return clock
+
+
+def test_wait_for_backs_off_between_probes(clock):
+    results = iter([None, None, None, None, "up"])
+    assert readiness.wait_for("ready", lambda: next(results), timeout=60, first_interval=0.05, max_interval=0.3) == "up"
+    assert clock.sleeps == [0.05, 0.1, 0.2, 0.3]
+
+
+def test_wait_for_counts_probe_errors_as_not_ready(clock):
+    def probe():
+        if clock.now < 1:
+            raise ConnectionRefusedError("refused")
+        return "up"
+    assert readiness.wait_for("ready", probe, timeout=60, first_interval=0.5) == "up"
+    assert clock.sleeps == [0.5, 1.0]
+
+
+def test_wait_for_times_out_with_the_last_error(clock):
+    def probe():
+        raise ConnectionRefusedError("refused")
+    with pytest.raises(TimeoutError, match="not ready after 1s, last error: refused"):
+        readiness.wait_for("ready", probe, timeout=1, first_interval=0.4)
+    assert clock.sleeps == pytest.approx([0.4, 0.6])
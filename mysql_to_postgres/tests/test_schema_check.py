@@ -0,0 +1,138 @@
+import gzip
+
+import schema_check
+
+reference_dump = """--
+-- PostgreSQL database dump
+--
+
+CREATE TABLE public.contentlet (
+    inode character varying(36) NOT NULL,
+    "language_id" bigint,
+    mod_date timestamp without time zone DEFAULT now() NOT NULL,
+    title character varying(255) COLLATE pg_catalog."default",
+    CONSTRAINT contentlet_check CHECK ((language_id > 0))
+);
+
+CREATE TABLE public.qrtz_locks (
+    lock_name character varying(40) NOT NULL
+);
+
+CREATE SEQUENCE public.trackback_id_seq
+    START WITH 1
+    INCREMENT BY 1;
+
+CREATE SEQUENCE public.content_rating_sequence
+    START WITH 1;
+
+COPY public.qrtz_locks (lock_name) FROM stdin;
+trigger_access
+job_access
+\\.
+
+COPY public.contentlet (inode, language_id, mod_date, title) FROM stdin;
+not_a_lock
+\\.
+
+ALTER TABLE ONLY public.contentlet
+    ADD CONSTRAINT contentlet_pkey PRIMARY KEY (inode);
+
+ALTER TABLE ONLY public.qrtz_locks
+    ADD CONSTRAINT qrtz_locks_pkey PRIMARY KEY (lock_name);
+"""
+
+
+def reference(tmp_path, gzipped=False):
+    path = tmp_path / ("reference.sql.gz" if gzipped else "reference.sql")
+    path.write_bytes(gzip.compress(reference_dump.encode()) if gzipped else reference_dump.encode())
+    return schema_check.reference_schema(path)
+
+
+def test_reference_schema_tables_and_types(tmp_path):
+    expected = reference(tmp_path)
+    assert expected["tables"] == {
+        "contentlet": {
+            "inode": "character varying(36)",
+            "language_id": "bigint",
+            "mod_date": "timestamp without time zone",
+            "title": "character varying(255)",
+        },
+        "qrtz_locks": {"lock_name": "character varying(40)"},
+    }
+
+
+def test_reference_schema_keys_sequences_and_locks(tmp_path):
+    expected = reference(tmp_path)
+    assert expected["primary_keys"] == {"contentlet": "contentlet_pkey", "qrtz_locks": "qrtz_locks_pkey"}
+    # renamed like postgres_post_import renames them
+    assert expected["sequences"] == {"trackback_sequence", "content_rating_sequence"}
+    assert expected["quartz_locks"] == {"qrtz_locks": {"TRIGGER_ACCESS", "JOB_ACCESS"}}
+
+
+def test_reference_schema_reads_gzipped_dumps(tmp_path):
+    assert reference(tmp_path, gzipped=True) == reference(tmp_path)
+
+
+def converted_like(expected):
+    return {
+        "tables": {table: dict(columns) for table, columns in expected["tables"].items()},
+        "primary_keys": dict(expected["primary_keys"]),
+        "sequences": set(expected["sequences"]),
+        "quartz_locks": {table: set(locks) for table, locks in expected["quartz_locks"].items()},
+    }
+
+
+def test_diff_of_a_matching_schema_is_empty(tmp_path):
+    expected = reference(tmp_path)
+    assert schema_check.diff(expected, converted_like(expected)) == []
+
+
+def test_diff_errors(tmp_path):
+    expected = reference(tmp_path)
+    converted = converted_like(expected)
+    del converted["tables"]["contentlet"]["title"]
+    converted["tables"]["contentlet"]["inode"] = "character(36)"
+    converted["primary_keys"]["contentlet"] = "pk_contentlet"
+    del converted["primary_keys"]["qrtz_locks"]
+    converted["sequences"].remove("trackback_sequence")
+    converted["quartz_locks"]["qrtz_locks"] = {"JOB_ACCESS"}
+    problems = schema_check.diff(expected, converted)
+    assert problems == [
+        ("error", "contentlet.inode", "type character(36), expected character varying(36)"),
+        ("error", "contentlet.title", "column missing"),
+        ("error", "contentlet", "primary key pk_contentlet, expected contentlet_pkey"),
+        ("error", "qrtz_locks", "primary key missing, expected qrtz_locks_pkey"),
+        ("error", "trackback_sequence", "sequence missing"),
+        ("error", "qrtz_locks", "quartz lock rows missing: TRIGGER_ACCESS"),
+    ]
+    assert schema_check.errors(problems) == problems
+
+
+def test_diff_missing_table_skips_its_primary_key(tmp_path):
+    expected = reference(tmp_path)
+    converted = converted_like(expected)
+    del converted["tables"]["contentlet"]
+    del converted["primary_keys"]["contentlet"]
+    assert schema_check.diff(expected, converted) == [("error", "contentlet", "table missing")]
+
+
+def test_diff_extras_are_warnings(tmp_path):
+    expected = reference(tmp_path)
+    converted = converted_like(expected)
+    converted["tables"]["contentlet"]["plugin_field"] = "text"
+    converted["tables"]["plugin_table"] = {"id": "bigint"}
+    converted["sequences"].add("plugin_seq")
+    problems = schema_check.diff(expected, converted)
+    assert problems == [
+        ("warning", "contentlet.plugin_field", "extra column"),
+        ("warning", "plugin_table", "extra table"),
+        ("warning", "plugin_seq", "extra sequence"),
+    ]
+    assert schema_check.errors(problems) == []
+
+
+def test_default_reference_parses():
+    expected = schema_check.reference_schema()
+    assert expected["tables"]["contentlet"]["inode"] == "character varying(36)"
+    assert expected["primary_keys"]["contentlet"] == "contentlet_pkey"
+    assert "qrtz_locks" in expected["quartz_locks"]
@@ -0,0 +1,81 @@
+import pytest
+
+import session as migration_session
+
+
+class Cursor:
+    def __init__(self, cnx):
+        self.cnx = cnx
+        self.rowcount = -1
+
+    def execute(self, query, params=None):
+        if self.cnx.fail and self.cnx.fail in query:
+            raise RuntimeError(f"failed: {query}")
+        self.cnx.executed.append(query)
+        self.rowcount = query.count("DELETE")
+
+    def close(self):
+        pass
+
+
+class Connection:
+    """ a postgres connection that records the queries it was sent and its commits """
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.executed = []
+        self.commits = 0
+        self.closed = 0
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+def migration(monkeypatch, cnx):
+    session = migration_session.MigrationSession(username="dotcms", password="dotcms")
+    monkeypatch.setattr(session, "_connect", lambda kind: cnx)
+    return session
+
+
+def test_execute_batch_sends_pages_in_one_transaction(monkeypatch):
+    cnx = Connection()
+    session = migration(monkeypatch, cnx)
+    queries = [f"DELETE FROM t{i};" for i in range(5)]
+    assert session.execute_batch("postgres", queries, page_size=2) == 5
+    assert cnx.executed == ["DELETE FROM t0;\nDELETE FROM t1;", "DELETE FROM t2;\nDELETE FROM t3;", "DELETE FROM t4;"]
+    assert cnx.commits == 1
+    assert session.statements[0]["statement"] == "5 statements: DELETE FROM t0;"
+    assert session.statements[0]["rows"] == 5
+
+
+def test_execute_batch_runs_mysql_statements_in_order(monkeypatch):
+    cnx = Connection()
+    session = migration(monkeypatch, cnx)
+    queries = ["SET FOREIGN_KEY_CHECKS=0;", "TRUNCATE TABLE `clickstream`;", "SET FOREIGN_KEY_CHECKS=1;"]
+    assert session.execute_batch("mysql", queries) == 3
+    assert cnx.executed == queries
+
+
+def test_execute_batch_closes_the_connection_on_failure(monkeypatch):
+    cnx = Connection(fail="TRUNCATE")
+    session = migration(monkeypatch, cnx)
+    with pytest.raises(RuntimeError):
+        session.execute_batch("mysql", ["SET FOREIGN_KEY_CHECKS=0;", "TRUNCATE TABLE `clickstream`;"])
+    # SET FOREIGN_KEY_CHECKS=0 doesn't go back to the pool
+    assert cnx.closed
+    assert session._pools["mysql"].empty()
+
+
+def test_execute_batch_without_statements(monkeypatch):
+    cnx = Connection()
+    session = migration(monkeypatch, cnx)
+    assert session.execute_batch("postgres", []) == 0
+    assert cnx.executed == [] and session.statements == []
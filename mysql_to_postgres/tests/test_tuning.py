@@ -0,0 +1,57 @@
+import tuning
+
+gigabyte = tuning.gigabyte
+
+
+def test_safe_profile_keeps_the_default_settings():
+    assert tuning.postgres_settings("safe", 64 * gigabyte, 16) == {"max_connections": "400", "shared_buffers": "128MB"}
+    assert tuning.mysql_settings("safe", 64 * gigabyte, 16) == {"lower_case_table_names": "1", "max_allowed_packet": "32M"}
+
+
+def test_bulk_profile_turns_durability_off():
+    postgres = tuning.postgres_settings("bulk", 16 * gigabyte, 4)
+    assert (postgres["fsync"], postgres["synchronous_commit"], postgres["full_page_writes"]) == ("off", "off", "off")
+    assert (postgres["wal_level"], postgres["max_wal_senders"]) == ("minimal", "0")
+    mysql = tuning.mysql_settings("bulk", 16 * gigabyte, 4)
+    assert (mysql["innodb_flush_log_at_trx_commit"], mysql["innodb_doublewrite"], mysql["sync_binlog"]) == ("0", "0", "0")
+    # the safe settings stay
+    assert postgres["max_connections"] == "400" and mysql["lower_case_table_names"] == "1"
+
+
+def test_bulk_profile_sized_to_the_host():
+    postgres = tuning.postgres_settings("bulk", 16 * gigabyte, 4)
+    assert (postgres["shared_buffers"], postgres["maintenance_work_mem"], postgres["max_wal_size"]) == ("2048MB", "1024MB", "4096MB")
+    assert postgres["max_parallel_maintenance_workers"] == "2"
+    mysql = tuning.mysql_settings("bulk", 16 * gigabyte, 4)
+    assert (mysql["innodb_buffer_pool_size"], mysql["innodb_buffer_pool_instances"], mysql["innodb_write_io_threads"]) == ("4096MB", "4", "4")
+
+
+def test_bulk_profile_caps_on_big_hosts_and_floors_on_small_ones():
+    big = tuning.postgres_settings("bulk", 512 * gigabyte, 96)
+    assert (big["shared_buffers"], big["maintenance_work_mem"], big["max_wal_size"]) == ("8192MB", "2048MB", "16384MB")
+    assert big["max_parallel_maintenance_workers"] == "8"
+    assert tuning.mysql_settings("bulk", 512 * gigabyte, 96)["innodb_buffer_pool_size"] == "16384MB"
+    small = tuning.postgres_settings("bulk", gigabyte, 1)
+    assert (small["maintenance_work_mem"], small["max_wal_size"], small["max_parallel_maintenance_workers"]) == ("64MB", "1024MB", "1")
+
+
+def test_commands():
+    assert tuning.postgres_command("safe") == "postgres -c 'max_connections=400' -c 'shared_buffers=128MB'"
+    assert tuning.mysql_command("safe") == "--lower_case_table_names=1 --max_allowed_packet=32M"
+    assert "-c 'fsync=off'" in tuning.postgres_command("bulk", 8 * gigabyte, 2)
+
+
+def test_memory_limits_above_the_bulk_settings():
+    limits = tuning.memory_limits(16 * gigabyte)
+    assert limits["mysql"] == 5 * gigabyte
+    assert limits["postgres"] == 7 * gigabyte
+    assert limits["pgloader"] == 4 * gigabyte
+    assert (limits["opensearch"], limits["dotcms"]) == (gigabyte, 2 * gigabyte)
+    assert tuning.compose_size(limits["mysql"]) == "5120m"
+
+
+def test_budget_replaces_the_host(monkeypatch):
+    monkeypatch.setattr(tuning, "budget", (8 * gigabyte, 2))
+    assert tuning.host_resources() == (8 * gigabyte, 2)
+    assert tuning.postgres_settings("bulk")["shared_buffers"] == "1024MB"
+    assert tuning.memory_limits()["pgloader"] == 2 * gigabyte
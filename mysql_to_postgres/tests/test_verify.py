@@ -0,0 +1,111 @@
+import verify
+
+contentlet = {
+    "columns": [("id", "bigint"), ("title", "varchar"), ("live", "tinyint"), ("mod_date", "datetime")],
+    "primary_key": ["id"],
+}
+contentlet_postgres = {"id": "bigint", "title": "character varying", "live": "boolean", "mod_date": "timestamp with time zone"}
+
+
+def test_column_sql_booleans():
+    assert verify.column_sql("live", "tinyint", "boolean") == (
+        "IF(`live` IS NULL, NULL, IF(`live` <> 0, '1', '0'))",
+        """CASE WHEN "live" THEN '1' WHEN NOT "live" THEN '0' END""",
+    )
+
+
+def test_column_sql_dates_in_utc_with_zero_dates_as_null():
+    mysql, postgres = verify.column_sql("mod_date", "datetime", "timestamp with time zone")
+    assert mysql == "NULLIF(DATE_FORMAT(`mod_date`, '%Y-%m-%d %H:%i:%s'), '0000-00-00 00:00:00')"
+    assert postgres == """to_char("mod_date" AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"""
+    assert verify.column_sql("d", "datetime", "timestamp without time zone")[1] == """to_char("d", 'YYYY-MM-DD HH24:MI:SS')"""
+
+
+def test_column_sql_binary_floats_and_text():
+    assert verify.column_sql("data", "blob", "bytea") == ("LOWER(HEX(`data`))", """encode("data", 'hex')""")
+    assert verify.column_sql("score", "double", "double precision") == (
+        "CAST(`score` AS DECIMAL(38,3))", '"score"::numeric(38,3)::text',
+    )
+    assert verify.column_sql("title", "varchar", "text") == ("CAST(`title` AS CHAR)", '"title"::text')
+
+
+def test_table_plan_chunks_integer_keys_by_range():
+    plan = verify.table_plan("dotcms", "contentlet", contentlet, contentlet_postgres, 250000, (1, 300000))
+    # 3 chunks of 100000 keys
+    assert plan["mysql"].startswith("SELECT FLOOR((`id` - 1) / 100000) AS chunk, COUNT(*), SUM(")
+    assert plan["mysql"].endswith("FROM `contentlet` GROUP BY chunk")
+    assert plan["postgres"].startswith('SELECT floor(("id" - 1) / 100000::numeric)::bigint AS chunk, count(*), sum(')
+    assert plan["postgres"].endswith('FROM "dotcms"."contentlet" GROUP BY chunk')
+    assert [plan["describe"](chunk) for chunk in range(3)] == ["id 1..100000", "id 100001..200000", "id 200001..300000"]
+
+
+def test_table_plan_buckets_other_keys_by_hash():
+    table = {"columns": [("inode", "varchar"), ("type", "varchar")], "primary_key": ["inode"]}
+    plan = verify.table_plan("dotcms", "inode", table, {"inode": "character varying", "type": "character varying"}, 150000, (None, None))
+    assert "CONV(SUBSTRING(MD5(CONCAT_WS('|', COALESCE(CAST(`inode` AS CHAR), ''))), 1, 4), 16, 10) % 2 AS chunk" in plan["mysql"]
+    assert """('x' || substr(md5(COALESCE("inode"::text, '')), 1, 4))::bit(16)::int % 2 AS chunk""" in plan["postgres"]
+    assert plan["describe"](1) == "md5(inode) bucket 1 of 2"
+
+
+def test_table_plan_without_primary_key_or_rows():
+    table = {"columns": [("name", "varchar")], "primary_key": []}
+    plan = verify.table_plan("dotcms", "t", table, {"name": "text"}, 0, (None, None))
+    assert "% 1 AS chunk" in plan["mysql"]
+    assert plan["describe"](0) == "md5(all columns) bucket 0 of 1"
+
+
+def test_table_plan_leaves_out_columns_missing_in_postgres():
+    plan = verify.table_plan("dotcms", "contentlet", contentlet, {"id": "bigint", "title": "text"}, 10, (1, 10))
+    assert plan["columns"] == ["id", "title"]
+    assert "live" not in plan["mysql"] and "live" not in plan["postgres"]
+
+
+class Session:
+    """ answers the row count and key range query of verify_table """
+    def __init__(self, count, low, high):
+        self.row = (count, low, high)
+
+    def execute(self, kind, query, params=None, fetch=False):
+        assert kind == "mysql" and query.startswith("SELECT COUNT(*), MIN(`id`), MAX(`id`) FROM `contentlet`")
+        return [self.row]
+
+
+def verify_contentlet(monkeypatch, mysql_chunks, postgres_chunks, postgres_columns=contentlet_postgres):
+    chunks = {"mysql": mysql_chunks, "postgres": postgres_chunks}
+    monkeypatch.setattr(verify, "_chunks", lambda session, kind, query: chunks[kind])
+    return verify.verify_table(Session(250000, 1, 300000), "dotcms", "contentlet", contentlet, postgres_columns)
+
+
+def test_verify_table_matching_checksums(monkeypatch):
+    chunks = {0: (100000, 11), 1: (100000, 22), 2: (50000, 33)}
+    result = verify_contentlet(monkeypatch, chunks, dict(chunks))
+    assert (result["mysql_rows"], result["postgres_rows"], result["chunks"]) == (250000, 250000, 3)
+    assert result["mismatched_chunks"] == [] and result["columns_missing"] == []
+    assert not verify.failed(result) and not verify.rows_differ(result)
+
+
+def test_verify_table_reports_mismatched_chunks_as_key_ranges(monkeypatch):
+    mysql_chunks = {0: (100000, 11), 1: (100000, 22), 2: (50000, 33)}
+    # same rows, one changed value in chunk 1; chunk 2 is missing
+    postgres_chunks = {0: (100000, 11), 1: (100000, 23)}
+    result = verify_contentlet(monkeypatch, mysql_chunks, postgres_chunks)
+    assert result["mismatched_chunks"] == ["id 100001..200000", "id 200001..300000"]
+    assert (result["mysql_rows"], result["postgres_rows"]) == (250000, 200000)
+    assert verify.failed(result) and verify.rows_differ(result)
+
+
+def test_verify_table_same_rows_different_content(monkeypatch):
+    result = verify_contentlet(monkeypatch, {0: (10, 1)}, {0: (10, 2)})
+    assert verify.failed(result) and not verify.rows_differ(result)
+
+
+def test_verify_table_missing_columns_fail(monkeypatch):
+    postgres_columns = {column: data_type for column, data_type in contentlet_postgres.items() if column != "live"}
+    result = verify_contentlet(monkeypatch, {0: (10, 1)}, {0: (10, 1)}, postgres_columns)
+    assert result["columns_missing"] == ["live"]
+    assert verify.failed(result)
+
+
+def test_failed_on_errors():
+    assert verify.failed({"error": "missing in postgres"})
+    assert verify.rows_differ({"error": "missing in postgres"})